@@ -1,18 +1,36 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
 from passlib.context import CryptContext
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.metrics import PASSWORD_HASH_QUEUE, PASSWORD_HASH_SECONDS
+from app.config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_MINUTES,
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+# bcrypt учитывает только первые 72 байта пароля
+BCRYPT_MAX_BYTES = 72
+
+def _bcrypt_secret(password: str) -> bytes:
+    """Пароль обрезается по байтам UTF-8 одинаково при хэшировании и проверке"""
+    return password.encode("utf-8")[:BCRYPT_MAX_BYTES]
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context.verify(_bcrypt_secret(plain_password), hashed_password)
 
 def get_password_hash(password: str) -> str:
-    if len(password.encode('utf-8')) > 72:
-        password = password[:50]
-    return pwd_context.hash(password)
+    return pwd_context.hash(_bcrypt_secret(password))
 
 def authenticate_user(db, username: str, password: str):
     from app.models.db_models import User
@@ -21,6 +39,76 @@ def authenticate_user(db, username: str, password: str):
         return None
     return user
 
+class PasswordHashPoolBusy(RuntimeError):
+    """Очередь на bcrypt заполнена: вход нужно повторить позже"""
+
+class PasswordHashPool:
+    """
+    Пул потоков для bcrypt. Хэширование занимает сотни миллисекунд CPU,
+    поэтому выполняется вне цикла событий и не больше чем в workers потоках
+    (bcrypt отпускает GIL). Когда задач в работе и в очереди больше
+    max_pending, новые сразу отклоняются PasswordHashPoolBusy - массовый
+    вход в начале урока не занимает сервер целиком.
+    """
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+    
+    def _timed(self, operation: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+    
+    async def run(self, operation: str, func, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHashPoolBusy(f"В очереди bcrypt {self._pending} задач")
+            self._pending += 1
+            PASSWORD_HASH_QUEUE.set(self._pending)
+        
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), self._timed, operation, func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                PASSWORD_HASH_QUEUE.set(self._pending)
+    
+    @property
+    def pending(self) -> int:
+        return self._pending
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+password_pool = PasswordHashPool()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_pool.run("hash", get_password_hash, password)
+
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    from app.models.db_models import User
+    user = await db.scalar(select(User).where(User.username == username))
+    if not user or not await verify_password_async(password, user.password_hash):
+        return None
+    return user
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -30,4 +118,18 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+def create_refresh_token(username: str, expires_delta: Optional[timedelta] = None) -> str:
+    """
+    Токен для /api/auth/refresh: выдает новые access-токены без пароля и
+    bcrypt до истечения срока. Срок не продлевается, после него нужен вход.
+    Отдельного списка отозванных токенов нет: /refresh отказывает
+    деактивированному пользователю.
+    """
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES))
+    return jwt.encode(
+        {"sub": username, "type": REFRESH_TOKEN_TYPE, "exp": expire},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
\ No newline at end of file
@@ -19,6 +19,11 @@ if len(SECRET_KEY) < 32:
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_TOKEN_EXPIRE_MINUTES", "480"))
+
+# bcrypt выполняется в отдельном пуле; лишние входы получают 503
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
 
 DEFAULT_BKT_PARAMS = {
     "p_learn": float(os.getenv("DEFAULT_P_LEARN", "0.15")),
@@ -26,4 +31,50 @@ DEFAULT_BKT_PARAMS = {
     "p_slip": float(os.getenv("DEFAULT_P_SLIP", "0.10")),
     "p_init": float(os.getenv("DEFAULT_P_INIT", "0.20")),
     "forgetting_rate": float(os.getenv("FORGETTING_RATE", "0.01"))
-}
\ No newline at end of file
+}
+
+MASTERY_CACHE_SIZE = int(os.getenv("MASTERY_CACHE_SIZE", "16"))
+MASTERY_CACHE_TTL_SECONDS = float(os.getenv("MASTERY_CACHE_TTL_SECONDS", "300"))
+# Знаков после запятой у вероятностей в format=columnar
+MASTERY_COLUMNAR_PRECISION = int(os.getenv("MASTERY_COLUMNAR_PRECISION", "4"))
+
+# Потоки для расчетов BKT из асинхронных обработчиков
+BKT_CPU_WORKERS = int(os.getenv("BKT_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Процессы для пакетов BKT по шардам учеников; меньшие пакеты и BKT_SHARDS=1 - последовательно
+BKT_SHARDS = int(os.getenv("BKT_SHARDS", str(os.cpu_count() or 1)))
+BKT_PARALLEL_MIN_ATTEMPTS = int(os.getenv("BKT_PARALLEL_MIN_ATTEMPTS", "5000"))
+
+# Очередь обработки BKT после сохранения результатов (таблица bkt_jobs).
+# Задачи выполняет один поток в одном процессе (держатель аренды)
+BKT_JOB_WORKER_ENABLED = os.getenv("BKT_JOB_WORKER_ENABLED", "1") == "1"
+BKT_JOB_MAX_ATTEMPTS = int(os.getenv("BKT_JOB_MAX_ATTEMPTS", "3"))
+BKT_JOB_RETRY_DELAY_SECONDS = float(os.getenv("BKT_JOB_RETRY_DELAY_SECONDS", "5"))
+BKT_JOB_POLL_SECONDS = float(os.getenv("BKT_JOB_POLL_SECONDS", "2"))
+# Попытки задачи учитываются пачками: отметка и прогресс фиксируются после каждой
+BKT_JOB_CHUNK_SIZE = int(os.getenv("BKT_JOB_CHUNK_SIZE", "10000"))
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+
+SNAPSHOT_BUILDER_ENABLED = os.getenv("SNAPSHOT_BUILDER_ENABLED", "1") == "1"
+SNAPSHOT_BUILD_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_BUILD_INTERVAL_SECONDS", "3600"))
+SNAPSHOT_BACKFILL_DAYS = int(os.getenv("SNAPSHOT_BACKFILL_DAYS", "365"))
+
+KNOWLEDGE_MATRIX_ENABLED = os.getenv("KNOWLEDGE_MATRIX_ENABLED", "0") == "1"
+KNOWLEDGE_MATRIX_DIR = Path(os.getenv("KNOWLEDGE_MATRIX_DIR", str(BASE_DIR / "data" / "knowledge_matrix")))
+
+ATTEMPT_LOG_DIR = Path(os.getenv("ATTEMPT_LOG_DIR", str(BASE_DIR / "data" / "attempt_log")))
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Сжатие ответов (gzip, brotli при установленном пакете brotli) от порога в байтах
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_COMPRESSLEVEL = int(os.getenv("GZIP_COMPRESSLEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Режим разработки: бюджет SQL-запросов на HTTP-запрос и поиск N+1
+QUERY_GUARD_ENABLED = os.getenv("QUERY_GUARD_ENABLED", "0") == "1"
+QUERY_GUARD_RAISE = os.getenv("QUERY_GUARD_RAISE", "0") == "1"
+QUERY_GUARD_REPEAT_THRESHOLD = int(os.getenv("QUERY_GUARD_REPEAT_THRESHOLD", "10"))
\ No newline at end of file
@@ -1,54 +1,110 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-from app.database import get_db
+from app.auth import ACCESS_TOKEN_TYPE
+from app.database import get_async_db
 from app.models.db_models import User
+from app.services.auth_cache import Principal, auth_cache
 from app.config import SECRET_KEY, ALGORITHM
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
 
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+def resolve_token(request: Request, token: Optional[str] = None) -> Optional[str]:
+    """Токен из параметра token, заголовка Authorization или cookie access_token"""
+    if token:
+        return token
+    auth_header = request.headers.get("authorization", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header.replace("Bearer ", "")
+    return request.cookies.get("access_token")
+
+async def authenticate(access_token: Optional[str],
+                       db: AsyncSession,
+                       token_type: str = ACCESS_TOKEN_TYPE) -> Principal:
+    """
+    Пользователь по токену. Расшифровка и строка users берутся из
+    auth_cache, поэтому повторные запросы с тем же токеном не обращаются к БД.
+    Кэшируются только access-токены: refresh-токен проверяется каждый раз.
+    """
+    if not access_token:
+        raise _unauthorized("Not authenticated")
+    
+    username = auth_cache.get_token(access_token) if token_type == ACCESS_TOKEN_TYPE else None
+    if username is None:
+        try:
+            payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise _unauthorized("Invalid token")
+        
+        username = payload.get("sub")
+        # Токены до появления refresh не содержат type и считаются access
+        if not username or payload.get("type", ACCESS_TOKEN_TYPE) != token_type:
+            raise _unauthorized("Invalid token")
+        if token_type == ACCESS_TOKEN_TYPE:
+            auth_cache.store_token(access_token, username, payload.get("exp"))
+    
+    principal = auth_cache.get_user(username)
+    if principal is None:
+        user = await db.scalar(select(User).where(User.username == username))
+        if not user:
+            raise _unauthorized("User not found")
+        principal = Principal.from_user(user)
+        auth_cache.store_user(principal)
+    
+    return principal
+
 class AuthDeps:
     @staticmethod
     async def get_current_user(
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-    ) -> Optional[User]:
-        if not token:
-            return None
-        
+        request: Request,
+        token: Optional[str] = Query(None, include_in_schema=False),
+        bearer: Optional[str] = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+    ) -> Optional[Principal]:
+        """Пользователь или None: для страниц, которые перенаправляют на вход"""
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
-                return None
-        except JWTError:
+            principal = await authenticate(resolve_token(request, token), db)
+        except HTTPException:
             return None
-        
-        user = db.query(User).filter(User.username == username).first()
-        return user
+        return principal if principal.is_active else None
     
     @staticmethod
     async def get_current_active_user(
-        current_user: Optional[User] = Depends(get_current_user)
-    ) -> User:
-        if not current_user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Не авторизован"
-            )
+        request: Request,
+        token: Optional[str] = Query(None, include_in_schema=False),
+        bearer: Optional[str] = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+    ) -> Principal:
+        current_user = await authenticate(resolve_token(request, token), db)
         if not current_user.is_active:
             raise HTTPException(status_code=400, detail="Неактивный пользователь")
         return current_user
     
     @staticmethod
     async def require_teacher(
-        current_user: User = Depends(get_current_active_user)
-    ) -> User:
+        current_user: Principal = Depends(get_current_active_user)
+    ) -> Principal:
         if current_user.role not in ["teacher", "admin"]:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Требуются права учителя"
             )
-        return current_user
\ No newline at end of file
+        return current_user
+    
+    @staticmethod
+    async def require_admin(
+        current_user: Principal = Depends(get_current_active_user)
+    ) -> Principal:
+        if current_user.role != "admin":
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+        return current_user
@@ -1,18 +1,53 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from jose import JWTError, jwt
 
-from app.routers import auth, students, skills, tests
-from app.database import engine, get_db
+from app.routers import auth, students, skills, tests, admin
+from app.database import engine, async_engine
+from app.deps import AuthDeps, resolve_token
 from app.models import db_models
-from app.config import SECRET_KEY, ALGORITHM
+from app.config import SNAPSHOT_BUILDER_ENABLED, METRICS_ENABLED, QUERY_GUARD_ENABLED, COMPRESSION_ENABLED
+from app.services.mastery_snapshots import start_snapshot_scheduler, stop_snapshot_scheduler
+from app.services.bkt_engine import shutdown_shard_pool
+from app.services.bkt_engine_async import shutdown_cpu_executor
+from app.services.bkt_jobs import start_job_worker, stop_job_worker
+from app.auth import password_pool
+from app.services.metrics import MetricsMiddleware, instrument_engine, render_metrics
+from app.services.query_guard import QueryGuardMiddleware
+from app.services.compression import CompressionMiddleware
+from app.services.auth_cache import Principal
 from app.logger import logger
 
 db_models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="BKT Teacher Dashboard")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SNAPSHOT_BUILDER_ENABLED:
+        start_snapshot_scheduler()
+    start_job_worker()
+    yield
+    stop_snapshot_scheduler()
+    stop_job_worker()
+    shutdown_cpu_executor()
+    shutdown_shard_pool()
+    password_pool.shutdown()
+    await async_engine.dispose()
+
+app = FastAPI(title="BKT Teacher Dashboard", lifespan=lifespan)
+
+if METRICS_ENABLED:
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+    app.add_middleware(MetricsMiddleware)
+
+if QUERY_GUARD_ENABLED:
+    app.add_middleware(QueryGuardMiddleware)
+
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -21,6 +56,7 @@ app.include_router(auth.router, prefix="/api")
 app.include_router(students.router, prefix="")
 app.include_router(skills.router, prefix="")
 app.include_router(tests.router, prefix="")
+app.include_router(admin.router, prefix="")
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -28,45 +64,28 @@ async def root(request: Request):
     return templates.TemplateResponse("login_simple.html", {"request": request})
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, token: str = None):
-    if token:
-        access_token = token
-    else:
-        auth_header = request.headers.get("authorization", "")
-        if auth_header.startswith("Bearer "):
-            access_token = auth_header.replace("Bearer ", "")
-        else:
-            access_token = request.cookies.get("access_token")
-    
-    if not access_token:
+async def dashboard(
+    request: Request,
+    token: str = None,
+    user: Optional[Principal] = Depends(AuthDeps.get_current_user)
+):
+    if not user:
         return RedirectResponse(url="/")
     
-    try:
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/")
-            
-        db = next(get_db())
-        user = db.query(db_models.User).filter(db_models.User.username == username).first()
-        db.close()
-        
-        if not user:
-            return RedirectResponse(url="/")
-        
-        logger.info(f"Успешный вход: {username}")
-        
-        response = templates.TemplateResponse("dashboard_simple.html", {
-            "request": request,
-            "user": user
-        })
-        response.set_cookie(key="access_token", value=access_token)
-        return response
-        
-    except JWTError as e:
-        logger.error(f"Ошибка JWT: {e}")
-        return RedirectResponse(url="/")
+    logger.info(f"Успешный вход: {user.username}")
+    
+    response = templates.TemplateResponse("dashboard_simple.html", {
+        "request": request,
+        "user": user
+    })
+    response.set_cookie(key="access_token", value=resolve_token(request, token))
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    if not METRICS_ENABLED:
+        return PlainTextResponse("metrics disabled\n", status_code=404)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/logout")
 async def logout():
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text, UniqueConstraint, Index, LargeBinary
+from datetime import datetime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -64,6 +65,9 @@ class Test(Base):
     
     created_by_user = relationship("User", back_populates="tests")
     items = relationship("TestItem", back_populates="test", cascade="all, delete-orphan")
+    
+    # Список тестов: keyset-пагинация по (test_date, id)
+    __table_args__ = (Index('ix_tests_test_date_id', 'test_date', 'id'),)
 
 class TestItem(Base):
     __tablename__ = "test_items"
@@ -94,7 +98,10 @@ class StudentAttempt(Base):
     student = relationship("Student", back_populates="attempts")
     test_item = relationship("TestItem", back_populates="attempts")
     
-    __table_args__ = (UniqueConstraint('student_id', 'test_item_id', name='unique_student_attempt'),)
+    __table_args__ = (
+        UniqueConstraint('student_id', 'test_item_id', name='unique_student_attempt'),
+        Index('ix_student_attempts_test_item', 'test_item_id'),
+    )
 
 class StudentKnowledgeState(Base):
     __tablename__ = "student_knowledge_states"
@@ -122,4 +129,74 @@ class KnowledgeHistory(Base):
     recorded_at = Column(DateTime, server_default=func.now())
     
     student = relationship("Student", back_populates="knowledge_history")
-    skill = relationship("Skill", back_populates="knowledge_history")
\ No newline at end of file
+    skill = relationship("Skill", back_populates="knowledge_history")
+    
+    __table_args__ = (Index('ix_knowledge_history_student_skill_recorded', 'student_id', 'skill_id', 'recorded_at'),)
+
+class TestProcessingState(Base):
+    __tablename__ = "test_processing_states"
+    
+    test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), primary_key=True)
+    last_attempt_id = Column(Integer, nullable=False, default=0)
+    processed_attempts = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class BKTJob(Base):
+    """Задача очереди обработки BKT: одна на сохранение результатов теста"""
+    __tablename__ = "bkt_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    test_id = Column(Integer, ForeignKey("tests.id", ondelete="CASCADE"), nullable=False)
+    # queued -> running -> finished | failed; при ошибке снова queued до max_attempts
+    state = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    updated_count = Column(Integer)
+    # Попытки теста к обработке (при захвате) и учтенные из них
+    progress_total = Column(Integer)
+    progress_done = Column(Integer)
+    error = Column(Text)
+    worker = Column(String(50))
+    created_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    run_after = Column(DateTime, nullable=False, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index('ix_bkt_jobs_state_run_after', 'state', 'run_after'),
+        Index('ix_bkt_jobs_test_state', 'test_id', 'state'),
+    )
+
+
+class DataVersion(Base):
+    """Счетчик изменений таблицы для ETag списков и таблицы освоения"""
+    __tablename__ = "data_versions"
+    
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class MasterySnapshot(Base):
+    __tablename__ = "mastery_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    snapshot_date = Column(Date, nullable=False, index=True)
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), nullable=False)
+    skill_count = Column(Integer, nullable=False, default=0)
+    # Упакованный массив (skill_id int32, probability float32, last_updated int64 мкс)
+    states = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    
+    __table_args__ = (UniqueConstraint('snapshot_date', 'student_id', name='unique_snapshot_student'),)
+
+
+class Lease(Base):
+    """Аренда фоновой работы: выполняет один процесс из нескольких воркеров"""
+    __tablename__ = "leases"
+    
+    name = Column(String(50), primary_key=True)
+    owner = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
\ No newline at end of file
@@ -0,0 +1,59 @@
+import threading
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from typing import Optional
+from app.database import SessionLocal
+from app.deps import AuthDeps
+from app.services.auth_cache import Principal
+from app.services.knowledge_rebuild import KnowledgeRebuilder
+from app.logger import logger
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+_rebuild_lock = threading.Lock()
+_rebuild_status = {"state": "idle"}
+
+def _update_progress(stage: str, done: int, total: int):
+    _rebuild_status["progress"] = {"stage": stage, "done": done, "total": total}
+
+def _run_rebuild(dry_run: bool, workers: Optional[int]):
+    db = SessionLocal()
+    try:
+        rebuilder = KnowledgeRebuilder(db, workers=workers, progress=_update_progress)
+        report = rebuilder.run(dry_run=dry_run)
+        _rebuild_status.update({"state": "finished", "finished_at": datetime.now(), "report": report})
+    except Exception as e:
+        logger.error(f"Ошибка пересчета состояний знаний: {e}")
+        _rebuild_status.update({"state": "failed", "finished_at": datetime.now(), "error": str(e)})
+    finally:
+        db.close()
+        _rebuild_lock.release()
+
+@router.post("/api/rebuild-knowledge", status_code=202)
+def start_rebuild(
+    background_tasks: BackgroundTasks,
+    dry_run: bool = Query(True),
+    workers: Optional[int] = Query(None, ge=1, le=64),
+    current_user: Principal = Depends(AuthDeps.require_admin)
+):
+    if not _rebuild_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Пересчет уже выполняется")
+    
+    _rebuild_status.clear()
+    _rebuild_status.update({
+        "state": "running",
+        "dry_run": dry_run,
+        "started_by": current_user.username,
+        "started_at": datetime.now(),
+        "progress": None
+    })
+    background_tasks.add_task(_run_rebuild, dry_run, workers)
+    
+    logger.info(f"Запущен пересчет состояний знаний (dry_run={dry_run}): {current_user.username}")
+    return _rebuild_status
+
+@router.get("/api/rebuild-knowledge")
+def get_rebuild_status(
+    current_user: Principal = Depends(AuthDeps.require_admin)
+):
+    return _rebuild_status
\ No newline at end of file
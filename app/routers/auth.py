@@ -1,24 +1,45 @@
+import time
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from app import auth
-from app.database import get_db
-from app.schemas.pydantic_models import UserCreate, UserResponse, Token
+from app.database import get_async_db
+from app.schemas.pydantic_models import UserCreate, UserResponse, Token, RefreshRequest
 from app.models.db_models import User
 from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
-from app.deps import AuthDeps  # Импортируем из deps.py
+from app.deps import AuthDeps, authenticate  # Импортируем из deps.py
+from app.services.auth_cache import Principal
+from app.services.metrics import AUTH_LOGIN_SECONDS, AUTH_TOKEN_REFRESHES
 from app.logger import logger
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
+def _pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Слишком много одновременных входов, повторите через несколько секунд",
+        headers={"Retry-After": "1"}
+    )
+
+def _issue_access_token(username: str) -> str:
+    return auth.create_access_token(
+        data={"sub": username, "type": auth.ACCESS_TOKEN_TYPE},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(User).where(User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Имя пользователя уже занято")
     
-    hashed_password = auth.get_password_hash(user.password)
+    try:
+        hashed_password = await auth.get_password_hash_async(user.password)
+    except auth.PasswordHashPoolBusy:
+        raise _pool_busy()
+    
     db_user = User(
         username=user.username,
         password_hash=hashed_password,
@@ -26,31 +47,65 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         role=user.role
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     logger.info(f"Зарегистрирован новый пользователь: {user.username}")
     return db_user
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
-    if not user:
-        logger.warning(f"Неудачная попытка входа: {form_data.username}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неверное имя пользователя или пароль",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    started = time.perf_counter()
+    outcome = "failure"
+    try:
+        try:
+            user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
+        except auth.PasswordHashPoolBusy as e:
+            outcome = "busy"
+            logger.warning(f"Вход отклонен, пул bcrypt занят ({e}): {form_data.username}")
+            raise _pool_busy()
+        
+        if not user:
+            logger.warning(f"Неудачная попытка входа: {form_data.username}")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Неверное имя пользователя или пароль",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        
+        outcome = "success"
+        logger.info(f"Успешный вход: {user.username}")
+        return {
+            "access_token": _issue_access_token(user.username),
+            "token_type": "bearer",
+            "role": user.role,
+            "refresh_token": auth.create_refresh_token(user.username),
+            "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        }
+    finally:
+        AUTH_LOGIN_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    """Новый access-токен по refresh-токену, без пароля и bcrypt"""
+    try:
+        current_user = await authenticate(request.refresh_token, db, token_type=auth.REFRESH_TOKEN_TYPE)
+    except HTTPException:
+        AUTH_TOKEN_REFRESHES.inc(outcome="invalid")
+        raise
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    if not current_user.is_active:
+        AUTH_TOKEN_REFRESHES.inc(outcome="inactive")
+        raise HTTPException(status_code=400, detail="Неактивный пользователь")
     
-    logger.info(f"Успешный вход: {user.username}")
-    return {"access_token": access_token, "token_type": "bearer", "role": user.role}
+    AUTH_TOKEN_REFRESHES.inc(outcome="success")
+    return {
+        "access_token": _issue_access_token(current_user.username),
+        "token_type": "bearer",
+        "role": current_user.role,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
 
 @router.get("/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(AuthDeps.get_current_active_user)):  # Исправлено!
+def read_users_me(current_user: Principal = Depends(AuthDeps.get_current_active_user)):  # Исправлено!
     return current_user
\ No newline at end of file
@@ -1,15 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
-from app.models.db_models import Skill, User, TestItem
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from app.database import get_async_db
+from app.models.db_models import Skill, TestItem
 from app.schemas.pydantic_models import SkillCreate, SkillResponse
-from app.services.bkt_engine import BKTEngine
+from app.services.mastery_cache import bump_data_version_async
+from app.services.data_versions import (
+    SKILLS, data_validators, is_not_modified, not_modified_response, validator_headers
+)
+from app.services.auth_cache import Principal
+from app.services.query_guard import query_budget
+from app.deps import AuthDeps
 from app.logger import logger
-from jose import jwt
-from app.config import SECRET_KEY, ALGORITHM
 
 router = APIRouter(prefix="/skills", tags=["skills"])
 templates = Jinja2Templates(directory="app/templates")
@@ -17,33 +22,14 @@ templates = Jinja2Templates(directory="app/templates")
 @router.get("/", response_class=HTMLResponse)
 async def skills_page(
     request: Request,
-    token: str = None,
-    db: Session = Depends(get_db)
+    user: Optional[Principal] = Depends(AuthDeps.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    if not user:
+        return RedirectResponse(url="/")
+    
     try:
-        if token:
-            access_token = token
-        else:
-            auth_header = request.headers.get("authorization", "")
-            if auth_header.startswith("Bearer "):
-                access_token = auth_header.replace("Bearer ", "")
-            else:
-                access_token = request.cookies.get("access_token")
-        
-        if not access_token:
-            return RedirectResponse(url="/")
-        
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/")
-        
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return RedirectResponse(url="/")
-        
-        skills = db.query(Skill).filter_by(is_active=True).order_by(Skill.name).all()
+        skills = (await db.scalars(select(Skill).filter_by(is_active=True).order_by(Skill.name))).all()
         
         return templates.TemplateResponse(
             "skills_simple.html",
@@ -54,54 +40,40 @@ async def skills_page(
         return RedirectResponse(url="/dashboard")
 
 @router.get("/api", response_model=List[SkillResponse])
-def get_skills(
+@query_budget(5)
+async def get_skills(
     request: Request,
-    db: Session = Depends(get_db),
+    response: Response,
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
-    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
+        validators = await data_validators(db, [SKILLS], extra=f"{skip}:{limit}")
+        if is_not_modified(request, validators):
+            return not_modified_response(validators)
+        response.headers.update(validator_headers(validators))
         
-        skills = db.query(Skill).filter_by(is_active=True).order_by(Skill.name).offset(skip).limit(limit).all()
-        return skills
+        skills = await db.scalars(
+            select(Skill).filter_by(is_active=True).order_by(Skill.name).offset(skip).limit(limit)
+        )
+        return skills.all()
     except Exception as e:
         logger.error(f"Ошибка получения списка навыков: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при получении данных")
 
 @router.post("/api", response_model=SkillResponse)
-def create_skill(
+async def create_skill(
     skill: SkillCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot create skills")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot create skills")
-        
-        existing = db.query(Skill).filter(Skill.name == skill.name).first()
+        existing = await db.scalar(select(Skill).where(Skill.name == skill.name))
         if existing:
             raise HTTPException(status_code=400, detail="Навык с таким названием уже существует")
         
@@ -116,42 +88,30 @@ def create_skill(
             is_active=True
         )
         db.add(db_skill)
-        db.commit()
-        db.refresh(db_skill)
+        await db.commit()
+        await db.refresh(db_skill)
+        await bump_data_version_async(SKILLS)
         
         logger.info(f"Навык создан: {skill.name}")
         return db_skill
         
     except Exception as e:
         logger.error(f"Ошибка создания навыка: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при создании навыка")
 
 @router.put("/api/{skill_id}", response_model=SkillResponse)
-def update_skill(
+async def update_skill(
     skill_id: int,
     skill_update: SkillCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot update skills")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot update skills")
-        
-        skill = db.query(Skill).filter(Skill.id == skill_id).first()
+        skill = await db.get(Skill, skill_id)
         if not skill:
             raise HTTPException(status_code=404, detail="Навык не найден")
         
@@ -162,51 +122,40 @@ def update_skill(
         skill.p_slip = skill_update.p_slip
         skill.p_init = skill_update.p_init
         
-        db.commit()
-        db.refresh(skill)
+        await db.commit()
+        await db.refresh(skill)
+        await bump_data_version_async(SKILLS)
         
         logger.info(f"Навык обновлен: ID {skill_id}")
         return skill
         
     except Exception as e:
         logger.error(f"Ошибка обновления навыка {skill_id}: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при обновлении навыка")
 
 @router.delete("/api/{skill_id}")
-def delete_skill(
+async def delete_skill(
     skill_id: int,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot delete skills")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot delete skills")
-        
-        skill = db.query(Skill).filter(Skill.id == skill_id).first()
+        skill = await db.get(Skill, skill_id)
         if not skill:
             raise HTTPException(status_code=404, detail="Навык не найден")
         
         skill.is_active = False
-        db.commit()
+        await db.commit()
+        await bump_data_version_async(SKILLS)
         
         logger.info(f"Навык деактивирован: ID {skill_id}")
         return {"message": "Навык успешно деактивирован"}
         
     except Exception as e:
         logger.error(f"Ошибка удаления навыка {skill_id}: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при удалении навыка")
\ No newline at end of file
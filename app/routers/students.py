@@ -1,16 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Query
-from fastapi.responses import HTMLResponse, RedirectResponse
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.database import get_db
-from app.models.db_models import Student, User
+from datetime import datetime, date
+from app.database import get_db, get_async_db
+from app.models.db_models import Student
 from app.schemas.pydantic_models import StudentCreate, StudentResponse
-from app.services.bkt_engine import BKTEngine
+from app.services.mastery_cache import (
+    get_mastery_table_cached_async, get_mastery_columns_cached_async, bump_data_version_async
+)
+from app.services.data_versions import (
+    STUDENTS, MASTERY_TABLES, data_state, data_validators, state_validators,
+    is_not_modified, not_modified_response, validator_headers
+)
+from app.services.mastery_snapshots import MasterySnapshotBuilder
+from app.services.mastery_export import stream_mastery, EXPORT_FORMATS
+from app.services.mastery_formats import columnar_payload, binary_payload, BINARY_MEDIA_TYPE
 from app.deps import AuthDeps
+from app.services.auth_cache import Principal
+from app.services.query_guard import query_budget
+from app.services.json_response import ORJSONResponse
+from app.config import MASTERY_CACHE_TTL_SECONDS, MASTERY_COLUMNAR_PRECISION
 from app.logger import logger
-from jose import jwt
-from app.config import SECRET_KEY, ALGORITHM
 
 router = APIRouter(prefix="/students", tags=["students"])
 templates = Jinja2Templates(directory="app/templates")
@@ -18,33 +33,14 @@ templates = Jinja2Templates(directory="app/templates")
 @router.get("/", response_class=HTMLResponse)
 async def students_page(
     request: Request,
-    token: str = None,
-    db: Session = Depends(get_db)
+    user: Optional[Principal] = Depends(AuthDeps.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    if not user:
+        return RedirectResponse(url="/")
+    
     try:
-        if token:
-            access_token = token
-        else:
-            auth_header = request.headers.get("authorization", "")
-            if auth_header.startswith("Bearer "):
-                access_token = auth_header.replace("Bearer ", "")
-            else:
-                access_token = request.cookies.get("access_token")
-        
-        if not access_token:
-            return RedirectResponse(url="/")
-        
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/")
-        
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return RedirectResponse(url="/")
-        
-        students = db.query(Student).order_by(Student.name).all()
+        students = (await db.scalars(select(Student).order_by(Student.name))).all()
         
         return templates.TemplateResponse(
             "students_simple.html",
@@ -57,34 +53,15 @@ async def students_page(
 @router.get("/mastery", response_class=HTMLResponse)
 async def mastery_table_page(
     request: Request,
-    token: str = None,
-    db: Session = Depends(get_db)
+    as_of: Optional[datetime] = None,
+    user: Optional[Principal] = Depends(AuthDeps.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    if not user:
+        return RedirectResponse(url="/")
+    
     try:
-        if token:
-            access_token = token
-        else:
-            auth_header = request.headers.get("authorization", "")
-            if auth_header.startswith("Bearer "):
-                access_token = auth_header.replace("Bearer ", "")
-            else:
-                access_token = request.cookies.get("access_token")
-        
-        if not access_token:
-            return RedirectResponse(url="/")
-        
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/")
-        
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return RedirectResponse(url="/")
-        
-        bkt = BKTEngine(db)
-        students, skills, matrix = bkt.get_mastery_table()
+        students, skills, matrix = await get_mastery_table_cached_async(db, as_of)
         
         return templates.TemplateResponse(
             "mastery_simple.html",
@@ -93,141 +70,178 @@ async def mastery_table_page(
                 "students": students,
                 "skills": skills,
                 "matrix": matrix,
-                "user": user
+                "user": user,
+                "as_of": as_of
             }
         )
     except Exception as e:
         logger.error(f"Ошибка загрузки таблицы освоения: {e}")
         return RedirectResponse(url="/dashboard")
 
-@router.get("/api/mastery")
+@router.get("/api/mastery", response_class=ORJSONResponse)
+@query_budget(10)
 async def get_mastery_data(
     request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    as_of: Optional[datetime] = None,
+    format: str = Query("table", pattern="^(table|columnar|binary)$"),
+    precision: int = Query(MASTERY_COLUMNAR_PRECISION, ge=1, le=8),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    format=table - строки учеников со словарем по навыкам, columnar -
+    массивы id и вероятностей, binary - float32 (см. binary_payload)
+    """
+    try:
+        # Таблица на дату as_of от текущего времени не зависит
+        state = await data_state(db, MASTERY_TABLES, epoch_seconds=None if as_of else MASTERY_CACHE_TTL_SECONDS)
+        variant = format if format != "columnar" else f"{format}:{precision}"
+        validators = state_validators(state, extra=f"{as_of.isoformat() if as_of else ''}|{variant}")
+        if is_not_modified(request, validators):
+            return not_modified_response(validators)
+        
+        if format != "table":
+            students, skills, probabilities = await get_mastery_columns_cached_async(db, as_of, state.key)
+            if format == "binary":
+                return Response(
+                    binary_payload(students, skills, probabilities),
+                    media_type=BINARY_MEDIA_TYPE,
+                    headers=validator_headers(validators)
+                )
+            return ORJSONResponse(
+                columnar_payload(students, skills, probabilities, precision, as_of),
+                headers=validator_headers(validators)
+            )
+        
+        students, skills, matrix = await get_mastery_table_cached_async(db, as_of, state.key)
+        
+        return ORJSONResponse(
+            {
+                "students": students,
+                "skills": skills,
+                "matrix": matrix,
+                "as_of": as_of
+            },
+            headers=validator_headers(validators)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения данных освоения: {e}")
+        raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
+
+@router.get("/api/mastery/export")
+def export_mastery_data(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    as_of: Optional[datetime] = None,
+    batch_size: int = Query(500, ge=10, le=10000),
+    current_user: Principal = Depends(AuthDeps.get_current_active_user)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    suffix = (as_of or datetime.now()).strftime("%Y%m%d")
+    logger.info(f"Выгрузка освоения ({format}): {current_user.username}")
     
-    token = auth_header.replace("Bearer ", "")
+    return StreamingResponse(
+        stream_mastery(format, as_of, batch_size),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="mastery_{suffix}.{format}"'}
+    )
+
+@router.get("/api/mastery/trend", response_class=ORJSONResponse)
+def get_mastery_trend(
+    start: date,
+    end: date,
+    step_days: int = Query(7, ge=1, le=366),
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if end < start:
+        raise HTTPException(status_code=400, detail="end раньше start")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        bkt = BKTEngine(db)
-        students, skills, matrix = bkt.get_mastery_table()
-        
-        return {
-            "students": students,
-            "skills": skills,
-            "matrix": matrix
-        }
+        students, skills, dates, matrices = MasterySnapshotBuilder(db).get_trend(start, end, step_days)
+        
+        return ORJSONResponse({
+            "students": [{"id": s.id, "name": s.name, "class": s.class_name} for s in students],
+            "skills": [{"id": sk.id, "name": sk.name} for sk in skills],
+            "points": [
+                {"date": day, "matrix": np.round(matrix, 4)}
+                for day, matrix in zip(dates, matrices)
+            ]
+        })
     except Exception as e:
-        logger.error(f"Ошибка получения данных освоения: {e}")
+        logger.error(f"Ошибка получения динамики освоения: {e}")
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 @router.post("/api", response_model=StudentResponse)
-def create_student(
+async def create_student(
     student: StudentCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot create students")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot create students")
-        
         db_student = Student(
             name=student.name,
             class_name=student.class_name,
             created_by=current_user.id
         )
         db.add(db_student)
-        db.commit()
-        db.refresh(db_student)
+        await db.commit()
+        await db.refresh(db_student)
+        await bump_data_version_async(STUDENTS)
         
         logger.info(f"Ученик создан: {student.name}")
         return db_student
         
     except Exception as e:
         logger.error(f"Ошибка создания ученика: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при создании ученика")
 
 @router.get("/api", response_model=List[StudentResponse])
-def get_students(
+@query_budget(5)
+async def get_students(
     request: Request,
-    db: Session = Depends(get_db),
+    response: Response,
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
-    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
+        validators = await data_validators(db, [STUDENTS], extra=f"{skip}:{limit}")
+        if is_not_modified(request, validators):
+            return not_modified_response(validators)
+        response.headers.update(validator_headers(validators))
         
-        students = db.query(Student).order_by(Student.name).offset(skip).limit(limit).all()
-        return students
+        students = await db.scalars(select(Student).order_by(Student.name).offset(skip).limit(limit))
+        return students.all()
     except Exception as e:
         logger.error(f"Ошибка получения списка учеников: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при получении данных")
 
 @router.delete("/api/{student_id}")
-def delete_student(
+async def delete_student(
     student_id: int,
-    request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot delete students")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot delete students")
-        
-        student = db.query(Student).filter(Student.id == student_id).first()
+        student = await db.get(Student, student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Ученик не найден")
         
-        db.delete(student)
-        db.commit()
+        await db.delete(student)
+        await db.commit()
+        await bump_data_version_async(STUDENTS)
         
         logger.info(f"Ученик удален: ID {student_id}")
         return {"message": "Ученик успешно удален"}
         
     except Exception as e:
         logger.error(f"Ошибка удаления ученика {student_id}: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при удалении ученика")
\ No newline at end of file
@@ -1,55 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+import base64
+import binascii
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks, UploadFile, File, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, distinct, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from app.database import get_db
-from app.models.db_models import Test, TestItem, Student, Skill, StudentAttempt, User
-from app.services.bkt_engine import BKTEngine
+from typing import Optional
+from app.database import get_async_db, SessionLocal
+from app.models.db_models import Test, TestItem, Student, Skill, StudentAttempt, BKTJob
+from app.services.bkt_jobs import new_job, job_status, queued_ahead_statement, notify_job_worker, JOB_QUEUED
+from app.services.attempt_import import AttemptImporter, FORMATS, IMPORT_CHUNK_SIZE, detect_format
+from app.services.query_guard import query_budget
+from app.services.json_response import ORJSONResponse
+from app.services.auth_cache import Principal
+from app.deps import AuthDeps
 from app.logger import logger
-from jose import jwt
-from app.config import SECRET_KEY, ALGORITHM
 
 router = APIRouter(prefix="/tests", tags=["tests"])
 templates = Jinja2Templates(directory="app/templates")
 
+MAX_IMPORT_JOBS = 50
+COPY_BUFFER_SIZE = 1024 * 1024
+
+_import_jobs = OrderedDict()
+_import_jobs_lock = threading.Lock()
+
 @router.get("/input", response_class=HTMLResponse)
 async def test_input_page(
     request: Request,
-    token: str = None,
-    db: Session = Depends(get_db)
+    user: Optional[Principal] = Depends(AuthDeps.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    if not user:
+        return RedirectResponse(url="/")
+    
+    if user.role == "guest":
+        return templates.TemplateResponse(
+            "error.html",
+            {"request": request, "message": "У вас нет прав для ввода тестов", "user": user}
+        )
+    
     try:
-        if token:
-            access_token = token
-        else:
-            auth_header = request.headers.get("authorization", "")
-            if auth_header.startswith("Bearer "):
-                access_token = auth_header.replace("Bearer ", "")
-            else:
-                access_token = request.cookies.get("access_token")
-        
-        if not access_token:
-            return RedirectResponse(url="/")
-        
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        if not username:
-            return RedirectResponse(url="/")
-        
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return RedirectResponse(url="/")
-        
-        if user.role == "guest":
-            return templates.TemplateResponse(
-                "error.html",
-                {"request": request, "message": "У вас нет прав для ввода тестов", "user": user}
-            )
-        
-        students = db.query(Student).order_by(Student.name).all()
-        skills = db.query(Skill).filter_by(is_active=True).order_by(Skill.name).all()
+        students = (await db.scalars(select(Student).order_by(Student.name))).all()
+        skills = (await db.scalars(select(Skill).filter_by(is_active=True).order_by(Skill.name))).all()
         
         return templates.TemplateResponse(
             "tests_input_simple.html",
@@ -67,34 +68,22 @@ async def test_input_page(
 @router.post("/api/create")
 async def create_test(
     request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot create tests")
     
     try:
         data = await request.json()
         
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot create tests")
-        
         test = Test(
             test_date=datetime.now(),
             description=data.get("description", ""),
             created_by=current_user.id
         )
         db.add(test)
-        db.flush()
+        await db.flush()
         
         items = data.get("items", [])
         for idx, skill_id in enumerate(items, 1):
@@ -105,45 +94,34 @@ async def create_test(
             )
             db.add(test_item)
         
-        db.commit()
+        await db.commit()
         logger.info(f"Тест создан: ID {test.id}")
         
         return {"test_id": test.id, "message": "Test created successfully"}
         
     except Exception as e:
         logger.error(f"Ошибка создания теста: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/api/save-results")
+@router.post("/api/save-results", status_code=202)
+@query_budget(30)
 async def save_test_results(
     request: Request,
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = auth_header.replace("Bearer ", "")
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot save results")
     
     try:
         data = await request.json()
         
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        
-        current_user = db.query(User).filter(User.username == username).first()
-        if not current_user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        if current_user.role == "guest":
-            raise HTTPException(status_code=403, detail="Guests cannot save results")
-        
         test_id = data.get("test_id")
         if not test_id:
             raise HTTPException(status_code=400, detail="Missing test_id")
         
-        test_items = db.query(TestItem).filter(TestItem.test_id == test_id).all()
+        test_items = (await db.scalars(select(TestItem).where(TestItem.test_id == test_id))).all()
         if not test_items:
             raise HTTPException(status_code=404, detail="Test has no items")
         
@@ -165,54 +143,231 @@ async def save_test_results(
                     db.add(attempt)
                     attempts_count += 1
         
-        db.commit()
-        logger.info(f"Сохранено {attempts_count} попыток для теста {test_id}")
-        
-        bkt = BKTEngine(db)
-        updated_count = bkt.process_test_results(test_id)
+        # Попытки и задача обработки фиксируются одним commit: BKT
+        # пересчитывается обработчиком очереди, а не в этом запросе
+        job = new_job(int(test_id), current_user.id)
+        db.add(job)
+        await db.commit()
+        notify_job_worker()
         
+        logger.info(f"Сохранено {attempts_count} попыток для теста {test_id}, задача BKT {job.id}")
         return {
-            "message": f"Results saved successfully. BKT updated {updated_count} records.",
-            "updated_count": updated_count
+            "message": "Results saved. BKT update queued.",
+            "attempts_saved": attempts_count,
+            "job_id": job.id,
+            "state": job.state,
+            "status_url": f"/tests/api/jobs/{job.id}"
         }
         
     except Exception as e:
         logger.error(f"Ошибка сохранения результатов: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/api/list")
-def get_tests(
-    request: Request,
-    db: Session = Depends(get_db)
+@router.get("/api/jobs/{job_id}")
+async def get_job_status(
+    job_id: int,
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    auth_header = request.headers.get("authorization", "")
-    if not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    job = await db.get(BKTJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    queued_ahead = None
+    if job.state == JOB_QUEUED:
+        queued_ahead = await db.scalar(queued_ahead_statement(job))
+    return job_status(job, queued_ahead)
+
+def _encode_cursor(test_date: datetime, test_id: int) -> str:
+    raw = json.dumps([test_date.isoformat(), test_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        test_date, test_id = json.loads(raw)
+        return datetime.fromisoformat(test_date), int(test_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def tests_page_statement(limit: int, after: Optional[tuple] = None):
+    """
+    Страница тестов (новые первыми) со сводкой одним запросом: число заданий,
+    учеников с попытками, средняя доля верных ответов, время последней попытки.
+    Агрегаты считаются только по тестам страницы, поэтому время не зависит
+    от числа тестов. after - (test_date, id) последнего теста прошлой страницы.
+    """
+    page = select(Test.id, Test.test_date, Test.description, Test.created_at)
+    if after is not None:
+        after_date, after_id = after
+        page = page.where(or_(
+            Test.test_date < after_date,
+            and_(Test.test_date == after_date, Test.id < after_id)
+        ))
+    page = page.order_by(Test.test_date.desc(), Test.id.desc()).limit(limit).subquery()
+    page_ids = select(page.c.id)
+    
+    items = select(
+        TestItem.test_id,
+        func.count(TestItem.id).label("items_count")
+    ).where(
+        TestItem.test_id.in_(page_ids)
+    ).group_by(TestItem.test_id).subquery()
     
-    token = auth_header.replace("Bearer ", "")
+    attempts = select(
+        TestItem.test_id,
+        func.count(distinct(StudentAttempt.student_id)).label("students_count"),
+        func.avg(case((StudentAttempt.is_correct, 1.0), else_=0.0)).label("mean_correct"),
+        func.max(StudentAttempt.created_at).label("last_attempt_at")
+    ).join(
+        StudentAttempt, StudentAttempt.test_item_id == TestItem.id
+    ).where(
+        TestItem.test_id.in_(page_ids)
+    ).group_by(TestItem.test_id).subquery()
+    
+    return select(
+        page.c.id,
+        page.c.test_date,
+        page.c.description,
+        page.c.created_at,
+        func.coalesce(items.c.items_count, 0),
+        func.coalesce(attempts.c.students_count, 0),
+        attempts.c.mean_correct,
+        attempts.c.last_attempt_at
+    ).outerjoin(
+        items, items.c.test_id == page.c.id
+    ).outerjoin(
+        attempts, attempts.c.test_id == page.c.id
+    ).order_by(page.c.test_date.desc(), page.c.id.desc())
+
+@router.get("/api/list", response_class=ORJSONResponse)
+@query_budget(3)
+async def get_tests(
+    current_user: Principal = Depends(AuthDeps.get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    include_total: bool = False
+):
+    after = _decode_cursor(cursor) if cursor else None
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        tests = db.query(Test).order_by(Test.test_date.desc()).all()
-        
-        result = []
-        for test in tests:
-            items_count = db.query(TestItem).filter(TestItem.test_id == test.id).count()
-            result.append({
-                "id": test.id,
-                "test_date": test.test_date,
-                "description": test.description,
+        # Лишняя строка показывает, есть ли следующая страница
+        rows = (await db.execute(tests_page_statement(limit + 1, after))).all()
+        
+        items = [
+            {
+                "id": test_id,
+                "test_date": test_date,
+                "description": description,
                 "items_count": items_count,
-                "created_at": test.created_at
-            })
+                "students_count": students_count,
+                "mean_correct": round(mean_correct, 4) if mean_correct is not None else None,
+                "last_attempt_at": last_attempt_at,
+                "created_at": created_at
+            }
+            for test_id, test_date, description, created_at, items_count,
+                students_count, mean_correct, last_attempt_at in rows[:limit]
+        ]
         
-        return result
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = _encode_cursor(last["test_date"], last["id"])
+        
+        result = {"items": items, "next_cursor": next_cursor}
+        if include_total:
+            result["total"] = await db.scalar(select(func.count()).select_from(Test))
+        return ORJSONResponse(result)
         
     except Exception as e:
         logger.error(f"Ошибка получения списка тестов: {e}")
-        raise HTTPException(status_code=500, detail="Ошибка получения списка тестов")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Ошибка получения списка тестов")
+
+async def _require_editor(
+    current_user: Principal = Depends(AuthDeps.get_current_active_user)
+) -> Principal:
+    if current_user.role == "guest":
+        raise HTTPException(status_code=403, detail="Guests cannot import results")
+    return current_user
+
+def _evict_import_jobs():
+    """Вытесняет самые старые завершенные задачи; выполняющиеся остаются всегда"""
+    excess = len(_import_jobs) - MAX_IMPORT_JOBS
+    if excess <= 0:
+        return
+    finished = [job_id for job_id, job in _import_jobs.items() if job["state"] != "running"]
+    for job_id in finished[:excess]:
+        del _import_jobs[job_id]
+
+def _run_import(job_id: str, path: str, fmt: str, chunk_size: int, created_by: Optional[int] = None):
+    with _import_jobs_lock:
+        job = _import_jobs.get(job_id)
+    if job is None:
+        # Записи нет - импорт все равно выполняется, но без статуса
+        logger.warning(f"Задача импорта {job_id} не найдена, статус не сохраняется")
+        job = {"job_id": job_id}
+    
+    def update_progress(stage: str, done: int, total: int):
+        job["progress"] = {"stage": stage, "done": done, "total": total}
+    
+    db = SessionLocal()
+    try:
+        importer = AttemptImporter(db, chunk_size=chunk_size, progress=update_progress, created_by=created_by)
+        job["report"] = importer.report
+        with open(path, "rb") as source:
+            importer.run(source, fmt, total_bytes=os.path.getsize(path))
+        job.update({"state": "finished", "finished_at": datetime.now()})
+    except Exception as e:
+        logger.error(f"Ошибка импорта попыток: {e}")
+        job.update({"state": "failed", "finished_at": datetime.now(), "error": str(e)})
+    finally:
+        db.close()
+        os.remove(path)
+
+@router.post("/api/import", status_code=202)
+def import_results(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None),
+    chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=100, le=100000),
+    current_user: Principal = Depends(_require_editor)
+):
+    fmt = format or detect_format(file.filename)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    
+    # Загрузка копируется во временный файл блоками, импорт читает его потоком
+    with tempfile.NamedTemporaryFile(prefix="attempts_", suffix=f".{fmt}", delete=False) as tmp:
+        shutil.copyfileobj(file.file, tmp, COPY_BUFFER_SIZE)
+        path = tmp.name
+    
+    job_id = uuid.uuid4().hex
+    with _import_jobs_lock:
+        _import_jobs[job_id] = job = {
+            "job_id": job_id,
+            "state": "running",
+            "filename": file.filename,
+            "format": fmt,
+            "started_by": current_user.username,
+            "started_at": datetime.now(),
+            "progress": None,
+            "report": None
+        }
+        _evict_import_jobs()
+    
+    background_tasks.add_task(_run_import, job_id, path, fmt, chunk_size, current_user.id)
+    
+    logger.info(f"Запущен импорт попыток {file.filename} ({fmt}): {current_user.username}")
+    return job
+
+@router.get("/api/import/{job_id}")
+def get_import_status(
+    job_id: str,
+    current_user: Principal = Depends(_require_editor)
+):
+    job = _import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
\ No newline at end of file
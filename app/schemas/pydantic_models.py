@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from datetime import datetime, date
 from typing import Optional, List, Dict, Any
 
@@ -10,6 +10,14 @@ class UserBase(BaseModel):
 
 class UserCreate(UserBase):
     password: str
+    
+    @field_validator("password")
+    @classmethod
+    def password_fits_bcrypt(cls, value: str) -> str:
+        # bcrypt учитывает только первые 72 байта: длиннее пароль не принимается
+        if len(value.encode("utf-8")) > 72:
+            raise ValueError("Пароль длиннее 72 байт в UTF-8")
+        return value
 
 class UserResponse(UserBase):
     id: int
@@ -23,6 +31,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     role: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 # Схемы для учеников
 class StudentBase(BaseModel):
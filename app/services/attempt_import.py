@@ -0,0 +1,278 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.models.db_models import BKTJob, Student, TestItem, StudentAttempt
+from app.services.bkt_engine import _chunks
+from app.services.bkt_jobs import JOB_QUEUED, new_job, notify_job_worker
+from app.logger import logger
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("csv", "ndjson")
+
+REQUIRED_FIELDS = ("student_id", "test_id", "item_order", "is_correct")
+TRUE_VALUES = {"1", "true", "yes", "y", "да", "+"}
+FALSE_VALUES = {"0", "false", "no", "n", "нет", "-"}
+
+ProgressCallback = Callable[[str, int, int], None]
+
+def detect_format(filename: str) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+def iter_records(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, object]]:
+    """
+    Строки файла как (номер строки, словарь). Строка NDJSON, которую не
+    удалось разобрать, отдается как исключение, чтобы попасть в отчет.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "ndjson":
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"is_correct: недопустимое значение {value!r}")
+
+def parse_record(record) -> Tuple[int, int, int, bool, Optional[datetime], Optional[float]]:
+    """(student_id, test_id, item_order, is_correct, created_at, score)"""
+    if isinstance(record, Exception):
+        raise ValueError(f"некорректный JSON: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("ожидается объект")
+    
+    missing = [name for name in REQUIRED_FIELDS if record.get(name) in (None, "")]
+    if missing:
+        raise ValueError(f"нет полей: {', '.join(missing)}")
+    
+    try:
+        student_id = int(record["student_id"])
+        test_id = int(record["test_id"])
+        item_order = int(record["item_order"])
+    except (TypeError, ValueError):
+        raise ValueError("student_id, test_id и item_order должны быть целыми")
+    
+    is_correct = _parse_bool(record["is_correct"])
+    
+    created_at = record.get("created_at")
+    if created_at in (None, ""):
+        created_at = None
+    else:
+        try:
+            created_at = datetime.fromisoformat(str(created_at)).replace(tzinfo=None)
+        except ValueError:
+            raise ValueError(f"created_at: недопустимая дата {created_at!r}")
+    
+    score = record.get("score")
+    if score in (None, ""):
+        score = None
+    else:
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            raise ValueError(f"score: недопустимое значение {score!r}")
+    
+    return student_id, test_id, item_order, is_correct, created_at, score
+
+class AttemptImporter:
+    """
+    Потоковый импорт попыток из CSV или NDJSON.
+    
+    Файл читается пачками по chunk_size строк. Каждая пачка проверяется
+    по множествам существующих учеников, заданий (test_id, item_order) и уже
+    сохраненных попыток и вставляется одним executemany вместе с задачами
+    BKT для ее тестов: знания пересчитывает очередь bkt_jobs, как после
+    save-results. Память не зависит от размера файла; ошибки строк
+    собираются в отчет (не больше max_errors).
+    """
+    
+    def __init__(self,
+                 db: Session,
+                 chunk_size: int = IMPORT_CHUNK_SIZE,
+                 progress: Optional[ProgressCallback] = None,
+                 max_errors: int = MAX_REPORTED_ERRORS,
+                 created_by: Optional[int] = None):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.max_errors = max_errors
+        self.created_by = created_by
+        # test_id -> последняя задача BKT, поставленная этим импортом
+        self.jobs = {}
+        self.report = {
+            "rows": 0,
+            "imported": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "bkt_jobs": [],
+            "chunks": 0,
+            "errors": []
+        }
+    
+    def _error(self, line_no: int, message: str):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < self.max_errors:
+            self.report["errors"].append({"line": line_no, "error": message})
+    
+    def _import_chunk(self, records: List[Tuple[int, object]]):
+        parsed = []
+        for line_no, record in records:
+            try:
+                parsed.append((line_no,) + parse_record(record))
+            except ValueError as e:
+                self._error(line_no, str(e))
+        
+        if not parsed:
+            return
+        
+        student_ids = {row[1] for row in parsed}
+        test_ids = {row[2] for row in parsed}
+        
+        known_students = {
+            row[0] for row in self.db.query(Student.id).filter(Student.id.in_(student_ids)).all()
+        }
+        items = {
+            (test_id, item_order): item_id
+            for item_id, test_id, item_order in self.db.query(
+                TestItem.id, TestItem.test_id, TestItem.item_order
+            ).filter(
+                TestItem.test_id.in_(test_ids)
+            ).all()
+        }
+        known_tests = {test_id for test_id, _ in items}
+        
+        existing = set()
+        if items:
+            existing = set(
+                self.db.query(
+                    StudentAttempt.student_id, StudentAttempt.test_item_id
+                ).filter(
+                    StudentAttempt.student_id.in_(known_students),
+                    StudentAttempt.test_item_id.in_(list(items.values()))
+                ).all()
+            )
+        
+        now = datetime.now()
+        rows = []
+        imported_tests = set()
+        for line_no, student_id, test_id, item_order, is_correct, created_at, score in parsed:
+            if student_id not in known_students:
+                self._error(line_no, f"ученик {student_id} не найден")
+                continue
+            if test_id not in known_tests:
+                self._error(line_no, f"тест {test_id} не найден или не содержит заданий")
+                continue
+            item_id = items.get((test_id, item_order))
+            if item_id is None:
+                self._error(line_no, f"в тесте {test_id} нет задания {item_order}")
+                continue
+            if (student_id, item_id) in existing:
+                self.report["duplicates"] += 1
+                continue
+            
+            existing.add((student_id, item_id))
+            imported_tests.add(test_id)
+            rows.append({
+                "student_id": student_id,
+                "test_item_id": item_id,
+                "is_correct": is_correct,
+                "score": score if score is not None else (1.0 if is_correct else 0.0),
+                "created_at": created_at or now
+            })
+        
+        if not rows:
+            return
+        
+        try:
+            for chunk in _chunks(rows):
+                self.db.execute(insert(StudentAttempt.__table__), chunk)
+            jobs = self._queue_jobs(imported_tests)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        for job in jobs:
+            self.jobs[job.test_id] = job.id
+            self.report["bkt_jobs"].append(job.id)
+        if jobs:
+            notify_job_worker()
+        self.report["imported"] += len(rows)
+    
+    def _queue_jobs(self, test_ids: set) -> List[BKTJob]:
+        """
+        Задачи BKT для тестов пачки в ее транзакции. Еще не начатая задача
+        этого импорта учтет и новые попытки; строка блокируется после
+        вставки попыток, поэтому захват задачи ждет commit пачки.
+        """
+        queued = set()
+        pending = [self.jobs[test_id] for test_id in test_ids if test_id in self.jobs]
+        if pending:
+            queued = {
+                row[0] for row in self.db.query(BKTJob.test_id).filter(
+                    BKTJob.id.in_(pending),
+                    BKTJob.state == JOB_QUEUED
+                ).with_for_update().all()
+            }
+        
+        jobs = [new_job(test_id, self.created_by) for test_id in sorted(test_ids - queued)]
+        self.db.add_all(jobs)
+        self.db.flush()
+        return jobs
+    
+    def run(self, source: BinaryIO, fmt: str, total_bytes: int = 0) -> dict:
+        """source - двоичный поток (файл или загрузка), fmt - csv или ndjson"""
+        started = datetime.now()
+        logger.info(f"Импорт попыток ({fmt}): пачки по {self.chunk_size}")
+        
+        stream = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+        records = []
+        
+        try:
+            for line_no, record in iter_records(stream, fmt):
+                records.append((line_no, record))
+                self.report["rows"] += 1
+                if len(records) >= self.chunk_size:
+                    self._flush(records, source, total_bytes)
+                    records = []
+            if records:
+                self._flush(records, source, total_bytes)
+        finally:
+            stream.detach()
+        
+        self.report["errors"].sort(key=lambda error: error["line"])
+        
+        self.report["seconds"] = round((datetime.now() - started).total_seconds(), 3)
+        logger.info(
+            f"Импорт попыток завершен: {self.report['imported']} из {self.report['rows']}, "
+            f"ошибок {self.report['failed']}, дубликатов {self.report['duplicates']}"
+        )
+        return self.report
+    
+    def _flush(self, records: List[Tuple[int, object]], source: BinaryIO, total_bytes: int):
+        self._import_chunk(records)
+        self.report["chunks"] += 1
+        if self.progress:
+            self.progress("import", source.tell(), total_bytes)
\ No newline at end of file
@@ -0,0 +1,222 @@
+import io
+import json
+import shutil
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from app.models.db_models import StudentAttempt, TestItem
+from app.config import ATTEMPT_LOG_DIR
+from app.logger import logger
+
+EXPORT_CHUNK_SIZE = 100000
+
+COLUMNS = {
+    "attempt_id": np.int64,
+    "student_id": np.int32,
+    "skill_id": np.int32,
+    "test_id": np.int32,
+    "timestamp_us": np.int64
+}
+CORRECT_FILE = "correct_bits.npy"
+MANIFEST_FILE = "manifest.json"
+
+def _npy_header(dtype: np.dtype, length: int) -> bytes:
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buffer, {
+        "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        "fortran_order": False,
+        "shape": (length,)
+    })
+    return buffer.getvalue()
+
+def _npy_length(path: Path) -> int:
+    if not path.exists():
+        return 0
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+    return shape[0]
+
+def _append_npy(path: Path, values: np.ndarray, drop_tail: int = 0):
+    """
+    Дописывает значения в конец одномерного .npy, переписывая только заголовок.
+    drop_tail - сколько последних элементов отбросить перед дописыванием.
+    """
+    if not path.exists():
+        np.save(path, values)
+        return
+    
+    with open(path, "r+b") as f:
+        np.lib.format.read_magic(f)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+        kept = shape[0] - drop_tail
+        header = _npy_header(dtype, kept + len(values))
+        
+        if len(header) != offset:
+            # Заголовок перестал помещаться в выравнивание - переписываем файл целиком
+            f.seek(offset)
+            old = np.frombuffer(f.read(kept * dtype.itemsize), dtype=dtype)
+            f.seek(0)
+            f.truncate()
+            f.write(header)
+            f.write(old.tobytes())
+        else:
+            f.seek(0)
+            f.write(header)
+            f.truncate(offset + kept * dtype.itemsize)
+        
+        f.seek(0, io.SEEK_END)
+        f.write(values.astype(dtype, copy=False).tobytes())
+
+class AttemptLog:
+    """
+    Журнал попыток в колоночном виде: attempt_id, student_id, skill_id, test_id,
+    timestamp_us (.npy) и правильность ответа упакованными битами.
+    
+    Файлы читаются через np.load(mmap_mode="r"), новые попытки дописываются
+    в конец по возрастанию attempt_id. skill_id = -1 - задание без навыка.
+    """
+    
+    def __init__(self, directory: Path = ATTEMPT_LOG_DIR):
+        self.directory = Path(directory)
+    
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / MANIFEST_FILE
+    
+    def manifest(self) -> dict:
+        if not self._manifest_path.exists():
+            return {"count": 0, "last_attempt_id": 0}
+        return json.loads(self._manifest_path.read_text())
+    
+    def _write_manifest(self, count: int, last_attempt_id: int):
+        manifest = {
+            "count": count,
+            "last_attempt_id": last_attempt_id,
+            "columns": {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+            "correct": {"file": CORRECT_FILE, "bitorder": "little"},
+            "updated_at": datetime.now().isoformat()
+        }
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        tmp_path.replace(self._manifest_path)
+    
+    def reset(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def append(self, chunk: Dict[str, np.ndarray], count: int) -> int:
+        """
+        Дописывает пачку; count - число попыток в журнале до нее (по манифесту).
+        Строки за count - остаток пачки, дописанной до сбоя без записи
+        манифеста, - отбрасываются, иначе колонки разъедутся.
+        """
+        for name, dtype in COLUMNS.items():
+            path = self.directory / f"{name}.npy"
+            _append_npy(path, chunk[name].astype(dtype), drop_tail=max(_npy_length(path) - count, 0))
+        
+        # Неполный последний байт битовой колонки распаковывается и пишется заново
+        correct_path = self.directory / CORRECT_FILE
+        full_bytes, tail_bits = divmod(count, 8)
+        bits = chunk["correct"].astype(bool)
+        if tail_bits:
+            packed = np.load(correct_path, mmap_mode="r")
+            tail = np.unpackbits(packed[full_bytes:full_bytes + 1], bitorder="little")[:tail_bits].astype(bool)
+            bits = np.concatenate([tail, bits])
+        _append_npy(
+            correct_path,
+            np.packbits(bits, bitorder="little"),
+            drop_tail=max(_npy_length(correct_path) - full_bytes, 0)
+        )
+        return count + len(chunk["correct"])
+    
+    def export(self, db: Session, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+        """Дописывает попытки с id больше последнего выгруженного"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest = self.manifest()
+        count = manifest["count"]
+        last_attempt_id = manifest["last_attempt_id"]
+        
+        stmt = select(
+            StudentAttempt.id,
+            StudentAttempt.student_id,
+            func.coalesce(TestItem.skill_id, -1),
+            TestItem.test_id,
+            StudentAttempt.created_at,
+            StudentAttempt.is_correct
+        ).join(
+            TestItem, StudentAttempt.test_item_id == TestItem.id
+        ).where(
+            StudentAttempt.id > last_attempt_id
+        ).order_by(
+            StudentAttempt.id
+        ).execution_options(yield_per=chunk_size)
+        
+        exported = 0
+        for rows in db.execute(stmt).partitions():
+            columns = list(zip(*rows))
+            chunk = {
+                "attempt_id": np.array(columns[0], dtype=np.int64),
+                "student_id": np.array(columns[1], dtype=np.int32),
+                "skill_id": np.array(columns[2], dtype=np.int32),
+                "test_id": np.array(columns[3], dtype=np.int32),
+                "timestamp_us": np.array(
+                    [value.replace(tzinfo=None) for value in columns[4]], dtype="datetime64[us]"
+                ).astype(np.int64),
+                "correct": np.array(columns[5], dtype=bool)
+            }
+            count = self.append(chunk, count)
+            last_attempt_id = int(chunk["attempt_id"][-1])
+            exported += len(rows)
+            self._write_manifest(count, last_attempt_id)
+        
+        logger.info(f"Журнал попыток: выгружено {exported}, всего {count}")
+        return exported
+    
+    def load(self, mmap: bool = True) -> Dict[str, np.ndarray]:
+        """Колонки журнала; при mmap=True - без чтения в память"""
+        count = self.manifest()["count"]
+        mode = "r" if mmap else None
+        columns = {
+            name: np.load(self.directory / f"{name}.npy", mmap_mode=mode)[:count]
+            if count else np.zeros(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        if count:
+            packed = np.load(self.directory / CORRECT_FILE, mmap_mode=mode)
+            columns["correct"] = np.unpackbits(packed, count=count, bitorder="little").astype(bool)
+        else:
+            columns["correct"] = np.zeros(0, dtype=bool)
+        return columns
+    
+    def to_attempt_arrays(self,
+                          skill_ids: Optional[List[int]] = None,
+                          student_ids: Optional[List[int]] = None,
+                          max_attempt_id: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Те же массивы, что load_attempt_arrays, но из файлов журнала.
+        Журнал только дописывается: попытки удаленных учеников отсекаются
+        фильтром student_ids (или полной перевыгрузкой).
+        """
+        columns = self.load()
+        selected = columns["skill_id"] >= 0
+        if max_attempt_id is not None:
+            selected &= columns["attempt_id"] <= max_attempt_id
+        if skill_ids is not None:
+            selected &= np.isin(columns["skill_id"], skill_ids)
+        if student_ids is not None:
+            selected &= np.isin(columns["student_id"], student_ids)
+        
+        # Хронологический порядок, как в load_attempt_arrays (created_at, id)
+        indices = np.flatnonzero(selected)
+        indices = indices[np.lexsort((columns["attempt_id"][indices], columns["timestamp_us"][indices]))]
+        
+        return {
+            "student_ids": columns["student_id"][indices].astype(np.int64),
+            "skill_ids": columns["skill_id"][indices].astype(np.int64),
+            "is_correct": columns["correct"][indices],
+            "timestamps_us": columns["timestamp_us"][indices].astype(np.int64)
+        }
\ No newline at end of file
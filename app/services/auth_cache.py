@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.models.db_models import User
+from app.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS
+from app.logger import logger
+
+class Principal:
+    """
+    Снимок пользователя для проверки прав: не привязан к сессии, поэтому
+    его можно хранить между запросами и отдавать в шаблоны вместо User.
+    """
+    
+    __slots__ = ("id", "username", "email", "role", "is_active", "created_at")
+    
+    def __init__(self, id: int, username: str, email: Optional[str], role: str,
+                 is_active: bool, created_at: Optional[datetime]):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.is_active = is_active
+        self.created_at = created_at
+    
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.username, user.email, user.role,
+                   bool(user.is_active), user.created_at)
+    
+    def __repr__(self) -> str:
+        return f"Principal({self.username!r}, role={self.role!r})"
+
+class AuthCache:
+    """
+    Кэш аутентификации внутри процесса: расшифрованные токены (токен ->
+    username до истечения exp) и снимки пользователей (username -> Principal).
+    
+    Размер ограничен (LRU), снимки живут не дольше ttl_seconds. Изменение
+    или удаление пользователя через ORM сбрасывает его снимок сразу
+    (события ORM ниже), массовые UPDATE в обход ORM - по TTL.
+    """
+    
+    def __init__(self, max_entries: int = AUTH_CACHE_SIZE,
+                 ttl_seconds: float = AUTH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._tokens = OrderedDict()
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _put(self, entries: OrderedDict, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+    
+    def get_token(self, token: str) -> Optional[str]:
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            
+            expires_at, username = entry
+            if time.time() >= expires_at:
+                del self._tokens[token]
+                return None
+            
+            self._tokens.move_to_end(token)
+            return username
+    
+    def store_token(self, token: str, username: str, expires_at: Optional[float]):
+        # Токен без exp кэшируется на ttl_seconds
+        limit = time.time() + self.ttl_seconds
+        with self._lock:
+            self._put(self._tokens, token, (min(expires_at or limit, limit), username))
+    
+    def get_user(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            stored_at, principal = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._users[username]
+                self.misses += 1
+                return None
+            
+            self._users.move_to_end(username)
+            self.hits += 1
+            return principal
+    
+    def store_user(self, principal: Principal):
+        with self._lock:
+            self._put(self._users, principal.username, (time.monotonic(), principal))
+    
+    def invalidate_user(self, username: str):
+        with self._lock:
+            self._users.pop(username, None)
+    
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tokens": len(self._tokens),
+                "users": len(self._users),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+auth_cache = AuthCache()
+
+def invalidate_user(username: str):
+    auth_cache.invalidate_user(username)
+    logger.info(f"Сброшен кэш аутентификации: {username}")
+
+def _changed_usernames(target: User) -> Tuple[str, ...]:
+    # При переименовании сбрасываются и старое, и новое имя
+    history = inspect(target).attrs.username.history
+    names = set(history.deleted or ()) | set(history.added or ()) | {target.username}
+    return tuple(name for name in names if name)
+
+def _on_user_changed(mapper, connection, target: User):
+    session = inspect(target).session
+    for username in _changed_usernames(target):
+        invalidate_user(username)
+        if session is not None:
+            session.info.setdefault("auth_invalidated", set()).add(username)
+
+def _on_commit(session: Session):
+    # Повторный сброс после commit: запрос между flush и commit мог
+    # успеть закэшировать еще не зафиксированное состояние
+    for username in session.info.pop("auth_invalidated", ()):
+        auth_cache.invalidate_user(username)
+
+event.listen(User, "after_update", _on_user_changed)
+event.listen(User, "after_delete", _on_user_changed)
+event.listen(Session, "after_commit", _on_commit)
@@ -1,18 +1,624 @@
+import multiprocessing
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from sqlalchemy import and_, delete, insert, select, func
 from sqlalchemy.orm import Session
-from typing import Optional, List, Tuple
+from typing import Callable, Iterator, Optional, List, Tuple, Sequence
 from app.models.db_models import (
     Student, Skill, StudentAttempt, TestItem,
-    StudentKnowledgeState, KnowledgeHistory
+    StudentKnowledgeState, KnowledgeHistory, TestProcessingState, MasterySnapshot
 )
-from app.config import DEFAULT_BKT_PARAMS
+from app.database import SessionLocal
+from app.services.knowledge_matrix import get_knowledge_matrix
+from app.services.metrics import BKT_ATTEMPTS, BKT_STATE_UPDATES, BKT_PROCESS_SECONDS
+from app.config import DEFAULT_BKT_PARAMS, BKT_SHARDS, BKT_PARALLEL_MIN_ATTEMPTS
 from app.logger import logger
 
+MIN_PROBABILITY = 0.01
+MAX_PROBABILITY = 0.99
+BULK_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+
+def apply_forgetting_array(probability: np.ndarray,
+                           days_passed: np.ndarray,
+                           forgetting_rate: float,
+                           min_probability: float) -> np.ndarray:
+    """Векторный аналог BKTEngine._apply_forgetting"""
+    decay = np.exp(-forgetting_rate * days_passed)
+    new_probability = min_probability + (probability - min_probability) * decay
+    forgotten = np.maximum(min_probability, np.minimum(probability, new_probability))
+    return np.where(days_passed > 0, forgotten, probability)
+
+def bkt_update_array(current: np.ndarray,
+                     is_correct: np.ndarray,
+                     p_learn: np.ndarray,
+                     p_guess: np.ndarray,
+                     p_slip: np.ndarray) -> np.ndarray:
+    """Байесовское обновление и переход p_learn сразу для массива последовательностей"""
+    p_correct = current * (1 - p_slip) + (1 - current) * p_guess
+    p_wrong = current * p_slip + (1 - current) * (1 - p_guess)
+    
+    evidence = np.where(is_correct, p_correct, p_wrong)
+    joint = np.where(is_correct, current * (1 - p_slip), current * p_slip)
+    
+    safe_evidence = np.where(evidence > 0, evidence, 1.0)
+    posterior = np.where(evidence > 0, joint / safe_evidence, current)
+    
+    new_prob = posterior + (1 - posterior) * p_learn
+    return np.clip(new_prob, MIN_PROBABILITY, MAX_PROBABILITY)
+
+def replay_sequences(initial: np.ndarray,
+                     outcomes: np.ndarray,
+                     days: np.ndarray,
+                     mask: np.ndarray,
+                     p_learn: np.ndarray,
+                     p_guess: np.ndarray,
+                     p_slip: np.ndarray,
+                     forgetting_rate: float,
+                     min_probability: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Прогон BKT по выровненным последовательностям попыток (строка = пара студент-навык).
+    
+    days[:, t] - дни, прошедшие до шага t (забывание применяется перед обновлением),
+    mask[:, t] - есть ли в последовательности шаг t.
+    Возвращает итоговые вероятности и матрицу вероятностей до каждого шага
+    (то, что пишется в knowledge_history).
+    """
+    prob = initial.astype(np.float64, copy=True)
+    history = np.zeros(outcomes.shape, dtype=np.float64)
+    
+    for t in range(outcomes.shape[1]):
+        active = mask[:, t]
+        history[:, t] = prob
+        
+        current = apply_forgetting_array(prob, days[:, t], forgetting_rate, min_probability)
+        updated = bkt_update_array(current, outcomes[:, t], p_learn, p_guess, p_slip)
+        prob = np.where(active, updated, prob)
+    
+    return prob, history
+
+def group_attempts(student_ids: np.ndarray,
+                   skill_ids: np.ndarray,
+                   timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Группирует попытки по парам (студент, навык) в хронологическом порядке.
+    
+    Возвращает порядок сортировки, номер группы и позицию внутри группы
+    для каждой отсортированной попытки, а также индексы начала групп.
+    """
+    n = len(student_ids)
+    order = np.lexsort((np.arange(n), timestamps, skill_ids, student_ids))
+    
+    sorted_students = student_ids[order]
+    sorted_skills = skill_ids[order]
+    
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = ((sorted_students[1:] != sorted_students[:-1]) |
+                     (sorted_skills[1:] != sorted_skills[:-1]))
+    
+    group_index = np.cumsum(new_group) - 1
+    group_starts = np.flatnonzero(new_group)
+    position = np.arange(n) - group_starts[group_index]
+    
+    return order, group_index, position, group_starts
+
+def group_attempt_batch(attempts: Sequence[Tuple[int, int, bool, datetime]],
+                        now: datetime) -> Tuple[np.ndarray, ...]:
+    """
+    Пакет попыток (student_id, skill_id, is_correct, attempt_date) в виде
+    выровненных последовательностей по парам студент-навык: студенты и
+    навыки групп, ответы, маска шагов и даты шагов.
+    """
+    n = len(attempts)
+    student_ids = np.fromiter((a[0] for a in attempts), dtype=np.int64, count=n)
+    skill_ids = np.fromiter((a[1] for a in attempts), dtype=np.int64, count=n)
+    is_correct = np.fromiter((bool(a[2]) for a in attempts), dtype=bool, count=n)
+    dates = np.array([naive_datetime(a[3]) or now for a in attempts], dtype="datetime64[us]")
+    
+    order, group_index, position, group_starts = group_attempts(
+        student_ids, skill_ids, dates.astype(np.int64)
+    )
+    
+    n_groups = len(group_starts)
+    max_len = int(position.max()) + 1
+    
+    outcomes = np.zeros((n_groups, max_len), dtype=bool)
+    mask = np.zeros((n_groups, max_len), dtype=bool)
+    date_matrix = np.full((n_groups, max_len), np.datetime64(now, "us"))
+    
+    outcomes[group_index, position] = is_correct[order]
+    mask[group_index, position] = True
+    date_matrix[group_index, position] = dates[order]
+    
+    group_students = student_ids[order][group_starts]
+    group_skills = skill_ids[order][group_starts]
+    
+    return group_students, group_skills, outcomes, mask, date_matrix
+
+def replay_attempt_batch(batch: Tuple[np.ndarray, ...],
+                         skills: dict,
+                         states: dict,
+                         now: datetime,
+                         forgetting_rate: float) -> Tuple[List[dict], List[dict]]:
+    """
+    Прогон BKT по пакету из group_attempt_batch. skills - skill_id -> навык,
+    states - (student_id, skill_id) -> (вероятность, last_updated).
+    Возвращает строки для upsert состояний и для knowledge_history.
+    Обращений к базе нет, поэтому функцию можно выполнять в другом потоке.
+    """
+    group_students, group_skills, outcomes, mask, date_matrix = batch
+    n_groups, max_len = outcomes.shape
+    
+    initial = np.empty(n_groups, dtype=np.float64)
+    initial_days = np.zeros(n_groups, dtype=np.float64)
+    p_learn = np.empty(n_groups, dtype=np.float64)
+    p_guess = np.empty(n_groups, dtype=np.float64)
+    p_slip = np.empty(n_groups, dtype=np.float64)
+    
+    for g in range(n_groups):
+        student_id, skill_id = int(group_students[g]), int(group_skills[g])
+        skill = skills.get(skill_id)
+        if not skill:
+            raise ValueError(f"Skill {skill_id} not found")
+        
+        p_learn[g], p_guess[g], p_slip[g] = skill.p_learn, skill.p_guess, skill.p_slip
+        
+        state = states.get((student_id, skill_id))
+        if state is None:
+            initial[g] = skill.p_init
+        else:
+            initial[g] = state[0]
+            last_updated = naive_datetime(state[1])
+            if last_updated is not None:
+                initial_days[g] = (now - last_updated).days
+    
+    days = np.zeros((n_groups, max_len), dtype=np.float64)
+    days[:, 0] = initial_days
+    if max_len > 1:
+        elapsed = np.datetime64(now, "us") - date_matrix[:, :-1]
+        days[:, 1:] = elapsed // np.timedelta64(1, "D")
+    
+    final, history = replay_sequences(
+        initial, outcomes, days, mask, p_learn, p_guess, p_slip,
+        forgetting_rate, DEFAULT_BKT_PARAMS["p_init"]
+    )
+    
+    lengths = mask.sum(axis=1)
+    corrects = (outcomes & mask).sum(axis=1)
+    last_dates = date_matrix[np.arange(n_groups), lengths - 1].astype(datetime)
+    
+    state_rows = [
+        {
+            "student_id": int(group_students[g]),
+            "skill_id": int(group_skills[g]),
+            "probability_knowing": float(final[g]),
+            "total_attempts": int(lengths[g]),
+            "correct_attempts": int(corrects[g]),
+            "last_updated": last_dates[g]
+        }
+        for g in range(n_groups)
+    ]
+    
+    history_groups, history_steps = np.nonzero(mask)
+    history_dates = date_matrix[history_groups, history_steps].astype(datetime)
+    history_rows = [
+        {
+            "student_id": int(group_students[g]),
+            "skill_id": int(group_skills[g]),
+            "probability": float(history[g, t]),
+            "recorded_at": recorded_at
+        }
+        for g, t, recorded_at in zip(history_groups, history_steps, history_dates)
+    ]
+    
+    return state_rows, history_rows
+
+def shard_attempts(attempts: Sequence[Tuple[int, int, bool, datetime]],
+                   shards: int) -> List[List[Tuple[int, int, bool, datetime]]]:
+    """
+    Делит пакет на шарды по непрерывным диапазонам student_id с примерно
+    равным числом попыток. Все попытки ученика попадают в один шард, порядок
+    попыток внутри шарда сохраняется, пустые шарды отбрасываются.
+    """
+    student_ids = np.fromiter((a[0] for a in attempts), dtype=np.int64, count=len(attempts))
+    unique, inverse, counts = np.unique(student_ids, return_inverse=True, return_counts=True)
+    shards = max(1, min(shards, len(unique)))
+    
+    # Шард ученика - по доле попыток перед ним, поэтому номера не убывают
+    starts = np.cumsum(counts) - counts
+    student_shard = starts * shards // max(len(attempts), 1)
+    
+    result = [[] for _ in range(shards)]
+    for attempt, shard in zip(attempts, student_shard[inverse].tolist()):
+        result[shard].append(tuple(attempt[:4]))
+    return [shard for shard in result if shard]
+
+def replay_attempt_shard(attempts: List[Tuple[int, int, bool, datetime]],
+                         now: datetime,
+                         forgetting_rate: float) -> Tuple[List[dict], List[dict]]:
+    """Шард в процессе пула: свой сеанс для чтения навыков и состояний, прогон без записи"""
+    batch = group_attempt_batch(attempts, now)
+    db = SessionLocal()
+    try:
+        rows = db.execute(batch_context_statement(
+            [int(s) for s in np.unique(batch[0])],
+            [int(s) for s in np.unique(batch[1])]
+        )).all()
+        skills, states = split_batch_context(rows)
+    finally:
+        db.close()
+    return replay_attempt_batch(batch, skills, states, now, forgetting_rate)
+
+_shard_pool: Optional[ProcessPoolExecutor] = None
+
+def new_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Пул процессов для расчетов BKT. Контекст spawn: приложение держит потоки,
+    пулы соединений и цикл событий, fork их копировать не должен.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max(1, max_workers),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def get_shard_pool() -> ProcessPoolExecutor:
+    global _shard_pool
+    if _shard_pool is None:
+        _shard_pool = new_process_pool(BKT_SHARDS)
+    return _shard_pool
+
+def shutdown_shard_pool():
+    global _shard_pool
+    if _shard_pool is not None:
+        _shard_pool.shutdown(wait=True)
+        _shard_pool = None
+
+def replay_shards_parallel(shards: List[List[Tuple[int, int, bool, datetime]]],
+                           now: datetime,
+                           forgetting_rate: float) -> Tuple[List[dict], List[dict]]:
+    """
+    Прогоняет шарды в пуле процессов и склеивает строки в порядке шардов.
+    Шарды - возрастающие диапазоны учеников, поэтому порядок строк тот же,
+    что у последовательного прогона всего пакета.
+    """
+    global _shard_pool
+    pool = get_shard_pool()
+    state_rows, history_rows = [], []
+    try:
+        futures = [pool.submit(replay_attempt_shard, shard, now, forgetting_rate) for shard in shards]
+        for future in futures:
+            shard_states, shard_history = future.result()
+            state_rows.extend(shard_states)
+            history_rows.extend(shard_history)
+    except BrokenProcessPool:
+        # Пул с упавшим процессом непригоден, следующий вызов создаст новый
+        _shard_pool = None
+        raise
+    return state_rows, history_rows
+
+def naive_datetime(value: datetime) -> datetime:
+    """Время без часового пояса: в БД даты хранятся как naive"""
+    if value is not None and value.tzinfo is not None:
+        return value.replace(tzinfo=None)
+    return value
+
+def _chunks(rows: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def _states_upsert_statement(dialect_name: str, rows: List[dict]):
+    """
+    Многострочный upsert по ограничению unique_student_skill.
+    
+    total_attempts/correct_attempts в rows - приращения: для новой строки
+    они и есть итог, для существующей прибавляются к текущим значениям.
+    """
+    table = StudentKnowledgeState.__table__
+    
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(rows)
+        return stmt.on_duplicate_key_update(
+            probability_knowing=stmt.inserted.probability_knowing,
+            total_attempts=table.c.total_attempts + stmt.inserted.total_attempts,
+            correct_attempts=table.c.correct_attempts + stmt.inserted.correct_attempts,
+            last_updated=stmt.inserted.last_updated
+        )
+    else:
+        raise ValueError(f"Bulk upsert не поддерживается для диалекта {dialect_name}")
+    
+    stmt = dialect_insert(table).values(rows)
+    set_ = {
+        "probability_knowing": stmt.excluded.probability_knowing,
+        "total_attempts": table.c.total_attempts + stmt.excluded.total_attempts,
+        "correct_attempts": table.c.correct_attempts + stmt.excluded.correct_attempts,
+        "last_updated": stmt.excluded.last_updated
+    }
+    
+    if dialect_name == "postgresql":
+        return stmt.on_conflict_do_update(constraint="unique_student_skill", set_=set_)
+    return stmt.on_conflict_do_update(index_elements=["student_id", "skill_id"], set_=set_)
+
+def _watermark_insert_statement(dialect_name: str, test_id: int):
+    """Нулевая отметка теста; существующая строка не меняется"""
+    table = TestProcessingState.__table__
+    values = {"test_id": test_id, "last_attempt_id": 0, "processed_attempts": 0}
+    
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        return mysql_insert(table).values(values).prefix_with("IGNORE")
+    else:
+        raise ValueError(f"Вставка отметки не поддерживается для диалекта {dialect_name}")
+    
+    return dialect_insert(table).values(values).on_conflict_do_nothing(index_elements=["test_id"])
+
+def upsert_knowledge_states(db: Session, rows: List[dict]) -> int:
+    """
+    Записывает состояния пачками многострочных upsert без commit.
+    
+    Каждая строка: student_id, skill_id, probability_knowing,
+    total_attempts, correct_attempts (приращения), last_updated.
+    """
+    dialect_name = db.get_bind().dialect.name
+    for chunk in _chunks(rows):
+        db.execute(_states_upsert_statement(dialect_name, chunk))
+    return len(rows)
+
+def invalidate_snapshots(db: Session, since: datetime):
+    """
+    Удаляет снимки освоения с дня since: история за эти дни изменилась.
+    Планировщик снимков построит их заново.
+    """
+    db.execute(delete(MasterySnapshot).where(MasterySnapshot.snapshot_date >= since.date()))
+
+def insert_knowledge_history(db: Session, rows: List[dict]) -> int:
+    """Вставляет строки knowledge_history одним executemany без commit"""
+    if rows:
+        db.execute(insert(KnowledgeHistory.__table__), rows)
+        invalidate_snapshots(db, min(row["recorded_at"] for row in rows))
+    return len(rows)
+
+def batch_context_statement(student_ids: List[int], skill_ids: List[int]):
+    """Навыки пакета вместе с существующими состояниями студентов пакета"""
+    return select(
+        Skill,
+        StudentKnowledgeState.student_id,
+        StudentKnowledgeState.probability_knowing,
+        StudentKnowledgeState.last_updated
+    ).outerjoin(
+        StudentKnowledgeState,
+        and_(
+            StudentKnowledgeState.skill_id == Skill.id,
+            StudentKnowledgeState.student_id.in_(student_ids)
+        )
+    ).where(
+        Skill.id.in_(skill_ids)
+    )
+
+def split_batch_context(rows) -> Tuple[dict, dict]:
+    """Строки batch_context_statement -> (skill_id -> навык, (student_id, skill_id) -> состояние)"""
+    skills = {}
+    states = {}
+    for skill, student_id, probability, last_updated in rows:
+        skills[skill.id] = skill
+        if student_id is not None:
+            states[(student_id, skill.id)] = (probability, last_updated)
+    return skills, states
+
+def new_attempts_statement(test_id: int, last_attempt_id: int, limit: Optional[int] = None):
+    """
+    Попытки теста после отметки: (student_id, skill_id, is_correct, created_at, id).
+    Порядок - по id, чтобы отметка пачки из первых limit попыток была ее
+    максимальным id; хронологию внутри пачки восстанавливает прогон.
+    """
+    stmt = select(
+        StudentAttempt.student_id,
+        TestItem.skill_id,
+        StudentAttempt.is_correct,
+        StudentAttempt.created_at,
+        StudentAttempt.id
+    ).join(
+        TestItem
+    ).where(
+        TestItem.test_id == test_id,
+        TestItem.skill_id.isnot(None),
+        StudentAttempt.id > last_attempt_id
+    ).order_by(
+        StudentAttempt.id
+    )
+    return stmt.limit(limit) if limit else stmt
+
+def knowledge_states_statement(student_ids: Optional[List[int]] = None):
+    """Текущие состояния по активным навыкам (всех студентов или только student_ids)"""
+    stmt = select(
+        StudentKnowledgeState.student_id,
+        StudentKnowledgeState.skill_id,
+        StudentKnowledgeState.probability_knowing,
+        StudentKnowledgeState.last_updated
+    ).join(
+        Skill, StudentKnowledgeState.skill_id == Skill.id
+    ).where(
+        Skill.is_active == True
+    )
+    if student_ids is not None:
+        stmt = stmt.where(StudentKnowledgeState.student_id.in_(student_ids))
+    return stmt
+
+def states_as_of_statement(as_of: datetime,
+                           student_ids: Optional[List[int]] = None,
+                           active_only: bool = True):
+    """
+    Запрос состояний (student_id, skill_id, вероятность, last_updated) на
+    момент as_of с оконными функциями. Строки с вероятностью NULL
+    (состояния нет) отбрасывает вызывающий код.
+    
+    Строка истории хранит вероятность до попытки, поэтому значение после
+    последней попытки не позже as_of - это первая строка истории после as_of,
+    а если ее нет - текущее состояние. Время последней попытки не позже
+    as_of служит last_updated для забывания.
+    """
+    student_filter = []
+    if student_ids is not None:
+        student_filter.append(KnowledgeHistory.student_id.in_(student_ids))
+    
+    before = select(
+        KnowledgeHistory.student_id,
+        KnowledgeHistory.skill_id,
+        KnowledgeHistory.recorded_at,
+        func.row_number().over(
+            partition_by=(KnowledgeHistory.student_id, KnowledgeHistory.skill_id),
+            order_by=(KnowledgeHistory.recorded_at.desc(), KnowledgeHistory.id.desc())
+        ).label("rn")
+    ).where(
+        KnowledgeHistory.recorded_at <= as_of,
+        *student_filter
+    ).subquery()
+    
+    after = select(
+        KnowledgeHistory.student_id,
+        KnowledgeHistory.skill_id,
+        KnowledgeHistory.probability,
+        func.row_number().over(
+            partition_by=(KnowledgeHistory.student_id, KnowledgeHistory.skill_id),
+            order_by=(KnowledgeHistory.recorded_at, KnowledgeHistory.id)
+        ).label("rn")
+    ).where(
+        KnowledgeHistory.recorded_at > as_of,
+        *student_filter
+    ).subquery()
+    
+    stmt = select(
+        before.c.student_id,
+        before.c.skill_id,
+        func.coalesce(after.c.probability, StudentKnowledgeState.probability_knowing),
+        before.c.recorded_at
+    ).select_from(
+        before
+    ).join(
+        Skill, Skill.id == before.c.skill_id
+    ).outerjoin(
+        after,
+        and_(
+            after.c.student_id == before.c.student_id,
+            after.c.skill_id == before.c.skill_id,
+            after.c.rn == 1
+        )
+    ).outerjoin(
+        StudentKnowledgeState,
+        and_(
+            StudentKnowledgeState.student_id == before.c.student_id,
+            StudentKnowledgeState.skill_id == before.c.skill_id
+        )
+    ).where(
+        before.c.rn == 1
+    )
+    
+    if active_only:
+        stmt = stmt.where(Skill.is_active == True)
+    
+    return stmt
+
+def mastery_from_read_model(matrix,
+                            students: List[Student],
+                            skills: List[Skill],
+                            now: datetime,
+                            forgetting_rate: float) -> np.ndarray:
+    """Матрица освоения из memory-mapped модели чтения вместо student_knowledge_states"""
+    stored, last_updated = matrix.read([s.id for s in students], [sk.id for sk in skills])
+    
+    probabilities = stored.astype(np.float64)
+    missing = np.isnan(probabilities)
+    p_init = np.array([skill.p_init for skill in skills], dtype=np.float64)
+    probabilities[missing] = np.broadcast_to(p_init, probabilities.shape)[missing]
+    
+    now_seconds = np.datetime64(now, "s").astype(np.int64)
+    days = np.where(missing, 0, (now_seconds - last_updated.astype(np.int64)) // 86400)
+    return apply_forgetting_array(probabilities, days.astype(np.float64),
+                                  forgetting_rate, DEFAULT_BKT_PARAMS["p_init"])
+
+def fill_mastery_matrix(students: List[Student],
+                        skills: List[Skill],
+                        states: Sequence[Tuple[int, int, float, datetime]],
+                        now: datetime,
+                        forgetting_rate: float) -> np.ndarray:
+    """
+    Заполняет матрицу: p_init навыка там, где состояния нет, иначе
+    сохраненная вероятность с забыванием на момент now.
+    """
+    student_index = {student.id: i for i, student in enumerate(students)}
+    skill_index = {skill.id: j for j, skill in enumerate(skills)}
+    
+    p_init = np.array([skill.p_init for skill in skills], dtype=np.float64)
+    probabilities = np.tile(p_init, (len(students), 1))
+    days = np.zeros(probabilities.shape, dtype=np.float64)
+    
+    rows, cols, values, dates = [], [], [], []
+    for student_id, skill_id, probability, last_updated in states:
+        i = student_index.get(student_id)
+        j = skill_index.get(skill_id)
+        if i is None or j is None:
+            continue
+        rows.append(i)
+        cols.append(j)
+        values.append(probability)
+        dates.append(naive_datetime(last_updated) or now)
+    
+    if rows:
+        elapsed = np.datetime64(now, "us") - np.array(dates, dtype="datetime64[us]")
+        probabilities[rows, cols] = values
+        days[rows, cols] = elapsed // np.timedelta64(1, "D")
+    
+    return apply_forgetting_array(probabilities, days, forgetting_rate, DEFAULT_BKT_PARAMS["p_init"])
+
+def mastery_labels(students: List[Student], skills: List[Skill]) -> Tuple[List[dict], List[dict]]:
+    students_data = [{"id": s.id, "name": s.name, "class": s.class_name} 
+                    for s in students]
+    skills_data = [{"id": sk.id, "name": sk.name} for sk in skills]
+    return students_data, skills_data
+
+def mastery_table_from_matrix(students: List[Student],
+                              skills: List[Skill],
+                              probabilities: np.ndarray) -> Tuple[List[dict], List[dict], List[dict]]:
+    students_data, skills_data = mastery_labels(students, skills)
+    skill_ids = [sk.id for sk in skills]
+    
+    matrix = []
+    for student, row in zip(students, probabilities.tolist()):
+        student_row = {
+            "student_id": student.id,
+            "student_name": student.name,
+            "mastery": {}
+        }
+        
+        for skill_id, prob in zip(skill_ids, row):
+            student_row["mastery"][skill_id] = {
+                "percentage": round(prob * 100, 1),
+                "probability": prob
+            }
+        
+        matrix.append(student_row)
+    
+    return students_data, skills_data, matrix
+
 class BKTEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, shards: Optional[int] = None):
         self.db = db
         self.forgetting_rate = DEFAULT_BKT_PARAMS["forgetting_rate"]
+        # Пакеты от BKT_PARALLEL_MIN_ATTEMPTS попыток считаются в shards процессах
+        self.shards = BKT_SHARDS if shards is None else shards
+        # Состояния, которые попадут в матрицу знаний после commit
+        self._pending_states = []
     
     def _apply_forgetting(self, probability: float, days_passed: float) -> float:
         if days_passed <= 0:
@@ -24,6 +630,10 @@ class BKTEngine:
         new_probability = min_probability + (probability - min_probability) * decay
         return max(min_probability, min(probability, new_probability))
     
+    def _apply_forgetting_array(self, probability: np.ndarray, days_passed: np.ndarray) -> np.ndarray:
+        return apply_forgetting_array(probability, days_passed,
+                                      self.forgetting_rate, DEFAULT_BKT_PARAMS["p_init"])
+    
     def get_current_knowledge(self, student_id: int, skill_id: int) -> float:
         state = self.db.query(StudentKnowledgeState).filter_by(
             student_id=student_id, skill_id=skill_id
@@ -76,6 +686,7 @@ class BKTEngine:
             recorded_at=attempt_date
         )
         self.db.add(history)
+        invalidate_snapshots(self.db, attempt_date)
         
         current_prob = self.get_current_knowledge(student_id, skill_id)
         
@@ -109,79 +720,256 @@ class BKTEngine:
         state.last_updated = attempt_date
         
         self.db.commit()
+        self._pending_states.append((student_id, skill_id, new_prob, attempt_date))
+        self._publish_states()
+        BKT_ATTEMPTS.inc(path="scalar")
+        BKT_STATE_UPDATES.inc(path="scalar")
         
         logger.info(f"Обновление студента {student_id}, навык {skill_id}: "
                    f"{current_prob:.3f} -> {new_prob:.3f}")
         
         return new_prob
     
-    def process_test_results(self, test_id: int) -> int:
-        logger.info(f"Обработка теста {test_id}")
-        
-        attempts = self.db.query(StudentAttempt).join(
-            TestItem
-        ).filter(
-            TestItem.test_id == test_id
-        ).order_by(
-            StudentAttempt.created_at
-        ).all()
-        
-        logger.info(f"Найдено {len(attempts)} попыток")
+    def update_from_attempts_batch(self,
+                                   attempts: Sequence[Tuple[int, int, bool, datetime]],
+                                   commit: bool = True) -> int:
+        """
+        Пакетный аналог update_from_attempt.
         
+        attempts - кортежи (student_id, skill_id, is_correct, attempt_date).
+        Состояния и параметры навыков загружаются одним запросом, обновление
+        считается векторно по всем последовательностям, запись - один upsert
+        состояний и один executemany истории. С commit=False фиксацию
+        выполняет вызывающий код.
+        Результат совпадает с последовательными вызовами update_from_attempt.
+        """
         if not attempts:
             return 0
         
-        updates = {}
-        for attempt in attempts:
-            skill_id = attempt.test_item.skill_id
-            key = (attempt.student_id, skill_id)
-            
-            if key not in updates:
-                updates[key] = []
-            updates[key].append(attempt)
+        n = len(attempts)
+        now = datetime.now()
+        
+        state_rows, history_rows, path = self._replay_batch(attempts, now)
+        n_groups = len(state_rows)
         
-        logger.info(f"Обновляем {len(updates)} пар студент-навык")
+        upsert_knowledge_states(self.db, state_rows)
+        insert_knowledge_history(self.db, history_rows)
+        self._pending_states.extend(
+            (row["student_id"], row["skill_id"], row["probability_knowing"], row["last_updated"])
+            for row in state_rows
+        )
+        
+        if commit:
+            self.db.commit()
+            self._publish_states()
+        
+        BKT_ATTEMPTS.inc(n, path=path)
+        BKT_STATE_UPDATES.inc(n_groups, path=path)
+        logger.info(f"Пакетное обновление: {n} попыток, {n_groups} пар студент-навык")
+        return n
+    
+    def _replay_batch(self,
+                      attempts: Sequence[Tuple[int, int, bool, datetime]],
+                      now: datetime) -> Tuple[List[dict], List[dict], str]:
+        """
+        Прогон пакета: в пуле процессов по шардам учеников или в текущем
+        процессе. Пары студент-навык независимы, поэтому результат не зависит
+        от режима. Запись выполняет вызывающий код одной транзакцией.
+        """
+        if self.shards > 1 and len(attempts) >= BKT_PARALLEL_MIN_ATTEMPTS:
+            shards = shard_attempts(attempts, self.shards)
+            if len(shards) > 1:
+                try:
+                    state_rows, history_rows = replay_shards_parallel(shards, now, self.forgetting_rate)
+                    logger.info(f"Пакет посчитан в {len(shards)} процессах")
+                    return state_rows, history_rows, "parallel"
+                except Exception as e:
+                    # Последовательный прогон даст тот же результат или ту же ошибку
+                    logger.warning(f"Параллельный прогон BKT не удался, последовательный режим: {e}")
+        
+        batch = group_attempt_batch(attempts, now)
+        skills, states = self._load_batch_context(batch[0], batch[1])
+        state_rows, history_rows = replay_attempt_batch(batch, skills, states, now, self.forgetting_rate)
+        return state_rows, history_rows, "batch"
+    
+    def _publish_states(self):
+        """Переносит зафиксированные состояния в memory-mapped матрицу знаний"""
+        pending, self._pending_states = self._pending_states, []
+        matrix = get_knowledge_matrix()
+        if matrix is None or not pending:
+            return
+        
+        try:
+            matrix.update(*zip(*pending))
+        except Exception as e:
+            logger.error(f"Ошибка обновления матрицы знаний: {e}")
+    
+    def _load_batch_context(self, student_ids: np.ndarray, skill_ids: np.ndarray):
+        """Навыки и существующие состояния для пакета одним запросом"""
+        student_list = [int(s) for s in np.unique(student_ids)]
+        skill_list = [int(s) for s in np.unique(skill_ids)]
+        
+        rows = self.db.execute(batch_context_statement(student_list, skill_list)).all()
+        return split_batch_context(rows)
+    
+    def _lock_watermark(self, test_id: int) -> TestProcessingState:
+        """
+        Отметка последней учтенной попытки теста (строка блокируется до commit).
+        Строка сначала создается, если ее нет: FOR UPDATE по отсутствующей
+        строке ничего не блокирует, и два обработчика прочли бы одну отметку.
+        """
+        self.db.execute(_watermark_insert_statement(self.db.get_bind().dialect.name, test_id))
+        return self.db.query(TestProcessingState).filter_by(
+            test_id=test_id
+        ).with_for_update().one()
+    
+    def _advance_watermark(self, watermark: TestProcessingState, attempt_ids: Sequence[int]):
+        if attempt_ids:
+            watermark.last_attempt_id = max(watermark.last_attempt_id, max(attempt_ids))
+            watermark.processed_attempts += len(attempt_ids)
+    
+    def _new_attempts(self, test_id: int, watermark: TestProcessingState, limit: Optional[int] = None) -> list:
+        attempts = self.db.execute(new_attempts_statement(test_id, watermark.last_attempt_id, limit)).all()
+        attempts.sort(key=lambda a: (a[3], a[4]))
+        return attempts
+    
+    def process_test_results(self,
+                             test_id: int,
+                             chunk_size: Optional[int] = None,
+                             progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Учитывает в BKT только попытки теста, появившиеся после предыдущей
+        обработки. Повторный вызов без новых попыток ничего не меняет.
+        
+        С chunk_size попытки учитываются пачками по id: состояния, история
+        и отметка каждой пачки фиксируются одним commit, после него
+        progress получает число учтенных попыток. Сбой откатывает только
+        текущую пачку, повтор продолжит с отметки.
+        """
+        started = time.perf_counter()
+        try:
+            return self._process_test_results(test_id, chunk_size, progress)
+        finally:
+            BKT_PROCESS_SECONDS.observe(time.perf_counter() - started)
+    
+    def _process_test_results(self,
+                              test_id: int,
+                              chunk_size: Optional[int],
+                              progress: Optional[Callable[[int], None]]) -> int:
+        logger.info(f"Обработка теста {test_id}")
         
         updated_count = 0
-        for (student_id, skill_id), attempt_list in updates.items():
-            attempt_list.sort(key=lambda x: x.created_at)
+        while True:
+            try:
+                watermark = self._lock_watermark(test_id)
+                attempts = self._new_attempts(test_id, watermark, chunk_size)
+                
+                logger.info(f"Найдено {len(attempts)} новых попыток")
+                
+                updated_count += self.update_from_attempts_batch(attempts, commit=False)
+                self._advance_watermark(watermark, [a[4] for a in attempts])
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                self._pending_states = []
+                logger.error(f"Обработка теста {test_id} отменена, изменения пачки откачены")
+                raise
             
-            for attempt in attempt_list:
-                self.update_from_attempt(
-                    student_id=student_id,
-                    skill_id=skill_id,
-                    is_correct=attempt.is_correct,
-                    attempt_date=attempt.created_at
-                )
-                updated_count += 1
+            self._publish_states()
+            if progress and attempts:
+                progress(updated_count)
+            if not chunk_size or len(attempts) < chunk_size:
+                break
         
         logger.info(f"Тест {test_id} обработан, {updated_count} обновлений")
         return updated_count
     
-    def get_mastery_table(self) -> Tuple[List[dict], List[dict], List[dict]]:
+    def get_mastery_matrix(self, as_of: Optional[datetime] = None) -> Tuple[List[Student], List[Skill], np.ndarray]:
+        """
+        Студенты, активные навыки и матрица вероятностей освоения (студент x навык)
+        с учетом забывания. Три запроса независимо от размера школы.
+        С as_of матрица строится по knowledge_history на указанный момент.
+        """
         students = self.db.query(Student).order_by(Student.name).all()
         skills = self.db.query(Skill).filter_by(is_active=True).order_by(Skill.name).all()
         
-        students_data = [{"id": s.id, "name": s.name, "class": s.class_name} 
-                        for s in students]
-        skills_data = [{"id": sk.id, "name": sk.name} for sk in skills]
+        if as_of is not None:
+            as_of = naive_datetime(as_of)
+            states = self._states_as_of(as_of)
+            now = as_of
+        else:
+            matrix = get_knowledge_matrix(self.db)
+            if matrix is not None:
+                probabilities = self._mastery_from_read_model(matrix, students, skills, datetime.now())
+                return students, skills, probabilities
+            
+            states = self.db.execute(knowledge_states_statement()).all()
+            now = datetime.now()
         
-        matrix = []
-        for student in students:
-            student_row = {
-                "student_id": student.id,
-                "student_name": student.name,
-                "mastery": {}
-            }
+        probabilities = self._fill_mastery_matrix(students, skills, states, now)
+        return students, skills, probabilities
+    
+    def iter_mastery_batches(self,
+                             as_of: Optional[datetime] = None,
+                             batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple[List[Student], List[Skill], np.ndarray]]:
+        """
+        get_mastery_matrix по частям: ученики читаются курсором пачками
+        по batch_size, для каждой пачки загружаются только ее состояния.
+        Память зависит от размера пачки, а не школы.
+        """
+        skills = self.db.query(Skill).filter_by(is_active=True).order_by(Skill.name).all()
+        
+        if as_of is not None:
+            as_of = naive_datetime(as_of)
+            now = as_of
+            matrix = None
+        else:
+            now = datetime.now()
+            matrix = get_knowledge_matrix(self.db)
+        
+        students_stmt = select(Student).order_by(Student.name, Student.id).execution_options(yield_per=batch_size)
+        
+        for students in self.db.execute(students_stmt).scalars().partitions():
+            student_ids = [student.id for student in students]
             
-            for skill in skills:
-                prob = self.get_current_knowledge(student.id, skill.id)
-                percentage = round(prob * 100, 1)
-                student_row["mastery"][skill.id] = {
-                    "percentage": percentage,
-                    "probability": prob
-                }
+            if as_of is not None:
+                states = self._states_as_of(as_of, student_ids=student_ids)
+            elif matrix is not None:
+                yield students, skills, self._mastery_from_read_model(matrix, students, skills, now)
+                continue
+            else:
+                states = self.db.execute(knowledge_states_statement(student_ids)).all()
             
-            matrix.append(student_row)
-        
-        return students_data, skills_data, matrix
\ No newline at end of file
+            yield students, skills, self._fill_mastery_matrix(students, skills, states, now)
+    
+    def _states_as_of(self,
+                      as_of: datetime,
+                      student_ids: Optional[List[int]] = None,
+                      active_only: bool = True) -> List[Tuple[int, int, float, datetime]]:
+        """Состояния на момент as_of одним запросом (см. states_as_of_statement)"""
+        stmt = states_as_of_statement(as_of, student_ids, active_only)
+        return [row for row in self.db.execute(stmt).all() if row[2] is not None]
+    
+    def _mastery_from_read_model(self,
+                                 matrix,
+                                 students: List[Student],
+                                 skills: List[Skill],
+                                 now: datetime) -> np.ndarray:
+        return mastery_from_read_model(matrix, students, skills, now, self.forgetting_rate)
+    
+    def _fill_mastery_matrix(self,
+                             students: List[Student],
+                             skills: List[Skill],
+                             states: Sequence[Tuple[int, int, float, datetime]],
+                             now: datetime) -> np.ndarray:
+        return fill_mastery_matrix(students, skills, states, now, self.forgetting_rate)
+    
+    def get_mastery_table(self, as_of: Optional[datetime] = None) -> Tuple[List[dict], List[dict], List[dict]]:
+        students, skills, probabilities = self.get_mastery_matrix(as_of)
+        return self._mastery_table_from_matrix(students, skills, probabilities)
+    
+    def _mastery_table_from_matrix(self,
+                                   students: List[Student],
+                                   skills: List[Skill],
+                                   probabilities: np.ndarray) -> Tuple[List[dict], List[dict], List[dict]]:
+        return mastery_table_from_matrix(students, skills, probabilities)
\ No newline at end of file
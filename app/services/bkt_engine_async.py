@@ -0,0 +1,99 @@
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal
+from app.models.db_models import Student, Skill
+from app.services.bkt_engine import (
+    naive_datetime, knowledge_states_statement, states_as_of_statement,
+    fill_mastery_matrix, mastery_from_read_model, mastery_table_from_matrix, mastery_labels
+)
+from app.services.knowledge_matrix import get_knowledge_matrix
+from app.config import DEFAULT_BKT_PARAMS, BKT_CPU_WORKERS
+
+_cpu_executor: Optional[ThreadPoolExecutor] = None
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        _cpu_executor = ThreadPoolExecutor(max_workers=BKT_CPU_WORKERS, thread_name_prefix="bkt-cpu")
+    return _cpu_executor
+
+def shutdown_cpu_executor():
+    global _cpu_executor
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=True)
+        _cpu_executor = None
+
+async def run_cpu(func: Callable, *args, **kwargs):
+    """
+    Выполняет расчет в отдельном пуле потоков, чтобы цикл событий продолжал
+    обслуживать другие запросы. Отдельный пул не занимает потоки, на которых
+    FastAPI выполняет синхронные обработчики.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), partial(func, *args, **kwargs))
+
+def _ensure_read_model():
+    """Матрица знаний, построенная при первом обращении (синхронной сессией)"""
+    db = SessionLocal()
+    try:
+        return get_knowledge_matrix(db)
+    finally:
+        db.close()
+
+class AsyncBKTEngine:
+    """
+    Чтение освоения из BKTEngine для обработчиков async def.
+    
+    Запросы выполняются через AsyncSession и не блокируют цикл событий,
+    расчеты (заполнение матрицы, сборка таблицы освоения) - в пуле run_cpu.
+    Запросы и формулы общие с BKTEngine, поэтому результаты совпадают.
+    Результаты тестов обрабатывает только очередь задач BKT (bkt_jobs).
+    """
+    
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.forgetting_rate = DEFAULT_BKT_PARAMS["forgetting_rate"]
+    
+    async def get_mastery_matrix(self, as_of: Optional[datetime] = None) -> Tuple[List[Student], List[Skill], np.ndarray]:
+        """BKTEngine.get_mastery_matrix: три запроса, матрица считается в пуле run_cpu"""
+        students = (await self.db.scalars(select(Student).order_by(Student.name))).all()
+        skills = (await self.db.scalars(
+            select(Skill).filter_by(is_active=True).order_by(Skill.name)
+        )).all()
+        
+        if as_of is not None:
+            as_of = naive_datetime(as_of)
+            result = await self.db.execute(states_as_of_statement(as_of))
+            states = [row for row in result.all() if row[2] is not None]
+            now = as_of
+        else:
+            now = datetime.now()
+            matrix = get_knowledge_matrix()
+            if matrix is not None:
+                if not matrix.exists():
+                    matrix = await run_cpu(_ensure_read_model)
+                probabilities = await run_cpu(
+                    mastery_from_read_model, matrix, students, skills, now, self.forgetting_rate
+                )
+                return students, skills, probabilities
+            
+            states = (await self.db.execute(knowledge_states_statement())).all()
+        
+        probabilities = await run_cpu(fill_mastery_matrix, students, skills, states, now, self.forgetting_rate)
+        return students, skills, probabilities
+    
+    async def get_mastery_table(self, as_of: Optional[datetime] = None) -> Tuple[List[dict], List[dict], List[dict]]:
+        students, skills, probabilities = await self.get_mastery_matrix(as_of)
+        return await run_cpu(mastery_table_from_matrix, students, skills, probabilities)
+    
+    async def get_mastery_columns(self, as_of: Optional[datetime] = None) -> Tuple[List[dict], List[dict], np.ndarray]:
+        """Подписи учеников и навыков и сама матрица: для компактных форматов API"""
+        students, skills, probabilities = await self.get_mastery_matrix(as_of)
+        students_data, skills_data = mastery_labels(students, skills)
+        return students_data, skills_data, probabilities
\ No newline at end of file
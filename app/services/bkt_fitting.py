@@ -0,0 +1,252 @@
+import os
+import numpy as np
+from typing import List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.models.db_models import Skill
+from app.services.bkt_engine import group_attempts, new_process_pool
+from app.services.attempt_log import AttemptLog
+from app.services.knowledge_rebuild import load_attempt_arrays
+from app.services.mastery_cache import bump_data_version
+from app.services.data_versions import SKILLS
+from app.config import DEFAULT_BKT_PARAMS
+from app.logger import logger
+
+PARAM_NAMES = ("p_init", "p_learn", "p_guess", "p_slip")
+PARAM_MIN = 0.001
+PARAM_MAX = 0.999
+# Угадывание и ошибка выше 0.5 делают модель вырожденной ("знание" означает незнание)
+MAX_GUESS = 0.5
+MAX_SLIP = 0.5
+
+def _clip_params(p_init: float, p_learn: float, p_guess: float, p_slip: float) -> Tuple[float, float, float, float]:
+    return (
+        float(np.clip(p_init, PARAM_MIN, PARAM_MAX)),
+        float(np.clip(p_learn, PARAM_MIN, PARAM_MAX)),
+        float(np.clip(p_guess, PARAM_MIN, MAX_GUESS)),
+        float(np.clip(p_slip, PARAM_MIN, MAX_SLIP))
+    )
+
+def build_sequences(student_ids: np.ndarray,
+                    is_correct: np.ndarray,
+                    timestamps_us: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Выровненные последовательности ответов одного навыка: строка = студент"""
+    skill_ids = np.zeros(len(student_ids), dtype=np.int64)
+    order, group_index, position, group_starts = group_attempts(student_ids, skill_ids, timestamps_us)
+    
+    shape = (len(group_starts), int(position.max()) + 1 if len(position) else 0)
+    outcomes = np.zeros(shape, dtype=bool)
+    mask = np.zeros(shape, dtype=bool)
+    outcomes[group_index, position] = is_correct[order]
+    mask[group_index, position] = True
+    return outcomes, mask
+
+def forward_backward(outcomes: np.ndarray,
+                     mask: np.ndarray,
+                     p_init: float,
+                     p_learn: float,
+                     p_guess: float,
+                     p_slip: float):
+    """
+    Масштабированный прямой-обратный проход по всем последовательностям сразу.
+    
+    Состояния: 0 - навык не освоен, 1 - освоен. Возвращает апостериорные
+    вероятности состояний gamma (N x T x 2), ожидаемое число переходов
+    0 -> 1 на каждом шаге (N x T) и логарифм правдоподобия.
+    """
+    n, steps = outcomes.shape
+    
+    # Правдоподобие наблюдения в каждом состоянии; на пустых шагах - 1
+    emission = np.empty((n, steps, 2), dtype=np.float64)
+    emission[..., 0] = np.where(outcomes, p_guess, 1 - p_guess)
+    emission[..., 1] = np.where(outcomes, 1 - p_slip, p_slip)
+    emission[~mask] = 1.0
+    
+    alpha = np.empty((n, steps, 2), dtype=np.float64)
+    scale = np.ones((n, steps), dtype=np.float64)
+    
+    alpha_t = np.array([1 - p_init, p_init]) * emission[:, 0]
+    scale[:, 0] = alpha_t.sum(axis=1)
+    alpha[:, 0] = alpha_t / scale[:, 0, None]
+    
+    for t in range(1, steps):
+        prev = alpha[:, t - 1]
+        predicted = np.stack([prev[:, 0] * (1 - p_learn), prev[:, 0] * p_learn + prev[:, 1]], axis=1)
+        alpha_t = predicted * emission[:, t]
+        active = mask[:, t]
+        scale[:, t] = np.where(active, alpha_t.sum(axis=1), 1.0)
+        alpha[:, t] = np.where(active[:, None], alpha_t / scale[:, t, None], prev)
+    
+    beta = np.ones((n, steps, 2), dtype=np.float64)
+    transitions = np.zeros((n, steps), dtype=np.float64)
+    
+    for t in range(steps - 2, -1, -1):
+        active_next = mask[:, t + 1]
+        weighted = emission[:, t + 1] * beta[:, t + 1] / scale[:, t + 1, None]
+        beta_t = np.stack([
+            (1 - p_learn) * weighted[:, 0] + p_learn * weighted[:, 1],
+            weighted[:, 1]
+        ], axis=1)
+        beta[:, t] = np.where(active_next[:, None], beta_t, 1.0)
+        transitions[:, t] = np.where(active_next, alpha[:, t, 0] * p_learn * weighted[:, 1], 0.0)
+    
+    gamma = alpha * beta
+    gamma /= gamma.sum(axis=2, keepdims=True)
+    
+    log_likelihood = float(np.log(scale[mask]).sum())
+    return gamma, transitions, log_likelihood
+
+def fit_sequences(outcomes: np.ndarray,
+                  mask: np.ndarray,
+                  start: Tuple[float, float, float, float],
+                  max_iter: int = 100,
+                  tol: float = 1e-6) -> dict:
+    """EM (Баум-Велш) для одного навыка, начиная с параметров start"""
+    p_init, p_learn, p_guess, p_slip = _clip_params(*start)
+    previous = -np.inf
+    log_likelihood = -np.inf
+    iterations = 0
+    
+    has_next = np.zeros(mask.shape, dtype=bool)
+    has_next[:, :-1] = mask[:, 1:]
+    
+    for iterations in range(1, max_iter + 1):
+        gamma, transitions, log_likelihood = forward_backward(
+            outcomes, mask, p_init, p_learn, p_guess, p_slip
+        )
+        
+        unknown = gamma[..., 0] * mask
+        known = gamma[..., 1] * mask
+        unknown_before_step = (gamma[..., 0] * has_next).sum()
+        
+        p_init = gamma[:, 0, 1].mean()
+        p_learn = transitions.sum() / unknown_before_step if unknown_before_step > 0 else p_learn
+        p_guess = (unknown * outcomes).sum() / unknown.sum() if unknown.sum() > 0 else p_guess
+        p_slip = (known * ~outcomes).sum() / known.sum() if known.sum() > 0 else p_slip
+        p_init, p_learn, p_guess, p_slip = _clip_params(p_init, p_learn, p_guess, p_slip)
+        
+        if abs(log_likelihood - previous) < tol:
+            break
+        previous = log_likelihood
+    
+    # Правдоподобие для итоговых параметров
+    _, _, log_likelihood = forward_backward(outcomes, mask, p_init, p_learn, p_guess, p_slip)
+    
+    return {
+        "p_init": p_init,
+        "p_learn": p_learn,
+        "p_guess": p_guess,
+        "p_slip": p_slip,
+        "log_likelihood": log_likelihood,
+        "iterations": iterations
+    }
+
+def _fit_skill(payload: dict) -> dict:
+    outcomes, mask = build_sequences(
+        payload["student_ids"], payload["is_correct"], payload["timestamps_us"]
+    )
+    
+    best = None
+    for start in payload["starts"]:
+        result = fit_sequences(outcomes, mask, start, payload["max_iter"], payload["tol"])
+        if best is None or result["log_likelihood"] > best["log_likelihood"]:
+            best = result
+    
+    best.update({
+        "skill_id": payload["skill_id"],
+        "sequences": int(outcomes.shape[0]),
+        "attempts": int(mask.sum())
+    })
+    return best
+
+class BKTParameterFitter:
+    """
+    Подбор p_init, p_learn, p_guess, p_slip навыков по всем попыткам учеников.
+    
+    Навыки обучаются независимо и параллельно в пуле процессов. Для каждого
+    навыка EM запускается из текущих параметров и из значений по умолчанию,
+    выбирается результат с наибольшим правдоподобием.
+    """
+    
+    def __init__(self,
+                 db: Session,
+                 workers: Optional[int] = None,
+                 max_iter: int = 100,
+                 tol: float = 1e-6,
+                 min_attempts: int = 20,
+                 attempt_log: Optional[AttemptLog] = None):
+        self.db = db
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_iter = max_iter
+        self.tol = tol
+        self.min_attempts = min_attempts
+        self.attempt_log = attempt_log
+    
+    def _starts(self, skill: Skill) -> List[Tuple[float, float, float, float]]:
+        current = (skill.p_init, skill.p_learn, skill.p_guess, skill.p_slip)
+        defaults = tuple(DEFAULT_BKT_PARAMS[name] for name in PARAM_NAMES)
+        return [current] if current == defaults else [current, defaults]
+    
+    def fit(self, skill_ids: Optional[List[int]] = None) -> List[dict]:
+        query = self.db.query(Skill)
+        if skill_ids is not None:
+            query = query.filter(Skill.id.in_(skill_ids))
+        skills = {skill.id: skill for skill in query.all()}
+        
+        if self.attempt_log is not None:
+            attempts = self.attempt_log.to_attempt_arrays(skill_ids=list(skills))
+        else:
+            attempts = load_attempt_arrays(self.db, skill_ids=list(skills))
+        order = np.argsort(attempts["skill_ids"], kind="stable")
+        sorted_skills = attempts["skill_ids"][order]
+        boundaries = np.flatnonzero(np.diff(sorted_skills)) + 1
+        
+        payloads = []
+        for indices in np.split(order, boundaries):
+            if len(indices) < self.min_attempts:
+                continue
+            skill_id = int(attempts["skill_ids"][indices[0]])
+            payloads.append({
+                "skill_id": skill_id,
+                "student_ids": attempts["student_ids"][indices],
+                "is_correct": attempts["is_correct"][indices],
+                "timestamps_us": attempts["timestamps_us"][indices],
+                "starts": self._starts(skills[skill_id]),
+                "max_iter": self.max_iter,
+                "tol": self.tol
+            })
+        
+        logger.info(f"Подбор параметров BKT: {len(payloads)} навыков, "
+                   f"{len(attempts['skill_ids'])} попыток")
+        
+        if self.workers == 1 or len(payloads) <= 1:
+            results = [_fit_skill(payload) for payload in payloads]
+        else:
+            with new_process_pool(min(self.workers, len(payloads))) as pool:
+                results = list(pool.map(_fit_skill, payloads, chunksize=max(1, len(payloads) // (self.workers * 4))))
+        
+        for result in results:
+            skill = skills[result["skill_id"]]
+            result["skill_name"] = skill.name
+            result["previous"] = {name: getattr(skill, name) for name in PARAM_NAMES}
+        
+        return results
+    
+    def apply(self, results: List[dict]) -> int:
+        """Записывает подобранные параметры в навыки (как update_skill)"""
+        ids = [result["skill_id"] for result in results]
+        skills = {skill.id: skill for skill in self.db.query(Skill).filter(Skill.id.in_(ids)).all()}
+        
+        try:
+            for result in results:
+                skill = skills[result["skill_id"]]
+                for name in PARAM_NAMES:
+                    setattr(skill, name, result[name])
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        bump_data_version(SKILLS)
+        for skill_id in ids:
+            logger.info(f"Навык обновлен: ID {skill_id}")
+        return len(results)
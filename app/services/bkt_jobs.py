@@ -0,0 +1,327 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import exists, func, select, update
+from sqlalchemy.orm import Session, aliased
+from app.database import SessionLocal
+from app.models.db_models import BKTJob, Lease, StudentAttempt, TestItem, TestProcessingState
+from app.services.bkt_engine import BKTEngine
+from app.services.mastery_cache import bump_data_version
+from app.services.data_versions import KNOWLEDGE
+from app.services.leases import acquire_lease, release_lease, lease_owner
+from app.services.metrics import BKT_JOBS, BKT_JOB_WAIT_SECONDS
+from app.config import (
+    BKT_JOB_WORKER_ENABLED, BKT_JOB_MAX_ATTEMPTS, BKT_JOB_RETRY_DELAY_SECONDS, BKT_JOB_POLL_SECONDS,
+    BKT_JOB_CHUNK_SIZE
+)
+from app.logger import logger
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+# Задача в состоянии running дольше этого срока считается брошенной
+# (процесс остановлен во время обработки) и возвращается в очередь
+STALE_JOB_AFTER = timedelta(minutes=30)
+
+# Задачи разных тестов с общими учениками читают и перезаписывают одни
+# и те же состояния знаний, поэтому очередь обрабатывается строго по одной
+# задаче: потребитель - держатель аренды. Срок тот же, что у зависших задач
+JOB_LEASE = "bkt_jobs"
+JOB_LEASE_SECONDS = STALE_JOB_AFTER.total_seconds()
+
+# Пока действует эта аренда, задачи не захватываются: пересчет знаний
+# с нуля переписывает все состояния и отметки тестов (pause_jobs)
+JOB_PAUSE_LEASE = "bkt_jobs_pause"
+
+def new_job(test_id: int, created_by: Optional[int] = None) -> BKTJob:
+    """Задача для добавления в сессию вместе с попытками: фиксируются одним commit"""
+    now = datetime.now()
+    return BKTJob(
+        test_id=test_id,
+        state=JOB_QUEUED,
+        attempts=0,
+        max_attempts=BKT_JOB_MAX_ATTEMPTS,
+        created_by=created_by,
+        created_at=now,
+        run_after=now
+    )
+
+def job_status(job: BKTJob, queued_ahead: Optional[int] = None) -> dict:
+    return {
+        "job_id": job.id,
+        "test_id": job.test_id,
+        "state": job.state,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "queued_ahead": queued_ahead,
+        "updated_count": job.updated_count,
+        "progress": {"done": job.progress_done, "total": job.progress_total}
+        if job.progress_total is not None else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "run_after": job.run_after if job.state == JOB_QUEUED else None,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+def queued_ahead_statement(job: BKTJob):
+    """Число незавершенных задач, созданных раньше"""
+    return select(func.count()).select_from(BKTJob).where(
+        BKTJob.state.in_(ACTIVE_STATES),
+        BKTJob.id < job.id
+    )
+
+def pending_attempts_statement(test_id: int):
+    """Число попыток теста, еще не учтенных в BKT (после отметки теста)"""
+    last_attempt_id = select(TestProcessingState.last_attempt_id).where(
+        TestProcessingState.test_id == test_id
+    ).scalar_subquery()
+    return select(func.count(StudentAttempt.id)).join(
+        TestItem, StudentAttempt.test_item_id == TestItem.id
+    ).where(
+        TestItem.test_id == test_id,
+        TestItem.skill_id.isnot(None),
+        StudentAttempt.id > func.coalesce(last_attempt_id, 0)
+    )
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=BKT_JOB_RETRY_DELAY_SECONDS * 2 ** max(attempts - 1, 0))
+
+def _paused(now: datetime):
+    return exists().where(Lease.name == JOB_PAUSE_LEASE, Lease.expires_at > now)
+
+def _next_job_statement(now: datetime):
+    """
+    Самая ранняя готовая задача, у теста которой нет более ранних
+    незавершенных задач: задачи одного теста выполняются строго по порядку
+    и никогда одновременно, задача на повторе задерживает следующие.
+    """
+    earlier = aliased(BKTJob)
+    return select(BKTJob.id).where(
+        ~_paused(now),
+        BKTJob.state == JOB_QUEUED,
+        BKTJob.run_after <= now,
+        ~exists().where(
+            earlier.test_id == BKTJob.test_id,
+            earlier.id < BKTJob.id,
+            earlier.state.in_(ACTIVE_STATES)
+        )
+    ).order_by(BKTJob.id).limit(1)
+
+def claim_next_job(db: Session, worker: str) -> Optional[BKTJob]:
+    """
+    Переводит следующую задачу в running. Захват - условный UPDATE по
+    state, поэтому из нескольких потоков и процессов задачу получает один;
+    во время паузы очереди UPDATE не срабатывает.
+    """
+    while True:
+        now = datetime.now()
+        job_id = db.scalar(_next_job_statement(now))
+        if job_id is None:
+            db.commit()
+            return None
+        
+        claimed = db.execute(
+            update(BKTJob)
+            .where(BKTJob.id == job_id, BKTJob.state == JOB_QUEUED, ~_paused(now))
+            .values(state=JOB_RUNNING, worker=worker, started_at=now, attempts=BKTJob.attempts + 1)
+        ).rowcount
+        db.commit()
+        if claimed:
+            job = db.get(BKTJob, job_id)
+            job.progress_total = db.scalar(pending_attempts_statement(job.test_id))
+            job.progress_done = 0
+            db.commit()
+            return job
+
+def run_job(db: Session, job: BKTJob) -> bool:
+    """Обрабатывает захваченную задачу; True - успешно"""
+    if job.attempts == 1:
+        BKT_JOB_WAIT_SECONDS.observe((job.started_at - job.created_at).total_seconds())
+    
+    def report_progress(done: int):
+        # Пачка уже зафиксирована: кэши освоения сбрасываются сразу
+        job.progress_done = done
+        db.commit()
+        bump_data_version(KNOWLEDGE)
+    
+    try:
+        # Водяной знак теста делает обработку идемпотентной: повтор
+        # после сбоя учитывает только еще не обработанные попытки
+        updated_count = BKTEngine(db).process_test_results(
+            job.test_id, chunk_size=BKT_JOB_CHUNK_SIZE, progress=report_progress
+        )
+    except Exception as e:
+        db.rollback()
+        job = db.get(BKTJob, job.id)
+        job.error = str(e)
+        if job.attempts < job.max_attempts:
+            job.state = JOB_QUEUED
+            job.run_after = datetime.now() + retry_delay(job.attempts)
+            BKT_JOBS.inc(outcome="retry")
+            logger.warning(f"Задача BKT {job.id} (тест {job.test_id}) будет повторена: {e}")
+        else:
+            job.state = JOB_FAILED
+            job.finished_at = datetime.now()
+            BKT_JOBS.inc(outcome="failed")
+            logger.error(f"Задача BKT {job.id} (тест {job.test_id}) не выполнена за {job.attempts} попыток: {e}")
+        db.commit()
+        return False
+    
+    job.state = JOB_FINISHED
+    job.updated_count = updated_count
+    job.error = None
+    job.finished_at = datetime.now()
+    db.commit()
+    
+    BKT_JOBS.inc(outcome="finished")
+    logger.info(f"Задача BKT {job.id} (тест {job.test_id}) выполнена: {updated_count} обновлений")
+    return True
+
+def run_next_job(worker: str) -> bool:
+    """Захватывает и выполняет одну задачу; False - очередь пуста"""
+    db = SessionLocal()
+    try:
+        job = claim_next_job(db, worker)
+        if job is None:
+            return False
+        run_job(db, job)
+        return True
+    finally:
+        db.close()
+
+def process_pending_jobs(worker: str = "inline", limit: Optional[int] = None) -> int:
+    """
+    Выполняет готовые задачи в текущем потоке (скрипт, бенчмарки), если
+    очередь не обрабатывает другой процесс или поток
+    """
+    owner = f"{lease_owner()}-{worker}"
+    processed = 0
+    try:
+        while limit is None or processed < limit:
+            if not acquire_lease(JOB_LEASE, JOB_LEASE_SECONDS, owner):
+                logger.info("Очередь BKT обрабатывает другой процесс")
+                break
+            if not run_next_job(worker):
+                break
+            processed += 1
+    finally:
+        release_lease(JOB_LEASE, owner)
+    return processed
+
+def pause_jobs(owner: str, ttl_seconds: float, timeout: float) -> bool:
+    """
+    Останавливает захват задач во всех процессах и ждет завершения
+    выполняющихся (кроме зависших дольше STALE_JOB_AFTER). False - пауза
+    уже взята другим владельцем или задачи не завершились за timeout.
+    """
+    if not acquire_lease(JOB_PAUSE_LEASE, ttl_seconds, owner):
+        return False
+    
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            running = db.scalar(select(func.count()).select_from(BKTJob).where(
+                BKTJob.state == JOB_RUNNING,
+                BKTJob.started_at >= datetime.now() - STALE_JOB_AFTER
+            ))
+        finally:
+            db.close()
+        
+        if not running:
+            return True
+        if time.monotonic() >= deadline:
+            release_lease(JOB_PAUSE_LEASE, owner)
+            return False
+        time.sleep(BKT_JOB_POLL_SECONDS)
+
+def resume_jobs(owner: str):
+    release_lease(JOB_PAUSE_LEASE, owner)
+    notify_job_worker()
+
+def recover_stale_jobs(db: Session) -> int:
+    recovered = db.execute(
+        update(BKTJob)
+        .where(BKTJob.state == JOB_RUNNING, BKTJob.started_at < datetime.now() - STALE_JOB_AFTER)
+        .values(state=JOB_QUEUED, run_after=datetime.now())
+    ).rowcount
+    db.commit()
+    if recovered:
+        logger.warning(f"Возвращено в очередь зависших задач BKT: {recovered}")
+    return recovered
+
+class BKTJobWorker:
+    """
+    Поток, выполняющий задачи bkt_jobs по одной. Работает, пока процесс
+    держит аренду JOB_LEASE: из нескольких воркеров uvicorn очередь
+    обрабатывает один. Новые задачи будят поток через notify, задачи из
+    других процессов и отложенные повторы подбираются опросом раз в poll_seconds.
+    """
+    
+    def __init__(self, enabled: bool = BKT_JOB_WORKER_ENABLED, poll_seconds: float = BKT_JOB_POLL_SECONDS):
+        self.enabled = enabled
+        self.poll_seconds = poll_seconds
+        self.owner = f"{lease_owner()}-worker"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def _loop(self):
+        worker = str(os.getpid())
+        while not self._stop.is_set():
+            try:
+                processed = acquire_lease(JOB_LEASE, JOB_LEASE_SECONDS, self.owner) and run_next_job(worker)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика очереди BKT {worker}: {e}")
+                processed = False
+            
+            if not processed:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+        
+        try:
+            release_lease(JOB_LEASE, self.owner)
+        except Exception as e:
+            logger.error(f"Ошибка освобождения аренды очереди BKT: {e}")
+    
+    def start(self):
+        if self._thread is not None or not self.enabled:
+            return
+        
+        db = SessionLocal()
+        try:
+            recover_stale_jobs(db)
+        finally:
+            db.close()
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="bkt-jobs", daemon=True)
+        self._thread.start()
+        logger.info("Запущен обработчик очереди BKT")
+    
+    def notify(self):
+        self._wake.set()
+    
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+job_worker = BKTJobWorker()
+
+def start_job_worker():
+    job_worker.start()
+
+def stop_job_worker():
+    job_worker.stop()
+
+def notify_job_worker():
+    job_worker.notify()
\ No newline at end of file
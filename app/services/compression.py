@@ -0,0 +1,148 @@
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from app.config import COMPRESSION_MINIMUM_SIZE, GZIP_COMPRESSLEVEL, BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Не сжимаются: уже сжатые и потоковые события
+SKIP_CONTENT_TYPES = ("text/event-stream", "application/zip", "application/gzip", "image/")
+
+def supported_encodings() -> tuple:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Кодировка по Accept-Encoding: наибольший q, при равных - br раньше gzip.
+    q=0 запрещает кодировку, * относится к неперечисленным.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def weak_etag(etag: str) -> str:
+    """
+    ETag строится по несжатому телу: сжатый вариант ему не равен побайтно,
+    поэтому остается только слабый валидатор (сравнение If-None-Match слабое)
+    """
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._zlib.compress(data)
+    
+    def flush(self) -> bytes:
+        # Для потоковых ответов: клиент получает каждый блок сразу
+        return self._brotli.flush() if self._brotli else self._zlib.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware: сжатие gzip или brotli (если установлен пакет brotli)
+    по Accept-Encoding. Ответы меньше minimum_size, без тела (204, 304) и
+    уже сжатые передаются как есть. Потоковые ответы (выгрузка освоения)
+    сжимаются по блокам. ETag сжатого ответа и 304 (клиент мог сохранить
+    сжатый вариант) становится слабым.
+    """
+    
+    def __init__(self, app,
+                 minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 gzip_level: int = GZIP_COMPRESSLEVEL,
+                 brotli_quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        state = {"start": None, "compressor": None, "passthrough": False}
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            
+            if state["compressor"] is None:
+                start = state["start"]
+                headers = MutableHeaders(raw=start["headers"])
+                content_type = headers.get("content-type", "")
+                if start["status"] == 304 and "etag" in headers:
+                    headers["ETag"] = weak_etag(headers["etag"])
+                if ("content-encoding" in headers
+                        or start["status"] in (204, 304)
+                        or content_type.startswith(SKIP_CONTENT_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                state["compressor"] = compressor
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = weak_etag(headers["etag"])
+                
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                await send(start)
+            
+            compressor = state["compressor"]
+            data = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+        
+        await self.app(scope, receive, send_wrapper)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+from fastapi import Request, Response
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import engine, async_engine
+from app.models.db_models import DataVersion
+from app.logger import logger
+
+STUDENTS = "students"
+SKILLS = "skills"
+KNOWLEDGE = "knowledge"
+DATA_TABLES = (STUDENTS, SKILLS, KNOWLEDGE)
+MASTERY_TABLES = DATA_TABLES
+
+Validators = Tuple[str, Optional[datetime]]
+
+class DataState(NamedTuple):
+    """
+    Состояние данных, от которого зависит тело ответа: key - пары
+    (таблица, версия) и номер интервала. Входит и в ETag, и в ключ
+    кэша таблиц освоения, поэтому тело и валидатор всегда совпадают.
+    """
+    key: Tuple[Tuple[str, int], ...]
+    last_modified: Optional[datetime]
+
+def _bump_statements(conn, tables: Sequence[str]):
+    now = datetime.now()
+    for name in tables:
+        updated = conn.execute(
+            update(DataVersion)
+            .where(DataVersion.name == name)
+            .values(version=DataVersion.version + 1, updated_at=now)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(DataVersion).values(name=name, version=1, updated_at=now))
+
+def bump_table_versions(tables: Sequence[str] = DATA_TABLES):
+    """
+    Увеличивает счетчики таблиц в базе: их видят все процессы, включая
+    скрипты. Вызывается после commit изменений; ошибка только логируется,
+    ETag тогда обновится со следующим изменением.
+    """
+    try:
+        with engine.begin() as conn:
+            _bump_statements(conn, tables)
+    except Exception as e:
+        logger.error(f"Ошибка обновления версий данных {tables}: {e}")
+
+async def bump_table_versions_async(tables: Sequence[str] = DATA_TABLES):
+    try:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(_bump_statements, tables)
+    except Exception as e:
+        logger.error(f"Ошибка обновления версий данных {tables}: {e}")
+
+async def table_versions(db: AsyncSession, tables: Sequence[str]) -> Dict[str, Tuple[int, datetime]]:
+    rows = await db.execute(
+        select(DataVersion.name, DataVersion.version, DataVersion.updated_at)
+        .where(DataVersion.name.in_(tables))
+    )
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+async def data_state(db: AsyncSession,
+                     tables: Sequence[str],
+                     epoch_seconds: Optional[float] = None) -> DataState:
+    """
+    Счетчики таблиц одним запросом к data_versions.
+    
+    epoch_seconds - для ответов с забыванием: значения меняются со временем
+    и без записи, поэтому к версии добавляется номер интервала (столько же
+    живет запись в кэше таблицы освоения).
+    """
+    versions = await table_versions(db, tables)
+    key = tuple((name, versions.get(name, (0, None))[0]) for name in tables)
+    
+    modified = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    if epoch_seconds:
+        epoch = int(time.time() // epoch_seconds)
+        key += (("epoch", epoch),)
+        modified.append(datetime.fromtimestamp(epoch * epoch_seconds))
+    
+    return DataState(key, max(modified) if modified else None)
+
+def state_validators(state: DataState, extra: str = "") -> Validators:
+    """ETag и Last-Modified; extra - параметры запроса, от которых зависит тело"""
+    parts = [f"{name}:{version}" for name, version in state.key]
+    parts.append(extra)
+    
+    digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+    # Слабый тег: тело может отдаваться сжатым
+    return f'W/"{digest}"', state.last_modified
+
+async def data_validators(db: AsyncSession,
+                          tables: Sequence[str],
+                          epoch_seconds: Optional[float] = None,
+                          extra: str = "") -> Validators:
+    return state_validators(await data_state(db, tables, epoch_seconds), extra)
+
+def _http_date(value: datetime) -> str:
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def validator_headers(validators: Validators) -> Dict[str, str]:
+    etag, last_modified = validators
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    return headers
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request: Request, validators: Validators) -> bool:
+    """If-None-Match (слабое сравнение), без него - If-Modified-Since"""
+    etag, last_modified = validators
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        return _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    
+    return False
+
+def not_modified_response(validators: Validators) -> Response:
+    return Response(status_code=304, headers=validator_headers(validators))
\ No newline at end of file
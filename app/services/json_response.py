@@ -0,0 +1,39 @@
+import json
+import numpy as np
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """
+    JSON в байтах: orjson, если установлен, иначе json из стандартной
+    библиотеки. Ключи-числа (mastery по skill_id), даты и массивы numpy
+    кодируются так же, как в jsonable_encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+class ORJSONResponse(JSONResponse):
+    """
+    Ответ для больших JSON. Обработчик возвращает экземпляр сам: тогда
+    FastAPI не прогоняет результат через jsonable_encoder, который обходит
+    каждое значение и для таблицы освоения занимает основное время.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
\ No newline at end of file
@@ -0,0 +1,218 @@
+import json
+import os
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+from app.models.db_models import StudentKnowledgeState
+from app.config import KNOWLEDGE_MATRIX_ENABLED, KNOWLEDGE_MATRIX_DIR
+from app.logger import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INITIAL_ROWS = 1024
+INITIAL_COLS = 64
+
+def _epoch_seconds(values: Sequence[datetime]) -> np.ndarray:
+    dates = np.array([value.replace(tzinfo=None) for value in values], dtype="datetime64[s]")
+    return dates.astype(np.int64).astype(np.uint32)
+
+class KnowledgeMatrix:
+    """
+    Модель чтения состояний знаний в memory-mapped файлах.
+    
+    probability.npy - float32 (ученик x навык), NaN там, где состояния нет;
+    last_updated.npy - uint32, секунды от эпохи; index.json - соответствие
+    id -> строка/столбец. Файлы отображаются в память со всех воркеров,
+    запись идет под файловой блокировкой, чтение - без нее.
+    """
+    
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._probability = None
+        self._last_updated = None
+        self._student_rows: Dict[int, int] = {}
+        self._skill_cols: Dict[int, int] = {}
+        self._index_mtime = None
+    
+    @property
+    def _index_path(self) -> Path:
+        return self.directory / "index.json"
+    
+    @contextmanager
+    def _write_lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reload_if_changed()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def exists(self) -> bool:
+        return self._index_path.exists()
+    
+    def _reload_if_changed(self):
+        try:
+            mtime = self._index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._probability = None
+            self._index_mtime = None
+            return
+        
+        if mtime == self._index_mtime and self._probability is not None:
+            return
+        
+        index = json.loads(self._index_path.read_text())
+        self._student_rows = {student_id: i for i, student_id in enumerate(index["students"])}
+        self._skill_cols = {skill_id: j for j, skill_id in enumerate(index["skills"])}
+        self._probability = np.load(self.directory / "probability.npy", mmap_mode="r+")
+        self._last_updated = np.load(self.directory / "last_updated.npy", mmap_mode="r+")
+        self._index_mtime = mtime
+    
+    def _write_index(self):
+        index = {
+            "students": sorted(self._student_rows, key=self._student_rows.get),
+            "skills": sorted(self._skill_cols, key=self._skill_cols.get)
+        }
+        tmp_path = self._index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(index))
+        os.replace(tmp_path, self._index_path)
+        self._index_mtime = self._index_path.stat().st_mtime_ns
+    
+    def _allocate(self, rows: int, cols: int):
+        """Создает файлы нужной емкости, переносит данные и атомарно подменяет старые"""
+        probability = np.lib.format.open_memmap(
+            self.directory / "probability.npy.tmp", mode="w+", dtype=np.float32, shape=(rows, cols)
+        )
+        last_updated = np.lib.format.open_memmap(
+            self.directory / "last_updated.npy.tmp", mode="w+", dtype=np.uint32, shape=(rows, cols)
+        )
+        probability[:] = np.nan
+        last_updated[:] = 0
+        
+        if self._probability is not None:
+            old_rows, old_cols = self._probability.shape
+            probability[:old_rows, :old_cols] = self._probability
+            last_updated[:old_rows, :old_cols] = self._last_updated
+        
+        probability.flush()
+        last_updated.flush()
+        os.replace(self.directory / "probability.npy.tmp", self.directory / "probability.npy")
+        os.replace(self.directory / "last_updated.npy.tmp", self.directory / "last_updated.npy")
+        self._probability = probability
+        self._last_updated = last_updated
+    
+    def _positions(self, mapping: Dict[int, int], ids: Sequence[int]) -> np.ndarray:
+        for item_id in ids:
+            if item_id not in mapping:
+                mapping[item_id] = len(mapping)
+        return np.array([mapping[item_id] for item_id in ids], dtype=np.int64)
+    
+    def update(self,
+               student_ids: Sequence[int],
+               skill_ids: Sequence[int],
+               probabilities: Sequence[float],
+               last_updated: Sequence[datetime]):
+        if not len(student_ids):
+            return
+        
+        with self._write_lock():
+            known = (len(self._student_rows), len(self._skill_cols))
+            rows = self._positions(self._student_rows, [int(s) for s in student_ids])
+            cols = self._positions(self._skill_cols, [int(s) for s in skill_ids])
+            
+            shape = self._probability.shape if self._probability is not None else (0, 0)
+            if len(self._student_rows) > shape[0] or len(self._skill_cols) > shape[1]:
+                self._allocate(
+                    max(INITIAL_ROWS, shape[0], 1 << (len(self._student_rows) - 1).bit_length()),
+                    max(INITIAL_COLS, shape[1], 1 << (len(self._skill_cols) - 1).bit_length())
+                )
+            
+            self._probability[rows, cols] = np.asarray(probabilities, dtype=np.float32)
+            self._last_updated[rows, cols] = _epoch_seconds(last_updated)
+            self._probability.flush()
+            self._last_updated.flush()
+            
+            if (len(self._student_rows), len(self._skill_cols)) != known or not self.exists():
+                self._write_index()
+    
+    def read(self, student_ids: Sequence[int], skill_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Подматрица для заданных учеников и навыков: вероятности (NaN - нет
+        состояния) и время обновления в секундах от эпохи.
+        """
+        self._reload_if_changed()
+        shape = (len(student_ids), len(skill_ids))
+        probability = np.full(shape, np.nan, dtype=np.float32)
+        last_updated = np.zeros(shape, dtype=np.uint32)
+        
+        if self._probability is None:
+            return probability, last_updated
+        
+        rows = np.array([self._student_rows.get(s, -1) for s in student_ids], dtype=np.int64)
+        cols = np.array([self._skill_cols.get(s, -1) for s in skill_ids], dtype=np.int64)
+        row_mask = rows >= 0
+        col_mask = cols >= 0
+        
+        selected = np.ix_(np.flatnonzero(row_mask), np.flatnonzero(col_mask))
+        source = np.ix_(rows[row_mask], cols[col_mask])
+        probability[selected] = self._probability[source]
+        last_updated[selected] = self._last_updated[source]
+        return probability, last_updated
+    
+    def student_row(self, student_id: int) -> Optional[Tuple[np.ndarray, np.ndarray, List[int]]]:
+        """Строка ученика без копирования (view на отображенные страницы)"""
+        self._reload_if_changed()
+        row = self._student_rows.get(student_id)
+        if row is None or self._probability is None:
+            return None
+        n_skills = len(self._skill_cols)
+        skill_ids = sorted(self._skill_cols, key=self._skill_cols.get)
+        return self._probability[row, :n_skills], self._last_updated[row, :n_skills], skill_ids
+    
+    def rebuild(self, db: Session) -> int:
+        """Полностью заполняет матрицу из student_knowledge_states"""
+        states = db.query(
+            StudentKnowledgeState.student_id,
+            StudentKnowledgeState.skill_id,
+            StudentKnowledgeState.probability_knowing,
+            StudentKnowledgeState.last_updated
+        ).all()
+        
+        with self._write_lock():
+            self._student_rows = {}
+            self._skill_cols = {}
+            self._probability = None
+            self._last_updated = None
+            self._allocate(INITIAL_ROWS, INITIAL_COLS)
+            self._write_index()
+        
+        if states:
+            student_ids, skill_ids, probabilities, last_updated = zip(*states)
+            now = datetime.now()
+            self.update(student_ids, skill_ids, probabilities, [value or now for value in last_updated])
+        
+        logger.info(f"Матрица знаний перестроена: {len(states)} состояний")
+        return len(states)
+
+_knowledge_matrix: Optional[KnowledgeMatrix] = None
+
+def get_knowledge_matrix(db: Optional[Session] = None) -> Optional[KnowledgeMatrix]:
+    """Общая матрица процесса или None, если модель чтения выключена"""
+    global _knowledge_matrix
+    if not KNOWLEDGE_MATRIX_ENABLED:
+        return None
+    if _knowledge_matrix is None:
+        _knowledge_matrix = KnowledgeMatrix(KNOWLEDGE_MATRIX_DIR)
+    if db is not None and not _knowledge_matrix.exists():
+        _knowledge_matrix.rebuild(db)
+    return _knowledge_matrix
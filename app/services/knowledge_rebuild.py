@@ -0,0 +1,504 @@
+import os
+import numpy as np
+from concurrent.futures import as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select, insert, func
+from sqlalchemy.orm import Session
+from app.models.db_models import (
+    Skill, Student, StudentAttempt, TestItem,
+    StudentKnowledgeState, KnowledgeHistory, TestProcessingState, MasterySnapshot
+)
+from app.services.bkt_engine import (
+    group_attempts, replay_sequences, insert_knowledge_history, new_process_pool, _chunks
+)
+from app.services.attempt_log import AttemptLog
+from app.services.mastery_cache import bump_data_version
+from app.services.bkt_jobs import new_job, notify_job_worker, pause_jobs, resume_jobs
+from app.services.leases import lease_owner
+from app.services.data_versions import KNOWLEDGE
+from app.services.knowledge_matrix import get_knowledge_matrix
+from app.config import DEFAULT_BKT_PARAMS
+from app.logger import logger
+
+REBUILD_CHUNK_SIZE = 50000
+REPLAY_MAX_CELLS = 4_000_000
+DAY_US = 86400 * 1_000_000
+
+# Очередь BKT стоит на паузе от чтения попыток до записи. Срок аренды
+# паузы с запасом покрывает пересчет, ожидание выполняющихся задач - нет
+REBUILD_PAUSE_SECONDS = 2 * 3600
+REBUILD_WAIT_JOBS_SECONDS = 300
+
+ProgressCallback = Callable[[str, int, int], None]
+
+def _skill_param_arrays(skill_ids: np.ndarray, params: Dict[int, Tuple[float, float, float, float]]):
+    """p_init, p_learn, p_guess, p_slip для каждого элемента skill_ids"""
+    known = np.array(sorted(params), dtype=np.int64)
+    table = np.array([params[k] for k in known], dtype=np.float64).reshape(-1, 4)
+    
+    index = np.searchsorted(known, skill_ids)
+    index = np.clip(index, 0, max(len(known) - 1, 0))
+    if len(known) == 0 or np.any(known[index] != skill_ids):
+        missing = sorted(set(skill_ids.tolist()) - set(known.tolist()))
+        raise ValueError(f"Skills not found: {missing}")
+    
+    values = table[index]
+    return values[:, 0], values[:, 1], values[:, 2], values[:, 3]
+
+def replay_attempt_log(student_ids: np.ndarray,
+                       skill_ids: np.ndarray,
+                       is_correct: np.ndarray,
+                       timestamps_us: np.ndarray,
+                       params: Dict[int, Tuple[float, float, float, float]],
+                       forgetting_rate: float,
+                       min_probability: float,
+                       max_cells: int = REPLAY_MAX_CELLS) -> Dict[str, np.ndarray]:
+    """
+    Прогон BKT по журналу попыток с нуля, в памяти.
+    
+    Каждая пара студент-навык начинается с p_init навыка, забывание перед
+    попыткой считается по дням с предыдущей попытки этой пары - так, как
+    если бы каждый тест обрабатывался сразу после проведения. BKTEngine
+    считает дни от предыдущей попытки до момента обработки, поэтому для
+    попыток, учтенных позже дня проведения (импорт журналов, повтор
+    задачи), живые вероятности сильнее смещены забыванием к p_init.
+    timestamps_us - время попыток в микросекундах от эпохи.
+    Возвращает итоговые состояния (state_*) и историю (hist_*) в виде массивов.
+    """
+    n = len(student_ids)
+    if n == 0:
+        empty_i = np.zeros(0, dtype=np.int64)
+        empty_f = np.zeros(0, dtype=np.float64)
+        return {
+            "state_student": empty_i, "state_skill": empty_i, "state_prob": empty_f,
+            "state_total": empty_i, "state_correct": empty_i, "state_last_ts": empty_i,
+            "hist_student": empty_i, "hist_skill": empty_i, "hist_prob": empty_f,
+            "hist_ts": empty_i
+        }
+    
+    order, group_index, position, group_starts = group_attempts(
+        student_ids, skill_ids, timestamps_us
+    )
+    
+    sorted_correct = is_correct[order]
+    sorted_ts = timestamps_us[order]
+    n_groups = len(group_starts)
+    lengths = np.diff(np.append(group_starts, n))
+    
+    group_students = student_ids[order][group_starts]
+    group_skills = skill_ids[order][group_starts]
+    p_init, p_learn, p_guess, p_slip = _skill_param_arrays(group_skills, params)
+    
+    final = np.empty(n_groups, dtype=np.float64)
+    history_values = np.empty(n, dtype=np.float64)
+    
+    # Группы обрабатываются кусками, чтобы выровненные матрицы не росли без предела
+    start = 0
+    while start < n_groups:
+        end = start + 1
+        longest = lengths[start]
+        while end < n_groups and (end - start + 1) * max(longest, lengths[end]) <= max_cells:
+            longest = max(longest, lengths[end])
+            end += 1
+        
+        lo = group_starts[start]
+        hi = group_starts[end] if end < n_groups else n
+        local_group = group_index[lo:hi] - start
+        local_position = position[lo:hi]
+        
+        shape = (end - start, int(longest))
+        outcomes = np.zeros(shape, dtype=bool)
+        mask = np.zeros(shape, dtype=bool)
+        ts = np.zeros(shape, dtype=np.int64)
+        
+        outcomes[local_group, local_position] = sorted_correct[lo:hi]
+        mask[local_group, local_position] = True
+        ts[local_group, local_position] = sorted_ts[lo:hi]
+        
+        days = np.zeros(shape, dtype=np.float64)
+        if shape[1] > 1:
+            days[:, 1:] = np.where(mask[:, 1:], (ts[:, 1:] - ts[:, :-1]) // DAY_US, 0)
+        
+        chunk_final, chunk_history = replay_sequences(
+            p_init[start:end], outcomes, days, mask,
+            p_learn[start:end], p_guess[start:end], p_slip[start:end],
+            forgetting_rate, min_probability
+        )
+        
+        final[start:end] = chunk_final
+        history_values[lo:hi] = chunk_history[mask]
+        start = end
+    
+    group_of_attempt = np.repeat(np.arange(n_groups), lengths)
+    corrects = np.bincount(group_of_attempt, weights=sorted_correct, minlength=n_groups)
+    
+    return {
+        "state_student": group_students,
+        "state_skill": group_skills,
+        "state_prob": final,
+        "state_total": lengths.astype(np.int64),
+        "state_correct": corrects.astype(np.int64),
+        "state_last_ts": sorted_ts[group_starts + lengths - 1],
+        "hist_student": student_ids[order],
+        "hist_skill": skill_ids[order],
+        "hist_prob": history_values,
+        "hist_ts": sorted_ts
+    }
+
+def _replay_shard(payload: dict) -> Dict[str, np.ndarray]:
+    return replay_attempt_log(**payload)
+
+def _merge_results(results: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    if not results:
+        return replay_attempt_log(
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64), {}, 0.0, 0.0
+        )
+    return {key: np.concatenate([r[key] for r in results]) for key in results[0]}
+
+def _to_datetimes(timestamps_us: np.ndarray) -> np.ndarray:
+    return timestamps_us.astype("datetime64[us]").astype(datetime)
+
+def load_attempt_arrays(db: Session,
+                        chunk_size: int = REBUILD_CHUNK_SIZE,
+                        skill_ids: Optional[List[int]] = None,
+                        progress: Optional[ProgressCallback] = None,
+                        max_attempt_id: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Журнал попыток (student_ids, skill_ids, is_correct, timestamps_us) в виде
+    массивов. Строки читаются потоком в хронологическом порядке.
+    max_attempt_id - граница: попытки, сохраненные позже, не читаются.
+    """
+    conditions = [TestItem.skill_id.isnot(None)]
+    if skill_ids is not None:
+        conditions.append(TestItem.skill_id.in_(skill_ids))
+    if max_attempt_id is not None:
+        conditions.append(StudentAttempt.id <= max_attempt_id)
+    
+    total = db.query(func.count(StudentAttempt.id)).join(TestItem).filter(
+        *conditions
+    ).scalar() or 0
+    
+    stmt = select(
+        StudentAttempt.student_id,
+        TestItem.skill_id,
+        StudentAttempt.is_correct,
+        StudentAttempt.created_at
+    ).join(
+        TestItem, StudentAttempt.test_item_id == TestItem.id
+    ).where(
+        *conditions
+    ).order_by(
+        StudentAttempt.created_at, StudentAttempt.id
+    ).execution_options(yield_per=chunk_size)
+    
+    columns = {"student_ids": [], "skill_ids": [], "is_correct": [], "timestamps_us": []}
+    loaded = 0
+    
+    for rows in db.execute(stmt).partitions():
+        columns["student_ids"].append(np.array([r[0] for r in rows], dtype=np.int64))
+        columns["skill_ids"].append(np.array([r[1] for r in rows], dtype=np.int64))
+        columns["is_correct"].append(np.array([bool(r[2]) for r in rows], dtype=bool))
+        columns["timestamps_us"].append(
+            np.array([r[3].replace(tzinfo=None) for r in rows], dtype="datetime64[us]").astype(np.int64)
+        )
+        loaded += len(rows)
+        if progress:
+            progress("load", loaded, total)
+    
+    empty = {"student_ids": np.int64, "skill_ids": np.int64, "is_correct": bool, "timestamps_us": np.int64}
+    return {
+        key: np.concatenate(parts) if parts else np.zeros(0, dtype=empty[key])
+        for key, parts in columns.items()
+    }
+
+class KnowledgeRebuilder:
+    """
+    Пересчет student_knowledge_states и knowledge_history с нуля по всем попыткам.
+    
+    Попытки читаются потоком в хронологическом порядке, делятся на шарды по
+    student_id и прогоняются в пуле процессов; результат записывается одной
+    транзакцией. В режиме dry_run база не меняется, возвращается сравнение
+    с текущими состояниями. С attempt_log попытки читаются из колоночного
+    журнала вместо базы.
+    
+    На время пересчета очередь BKT ставится на паузу во всех процессах:
+    задача, зафиксированная между чтением и записью, была бы учтена дважды.
+    Забывание считается по дням между попытками (см. replay_attempt_log).
+    """
+    
+    def __init__(self,
+                 db: Session,
+                 workers: Optional[int] = None,
+                 chunk_size: int = REBUILD_CHUNK_SIZE,
+                 progress: Optional[ProgressCallback] = None,
+                 attempt_log: Optional[AttemptLog] = None):
+        self.db = db
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.attempt_log = attempt_log
+        self.forgetting_rate = DEFAULT_BKT_PARAMS["forgetting_rate"]
+        self.min_probability = DEFAULT_BKT_PARAMS["p_init"]
+        # Последняя попытка на момент чтения: пересчет и отметки тестов не заходят дальше
+        self.max_attempt_id = 0
+    
+    def _report(self, stage: str, done: int, total: int):
+        if self.progress:
+            self.progress(stage, done, total)
+    
+    def load_skill_params(self) -> Dict[int, Tuple[float, float, float, float]]:
+        rows = self.db.query(
+            Skill.id, Skill.p_init, Skill.p_learn, Skill.p_guess, Skill.p_slip
+        ).all()
+        return {row[0]: tuple(row[1:]) for row in rows}
+    
+    def load_attempts(self) -> Dict[str, np.ndarray]:
+        self.max_attempt_id = self.db.scalar(select(func.max(StudentAttempt.id))) or 0
+        if self.attempt_log is None:
+            return load_attempt_arrays(
+                self.db, chunk_size=self.chunk_size, progress=self._report,
+                max_attempt_id=self.max_attempt_id
+            )
+        
+        # Журнал догружается до текущего состояния базы, чтобы отметки тестов совпали с пересчетом
+        self.attempt_log.export(self.db)
+        student_ids = [row[0] for row in self.db.query(Student.id).all()]
+        skill_ids = [row[0] for row in self.db.query(Skill.id).all()]
+        attempts = self.attempt_log.to_attempt_arrays(
+            skill_ids=skill_ids, student_ids=student_ids, max_attempt_id=self.max_attempt_id
+        )
+        self._report("load", len(attempts["student_ids"]), len(attempts["student_ids"]))
+        return attempts
+    
+    def replay(self, attempts: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        params = self.load_skill_params()
+        shard_of = attempts["student_ids"] % self.workers
+        
+        payloads = []
+        for shard in range(self.workers):
+            selected = shard_of == shard
+            if not np.any(selected):
+                continue
+            payloads.append({
+                "student_ids": attempts["student_ids"][selected],
+                "skill_ids": attempts["skill_ids"][selected],
+                "is_correct": attempts["is_correct"][selected],
+                "timestamps_us": attempts["timestamps_us"][selected],
+                "params": params,
+                "forgetting_rate": self.forgetting_rate,
+                "min_probability": self.min_probability
+            })
+        
+        results = []
+        if self.workers == 1 or len(payloads) <= 1:
+            for payload in payloads:
+                results.append(_replay_shard(payload))
+                self._report("replay", len(results), len(payloads))
+        else:
+            with new_process_pool(min(self.workers, len(payloads))) as pool:
+                futures = [pool.submit(_replay_shard, payload) for payload in payloads]
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    self._report("replay", len(results), len(payloads))
+        
+        return _merge_results(results)
+    
+    def diff(self, rebuilt: Dict[str, np.ndarray], top: int = 20) -> dict:
+        current = {
+            (row[0], row[1]): row[2:]
+            for row in self.db.query(
+                StudentKnowledgeState.student_id,
+                StudentKnowledgeState.skill_id,
+                StudentKnowledgeState.probability_knowing,
+                StudentKnowledgeState.total_attempts,
+                StudentKnowledgeState.correct_attempts
+            ).all()
+        }
+        
+        changes = []
+        new_pairs = 0
+        unchanged = 0
+        seen = set()
+        
+        for student_id, skill_id, prob, total, correct in zip(
+            rebuilt["state_student"].tolist(), rebuilt["state_skill"].tolist(),
+            rebuilt["state_prob"].tolist(), rebuilt["state_total"].tolist(),
+            rebuilt["state_correct"].tolist()
+        ):
+            key = (student_id, skill_id)
+            seen.add(key)
+            old = current.get(key)
+            if old is None:
+                new_pairs += 1
+                continue
+            
+            old_prob, old_total, old_correct = old
+            delta = prob - (old_prob or 0.0)
+            if abs(delta) > 1e-9 or old_total != total or old_correct != correct:
+                changes.append({
+                    "student_id": student_id,
+                    "skill_id": skill_id,
+                    "old_probability": old_prob,
+                    "new_probability": prob,
+                    "old_total_attempts": old_total,
+                    "new_total_attempts": total,
+                    "delta": delta
+                })
+            else:
+                unchanged += 1
+        
+        deltas = np.array([abs(c["delta"]) for c in changes], dtype=np.float64)
+        changes.sort(key=lambda c: abs(c["delta"]), reverse=True)
+        
+        return {
+            "pairs_rebuilt": len(rebuilt["state_student"]),
+            "pairs_current": len(current),
+            "new_pairs": new_pairs,
+            "removed_pairs": len(set(current) - seen),
+            "changed_pairs": len(changes),
+            "unchanged_pairs": unchanged,
+            "max_abs_diff": float(deltas.max()) if len(deltas) else 0.0,
+            "mean_abs_diff": float(deltas.mean()) if len(deltas) else 0.0,
+            "top_changes": changes[:top]
+        }
+    
+    def write(self, rebuilt: Dict[str, np.ndarray]) -> dict:
+        """Заменяет состояния, историю и отметки обработки тестов одной транзакцией"""
+        try:
+            self.db.query(KnowledgeHistory).delete(synchronize_session=False)
+            self.db.query(MasterySnapshot).delete(synchronize_session=False)
+            self.db.query(StudentKnowledgeState).delete(synchronize_session=False)
+            
+            state_rows = [
+                {
+                    "student_id": student_id,
+                    "skill_id": skill_id,
+                    "probability_knowing": prob,
+                    "total_attempts": total,
+                    "correct_attempts": correct,
+                    "last_updated": last_updated
+                }
+                for student_id, skill_id, prob, total, correct, last_updated in zip(
+                    rebuilt["state_student"].tolist(), rebuilt["state_skill"].tolist(),
+                    rebuilt["state_prob"].tolist(), rebuilt["state_total"].tolist(),
+                    rebuilt["state_correct"].tolist(), _to_datetimes(rebuilt["state_last_ts"])
+                )
+            ]
+            total_rows = len(state_rows) + len(rebuilt["hist_student"])
+            written = 0
+            
+            for chunk in _chunks(state_rows, self.chunk_size):
+                self.db.execute(insert(StudentKnowledgeState.__table__), chunk)
+                written += len(chunk)
+                self._report("write", written, total_rows)
+            
+            for start in range(0, len(rebuilt["hist_student"]), self.chunk_size):
+                window = slice(start, start + self.chunk_size)
+                history_rows = [
+                    {
+                        "student_id": student_id,
+                        "skill_id": skill_id,
+                        "probability": prob,
+                        "recorded_at": recorded_at
+                    }
+                    for student_id, skill_id, prob, recorded_at in zip(
+                        rebuilt["hist_student"][window].tolist(),
+                        rebuilt["hist_skill"][window].tolist(),
+                        rebuilt["hist_prob"][window].tolist(),
+                        _to_datetimes(rebuilt["hist_ts"][window])
+                    )
+                ]
+                written += insert_knowledge_history(self.db, history_rows)
+                self._report("write", written, total_rows)
+            
+            # Попытки до max_attempt_id учтены, инкрементальная обработка продолжит с них
+            self.db.query(TestProcessingState).delete(synchronize_session=False)
+            watermarks = self.db.query(
+                TestItem.test_id,
+                func.max(StudentAttempt.id),
+                func.count(StudentAttempt.id)
+            ).join(
+                StudentAttempt, StudentAttempt.test_item_id == TestItem.id
+            ).filter(
+                StudentAttempt.id <= self.max_attempt_id
+            ).group_by(
+                TestItem.test_id
+            ).all()
+            
+            watermark_rows = [
+                {"test_id": test_id, "last_attempt_id": last_id, "processed_attempts": count}
+                for test_id, last_id, count in watermarks
+            ]
+            if watermark_rows:
+                self.db.execute(insert(TestProcessingState.__table__), watermark_rows)
+            
+            # Попытки, сохраненные во время пересчета, в него не вошли, а их
+            # обработка (если успела пройти) стерта вместе с состояниями:
+            # тесты ставятся в очередь заново
+            late_tests = [
+                row[0] for row in self.db.query(TestItem.test_id).join(
+                    StudentAttempt, StudentAttempt.test_item_id == TestItem.id
+                ).filter(
+                    StudentAttempt.id > self.max_attempt_id
+                ).distinct().all()
+            ]
+            for test_id in late_tests:
+                self.db.add(new_job(test_id))
+            
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            logger.error("Пересчет состояний знаний отменен, изменения откачены")
+            raise
+        
+        if late_tests:
+            logger.warning(f"Попытки после начала пересчета: тесты {late_tests} поставлены в очередь BKT")
+            notify_job_worker()
+        
+        return {
+            "states_written": len(state_rows),
+            "history_written": int(len(rebuilt["hist_student"])),
+            "tests_marked": len(watermark_rows),
+            "tests_requeued": len(late_tests)
+        }
+    
+    def run(self, dry_run: bool = False) -> dict:
+        started = datetime.now()
+        logger.info(f"Пересчет состояний знаний: workers={self.workers}, dry_run={dry_run}")
+        
+        if dry_run:
+            report = self._rebuild(dry_run)
+        else:
+            owner = f"{lease_owner()}-rebuild"
+            if not pause_jobs(owner, REBUILD_PAUSE_SECONDS, REBUILD_WAIT_JOBS_SECONDS):
+                raise RuntimeError("Очередь BKT не остановлена: идет другой пересчет или задачи не завершились")
+            try:
+                report = self._rebuild(dry_run)
+            finally:
+                resume_jobs(owner)
+        
+        report["seconds"] = round((datetime.now() - started).total_seconds(), 3)
+        logger.info(f"Пересчет завершен: {report['attempts']} попыток за {report['seconds']} с")
+        return report
+    
+    def _rebuild(self, dry_run: bool) -> dict:
+        attempts = self.load_attempts()
+        rebuilt = self.replay(attempts)
+        
+        report = {
+            "dry_run": dry_run,
+            "attempts": int(len(attempts["student_ids"])),
+            "diff": self.diff(rebuilt)
+        }
+        
+        if not dry_run:
+            report.update(self.write(rebuilt))
+            bump_data_version(KNOWLEDGE)
+            
+            matrix = get_knowledge_matrix()
+            if matrix is not None:
+                matrix.rebuild(self.db)
+        
+        return report
\ No newline at end of file
@@ -0,0 +1,48 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app.database import engine
+from app.models.db_models import Lease
+
+def lease_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def acquire_lease(name: str, ttl_seconds: float, owner: Optional[str] = None) -> bool:
+    """
+    Захватывает или продлевает аренду name. Удается владельцу и любому
+    процессу после истечения срока: из нескольких воркеров uvicorn работу
+    выполняет один, а после его остановки ее подхватит другой.
+    """
+    owner = owner or lease_owner()
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    
+    with engine.begin() as conn:
+        renewed = conn.execute(
+            update(Lease)
+            .where(Lease.name == name, or_(Lease.owner == owner, Lease.expires_at < now))
+            .values(owner=owner, expires_at=expires_at)
+        ).rowcount
+        if renewed:
+            return True
+        if conn.scalar(select(Lease.name).where(Lease.name == name)) is not None:
+            return False
+    
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(Lease).values(name=name, owner=owner, expires_at=expires_at))
+        return True
+    except IntegrityError:
+        return False
+
+def release_lease(name: str, owner: Optional[str] = None):
+    """Освобождает аренду, чтобы другой процесс не ждал истечения срока"""
+    with engine.begin() as conn:
+        conn.execute(
+            update(Lease)
+            .where(Lease.name == name, Lease.owner == (owner or lease_owner()))
+            .values(expires_at=datetime.now())
+        )
\ No newline at end of file
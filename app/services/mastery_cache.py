@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.config import MASTERY_CACHE_SIZE, MASTERY_CACHE_TTL_SECONDS
+from app.services.bkt_engine import BKTEngine
+from app.services.bkt_engine_async import AsyncBKTEngine
+from app.services.data_versions import DATA_TABLES, bump_table_versions, bump_table_versions_async
+from app.logger import logger
+
+class MasteryCache:
+    """
+    Кэш таблиц освоения внутри процесса.
+    
+    Ключ включает счетчик версии данных: пути записи вызывают bump_version(),
+    и старые записи больше не попадаются. Размер ограничен (LRU), записи
+    живут не дольше ttl_seconds, чтобы забывание продолжало учитываться.
+    """
+    
+    def __init__(self, max_entries: int = MASTERY_CACHE_SIZE,
+                 ttl_seconds: float = MASTERY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+        self._async_compute_lock = None
+        self._async_lock_loop = None
+    
+    def bump_version(self) -> int:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            return self.version
+    
+    def _lookup(self, key: Tuple) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return False, None
+            
+            self._entries.move_to_end(key)
+            return True, value
+    
+    def _store(self, key: Tuple, value: Any):
+        with self._lock:
+            if key[0] != self.version:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def get_or_compute(self, name: Hashable, compute: Callable[[], Any]) -> Any:
+        key = (self.version, name)
+        found, value = self._lookup(key)
+        if found:
+            with self._lock:
+                self.hits += 1
+            return value
+        
+        # Одновременные промахи считают таблицу один раз
+        with self._compute_lock:
+            found, value = self._lookup(key)
+            if found:
+                with self._lock:
+                    self.hits += 1
+                return value
+            
+            with self._lock:
+                self.misses += 1
+            value = compute()
+            self._store(key, value)
+            return value
+    
+    def _get_async_compute_lock(self) -> asyncio.Lock:
+        # asyncio.Lock привязан к циклу событий, на новый цикл создается новый
+        loop = asyncio.get_running_loop()
+        if self._async_lock_loop is not loop:
+            self._async_compute_lock = asyncio.Lock()
+            self._async_lock_loop = loop
+        return self._async_compute_lock
+    
+    async def get_or_compute_async(self, name: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """get_or_compute для асинхронных обработчиков: промах ждет без блокировки цикла"""
+        key = (self.version, name)
+        found, value = self._lookup(key)
+        if found:
+            with self._lock:
+                self.hits += 1
+            return value
+        
+        async with self._get_async_compute_lock():
+            found, value = self._lookup(key)
+            if found:
+                with self._lock:
+                    self.hits += 1
+                return value
+            
+            with self._lock:
+                self.misses += 1
+            value = await compute()
+            self._store(key, value)
+            return value
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+mastery_cache = MasteryCache()
+
+def bump_data_version(*tables: str):
+    """
+    Сбрасывает кэш таблиц освоения и увеличивает счетчики изменившихся
+    таблиц для ETag (без аргументов - всех)
+    """
+    version = mastery_cache.bump_version()
+    bump_table_versions(tables or DATA_TABLES)
+    logger.info(f"Версия данных освоения: {version}")
+
+async def bump_data_version_async(*tables: str):
+    """bump_data_version для асинхронных обработчиков"""
+    version = mastery_cache.bump_version()
+    await bump_table_versions_async(tables or DATA_TABLES)
+    logger.info(f"Версия данных освоения: {version}")
+
+def get_mastery_table_cached(db: Session,
+                             as_of: Optional[datetime] = None,
+                             data_key: Tuple = ()) -> Tuple[List[dict], List[dict], List[dict]]:
+    """
+    data_key - DataState.key из data_versions. Счетчик version сбрасывается
+    только в этом процессе, а data_key меняется и после записи из других
+    процессов (воркеры uvicorn, очередь BKT, скрипты).
+    """
+    return mastery_cache.get_or_compute(
+        ("mastery_table", as_of, data_key),
+        lambda: BKTEngine(db).get_mastery_table(as_of)
+    )
+
+async def get_mastery_table_cached_async(db: AsyncSession,
+                                         as_of: Optional[datetime] = None,
+                                         data_key: Tuple = ()) -> Tuple[List[dict], List[dict], List[dict]]:
+    return await mastery_cache.get_or_compute_async(
+        ("mastery_table", as_of, data_key),
+        lambda: AsyncBKTEngine(db).get_mastery_table(as_of)
+    )
+
+async def get_mastery_columns_cached_async(db: AsyncSession,
+                                           as_of: Optional[datetime] = None,
+                                           data_key: Tuple = ()) -> Tuple[List[dict], List[dict], np.ndarray]:
+    """Матрица без словарей по ячейкам; кэшируется отдельно от таблицы"""
+    return await mastery_cache.get_or_compute_async(
+        ("mastery_columns", as_of, data_key),
+        lambda: AsyncBKTEngine(db).get_mastery_columns(as_of)
+    )
\ No newline at end of file
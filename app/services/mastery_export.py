@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+from app.services.bkt_engine import BKTEngine, EXPORT_BATCH_SIZE
+from app.database import SessionLocal
+from app.logger import logger
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson"
+}
+
+def _csv_rows(engine: BKTEngine, as_of: Optional[datetime], batch_size: int) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    
+    for students, skills, probabilities in engine.iter_mastery_batches(as_of, batch_size):
+        if not header_written:
+            # BOM, чтобы Excel открыл кириллицу без мастера импорта
+            buffer.write("\ufeff")
+            writer.writerow(["student_id", "student_name", "class"] + [skill.name for skill in skills])
+            header_written = True
+        
+        for student, row in zip(students, probabilities.tolist()):
+            writer.writerow(
+                [student.id, student.name, student.class_name or ""] +
+                [round(prob * 100, 1) for prob in row]
+            )
+        
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    if not header_written:
+        yield "\ufeffstudent_id,student_name,class\r\n"
+
+def _ndjson_rows(engine: BKTEngine, as_of: Optional[datetime], batch_size: int) -> Iterator[str]:
+    for students, skills, probabilities in engine.iter_mastery_batches(as_of, batch_size):
+        skill_ids = [skill.id for skill in skills]
+        lines = []
+        for student, row in zip(students, probabilities.tolist()):
+            lines.append(json.dumps({
+                "student_id": student.id,
+                "student_name": student.name,
+                "class": student.class_name,
+                "mastery": {
+                    skill_id: {"percentage": round(prob * 100, 1), "probability": prob}
+                    for skill_id, prob in zip(skill_ids, row)
+                }
+            }, ensure_ascii=False))
+        yield "\n".join(lines) + "\n"
+
+def stream_mastery(fmt: str,
+                   as_of: Optional[datetime] = None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Выгрузка таблицы освоения строками CSV или NDJSON по мере расчета.
+    Генератор открывает собственную сессию: он выполняется уже после
+    возврата из обработчика запроса.
+    """
+    db = SessionLocal()
+    exported = 0
+    try:
+        engine = BKTEngine(db)
+        rows = _csv_rows if fmt == "csv" else _ndjson_rows
+        for chunk in rows(engine, as_of, batch_size):
+            exported += 1
+            yield chunk.encode("utf-8")
+        logger.info(f"Выгрузка освоения ({fmt}) завершена: {exported} пачек")
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки освоения: {e}")
+        raise
+    finally:
+        db.close()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import struct
+import numpy as np
+from datetime import datetime
+from typing import List, Optional
+
+MASTERY_FORMATS = ("table", "columnar", "binary")
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+BINARY_MAGIC = b"BKTM"
+BINARY_VERSION = 1
+# magic, версия, резерв, число учеников, число навыков
+BINARY_HEADER = struct.Struct("<4sHHII")
+
+def columnar_payload(students: List[dict],
+                     skills: List[dict],
+                     probabilities: np.ndarray,
+                     precision: int,
+                     as_of: Optional[datetime] = None) -> dict:
+    """
+    Таблица освоения по столбцам: подписи - массивами, вероятности - одним
+    массивом по строкам (ученик i, навык j -> probability[i * skills + j]).
+    """
+    return {
+        "students": {
+            "id": [s["id"] for s in students],
+            "name": [s["name"] for s in students],
+            "class": [s["class"] for s in students]
+        },
+        "skills": {
+            "id": [sk["id"] for sk in skills],
+            "name": [sk["name"] for sk in skills]
+        },
+        "shape": [len(students), len(skills)],
+        "precision": precision,
+        "probability": np.round(probabilities, precision).ravel(),
+        "as_of": as_of
+    }
+
+def binary_payload(students: List[dict], skills: List[dict], probabilities: np.ndarray) -> bytes:
+    """
+    Little-endian: заголовок BINARY_HEADER (16 байт), id учеников и id
+    навыков (int32), затем вероятности float32 по строкам. Все смещения
+    кратны 4, поэтому браузер читает матрицу через Float32Array без копии.
+    Имена учеников и навыков - в format=columnar или /students/api.
+    """
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(students), len(skills))
+    return b"".join((
+        header,
+        np.asarray([s["id"] for s in students], dtype="<i4").tobytes(),
+        np.asarray([sk["id"] for sk in skills], dtype="<i4").tobytes(),
+        np.ascontiguousarray(probabilities, dtype="<f4").tobytes()
+    ))
\ No newline at end of file
@@ -0,0 +1,258 @@
+import threading
+import numpy as np
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, func
+from sqlalchemy.orm import Session
+from app.models.db_models import Student, Skill, KnowledgeHistory, MasterySnapshot
+from app.services.bkt_engine import BKTEngine
+from app.services.leases import acquire_lease, release_lease
+from app.database import SessionLocal
+from app.config import SNAPSHOT_BUILD_INTERVAL_SECONDS, SNAPSHOT_BACKFILL_DAYS
+from app.logger import logger
+
+SNAPSHOT_LEASE = "mastery_snapshots"
+
+SNAPSHOT_DTYPE = np.dtype([
+    ("skill_id", "<i4"),
+    ("probability", "<f4"),
+    ("last_updated_us", "<i8")
+])
+
+StudentStates = Dict[int, Tuple[float, int]]
+
+def pack_states(states: StudentStates) -> bytes:
+    packed = np.empty(len(states), dtype=SNAPSHOT_DTYPE)
+    for i, (skill_id, (probability, last_updated_us)) in enumerate(sorted(states.items())):
+        packed[i] = (skill_id, probability, last_updated_us)
+    return packed.tobytes()
+
+def unpack_states(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=SNAPSHOT_DTYPE)
+
+def _end_of_day(day: date) -> datetime:
+    return datetime.combine(day, time.max)
+
+def _to_us(value: datetime) -> int:
+    return int(np.datetime64(value.replace(tzinfo=None), "us").astype(np.int64))
+
+class MasterySnapshotBuilder:
+    """
+    Ежедневные снимки освоения: одна строка на ученика за день с упакованным
+    вектором сырых состояний (вероятность и время последнего обновления)
+    на конец дня. Забывание применяется при чтении на нужную дату.
+    
+    Снимок дня строится из снимка предыдущего дня: пересчитываются только
+    ученики, у которых в этот день были попытки.
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+        self.engine = BKTEngine(db)
+    
+    def latest_snapshot_date(self) -> Optional[date]:
+        return self.db.query(func.max(MasterySnapshot.snapshot_date)).scalar()
+    
+    def load_snapshot(self, day: date) -> Optional[Dict[int, StudentStates]]:
+        rows = self.db.query(
+            MasterySnapshot.student_id, MasterySnapshot.states
+        ).filter(
+            MasterySnapshot.snapshot_date == day
+        ).all()
+        
+        if not rows:
+            return None
+        
+        return {
+            student_id: {
+                int(item["skill_id"]): (float(item["probability"]), int(item["last_updated_us"]))
+                for item in unpack_states(blob)
+            }
+            for student_id, blob in rows
+        }
+    
+    def _states_for(self, as_of: datetime, student_ids: Optional[List[int]] = None) -> Dict[int, StudentStates]:
+        result = {}
+        for student_id, skill_id, probability, last_updated in self.engine._states_as_of(
+            as_of, student_ids=student_ids, active_only=False
+        ):
+            result.setdefault(student_id, {})[skill_id] = (probability, _to_us(last_updated))
+        return result
+    
+    def build_day(self, day: date) -> Optional[int]:
+        """
+        Строит снимок дня. None - пока снимок строился, появилась история
+        за этот день (импорт задним числом, очередь BKT): снимок не сохраняется.
+        """
+        as_of = _end_of_day(day)
+        history_mark = self.db.query(func.max(KnowledgeHistory.id)).scalar() or 0
+        previous = self.load_snapshot(day - timedelta(days=1))
+        
+        if previous is None:
+            states = self._states_for(as_of)
+        else:
+            touched = [
+                row[0] for row in self.db.query(KnowledgeHistory.student_id).filter(
+                    KnowledgeHistory.recorded_at >= datetime.combine(day, time.min),
+                    KnowledgeHistory.recorded_at <= as_of
+                ).distinct().all()
+            ]
+            states = previous
+            if touched:
+                states.update(self._states_for(as_of, student_ids=touched))
+        
+        rows = [
+            {
+                "snapshot_date": day,
+                "student_id": student_id,
+                "skill_count": len(student_states),
+                "states": pack_states(student_states)
+            }
+            for student_id, student_states in states.items()
+            if student_states
+        ]
+        
+        try:
+            self.db.query(MasterySnapshot).filter(
+                MasterySnapshot.snapshot_date == day
+            ).delete(synchronize_session=False)
+            if rows:
+                self.db.execute(insert(MasterySnapshot.__table__), rows)
+            
+            changed = self.db.query(KnowledgeHistory.id).filter(
+                KnowledgeHistory.id > history_mark,
+                KnowledgeHistory.recorded_at <= as_of
+            ).first()
+            if changed is not None:
+                self.db.rollback()
+                logger.warning(f"Снимок освоения за {day} отложен: история изменилась во время построения")
+                return None
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        logger.info(f"Снимок освоения за {day}: {len(rows)} учеников")
+        return len(rows)
+    
+    def build_missing(self, until: Optional[date] = None) -> List[date]:
+        """Достраивает снимки по закрытым дням (до вчера включительно)"""
+        until = until or date.today() - timedelta(days=1)
+        latest = self.latest_snapshot_date()
+        
+        if latest is not None:
+            start = latest + timedelta(days=1)
+        else:
+            first = self.db.query(func.min(KnowledgeHistory.recorded_at)).scalar()
+            if first is None:
+                return []
+            start = max(first.date(), until - timedelta(days=SNAPSHOT_BACKFILL_DAYS))
+        
+        built = []
+        day = start
+        while day <= until:
+            if self.build_day(day) is None:
+                break
+            built.append(day)
+            day += timedelta(days=1)
+        return built
+    
+    def get_trend(self,
+                  start: date,
+                  end: date,
+                  step_days: int = 7) -> Tuple[List[Student], List[Skill], List[date], List[np.ndarray]]:
+        """
+        Матрицы освоения (ученик x активный навык) на каждую step_days-ю дату
+        диапазона. Даты со снимком читаются одним запросом, остальные
+        считаются по истории.
+        """
+        students = self.db.query(Student).order_by(Student.name).all()
+        skills = self.db.query(Skill).filter_by(is_active=True).order_by(Skill.name).all()
+        
+        dates = []
+        day = start
+        while day <= end:
+            dates.append(day)
+            day += timedelta(days=step_days)
+        
+        rows = self.db.query(
+            MasterySnapshot.snapshot_date, MasterySnapshot.student_id, MasterySnapshot.states
+        ).filter(
+            MasterySnapshot.snapshot_date.in_(dates)
+        ).all()
+        
+        by_date = {}
+        for snapshot_date, student_id, blob in rows:
+            by_date.setdefault(snapshot_date, []).append((student_id, blob))
+        
+        matrices = []
+        for day in dates:
+            if day in by_date:
+                matrices.append(self._matrix_from_snapshot(students, skills, by_date[day], _end_of_day(day)))
+            else:
+                matrices.append(self.engine.get_mastery_matrix(as_of=_end_of_day(day))[2])
+        
+        return students, skills, dates, matrices
+    
+    def _matrix_from_snapshot(self,
+                              students: List[Student],
+                              skills: List[Skill],
+                              rows: List[Tuple[int, bytes]],
+                              as_of: datetime) -> np.ndarray:
+        student_index = {student.id: i for i, student in enumerate(students)}
+        skill_ids = np.array([skill.id for skill in skills], dtype=np.int64)
+        skill_order = np.argsort(skill_ids)
+        
+        p_init = np.array([skill.p_init for skill in skills], dtype=np.float64)
+        probabilities = np.tile(p_init, (len(students), 1))
+        days = np.zeros(probabilities.shape, dtype=np.float64)
+        now_us = _to_us(as_of)
+        
+        for student_id, blob in rows:
+            i = student_index.get(student_id)
+            if i is None or not len(skill_ids):
+                continue
+            
+            packed = unpack_states(blob)
+            positions = np.searchsorted(skill_ids[skill_order], packed["skill_id"])
+            positions = np.clip(positions, 0, len(skill_ids) - 1)
+            matched = skill_ids[skill_order][positions] == packed["skill_id"]
+            columns = skill_order[positions[matched]]
+            
+            probabilities[i, columns] = packed["probability"][matched]
+            days[i, columns] = (now_us - packed["last_updated_us"][matched]) // (86400 * 1_000_000)
+        
+        return self.engine._apply_forgetting_array(probabilities, days)
+
+_stop_event = threading.Event()
+
+def _scheduler_loop():
+    # Снимки строит один процесс из нескольких воркеров: аренда живет
+    # два интервала и продлевается каждым проходом
+    lease_seconds = SNAPSHOT_BUILD_INTERVAL_SECONDS * 2
+    while not _stop_event.is_set():
+        db = SessionLocal()
+        try:
+            if acquire_lease(SNAPSHOT_LEASE, lease_seconds):
+                built = MasterySnapshotBuilder(db).build_missing()
+                if built:
+                    logger.info(f"Построено снимков освоения: {len(built)}")
+        except Exception as e:
+            logger.error(f"Ошибка построения снимков освоения: {e}")
+        finally:
+            db.close()
+        _stop_event.wait(SNAPSHOT_BUILD_INTERVAL_SECONDS)
+    
+    try:
+        release_lease(SNAPSHOT_LEASE)
+    except Exception as e:
+        logger.error(f"Ошибка освобождения аренды снимков освоения: {e}")
+
+def start_snapshot_scheduler() -> threading.Thread:
+    _stop_event.clear()
+    thread = threading.Thread(target=_scheduler_loop, name="mastery-snapshots", daemon=True)
+    thread.start()
+    return thread
+
+def stop_snapshot_scheduler():
+    _stop_event.set()
@@ -0,0 +1,267 @@
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from starlette.routing import Match
+from app.database import engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 50000)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, object] = {}
+        REGISTRY.append(self)
+    
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+class Gauge(Counter):
+    kind = "gauge"
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+    
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items()]
+        
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Число HTTP-запросов", ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route")
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP-запросы в обработке", ("method", "route")
+)
+HTTP_SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "SQL-запросов на один HTTP-запрос", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+SQL_STATEMENTS = Counter(
+    "db_sql_statements_total", "Выполнено SQL-запросов", ("operation",)
+)
+SQL_DURATION = Histogram(
+    "db_sql_statement_duration_seconds", "Время выполнения SQL-запроса", ("operation",)
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Ожидание соединения из пула",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Соединения пула по состоянию", ("state",)
+)
+BKT_ATTEMPTS = Counter(
+    "bkt_attempts_processed_total", "Попыток учтено в BKT", ("path",)
+)
+BKT_STATE_UPDATES = Counter(
+    "bkt_state_updates_total", "Обновлений состояний знаний", ("path",)
+)
+BKT_PROCESS_SECONDS = Histogram(
+    "bkt_process_test_results_seconds", "Время process_test_results"
+)
+BKT_JOBS = Counter(
+    "bkt_jobs_total", "Задачи очереди BKT по результату", ("outcome",)
+)
+BKT_JOB_WAIT_SECONDS = Histogram(
+    "bkt_job_wait_seconds", "Время задачи BKT в очереди до начала обработки"
+)
+AUTH_LOGIN_SECONDS = Histogram(
+    "auth_login_duration_seconds", "Время входа по паролю", ("outcome",)
+)
+AUTH_TOKEN_REFRESHES = Counter(
+    "auth_token_refreshes_total", "Обновления access-токена по refresh-токену", ("outcome",)
+)
+PASSWORD_HASH_QUEUE = Gauge(
+    "auth_password_hash_pending", "Задачи bcrypt в работе и в очереди"
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "auth_password_hash_seconds", "Время bcrypt в пуле", ("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+# Счетчик SQL-запросов текущего HTTP-запроса (в потоках пула копируется вместе с контекстом)
+_request_statements: ContextVar[Optional[List[int]]] = ContextVar("request_statements", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    if started:
+        SQL_DURATION.observe(time.perf_counter() - started.pop(), operation=operation)
+    SQL_STATEMENTS.inc(operation=operation)
+    
+    counter = _request_statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+def _instrument_pool(pool):
+    """Замер ожидания соединения: у пула нет события до выдачи, оборачиваем connect"""
+    if getattr(pool, "_metrics_instrumented", False):
+        return
+    connect = pool.connect
+    
+    def timed_connect(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return connect(*args, **kwargs)
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+    
+    pool.connect = timed_connect
+    pool._metrics_instrumented = True
+
+def instrument_engine(db_engine=engine):
+    if not event.contains(db_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+    _instrument_pool(db_engine.pool)
+
+def _collect_pool_stats(db_engine=engine):
+    pool = db_engine.pool
+    _instrument_pool(pool)
+    for state, method in (("size", "size"), ("checked_out", "checkedout"),
+                          ("checked_in", "checkedin"), ("overflow", "overflow")):
+        if hasattr(pool, method):
+            # overflow() у QueuePool отрицателен, пока пул не заполнен
+            POOL_CONNECTIONS.set(max(0, getattr(pool, method)()), state=state)
+
+def render_metrics() -> str:
+    _collect_pool_stats()
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+def resolve_route(scope):
+    """Маршрут приложения, который обработает запрос (до маршрутизации), или None"""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: латентность, статусы и число SQL-запросов по шаблону
+    маршрута (/students/api/{student_id}, а не фактический путь).
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        route = getattr(resolve_route(scope), "path", "unmatched")
+        status = {"code": 500}
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        counter = [0]
+        token = _request_statements.set(counter)
+        HTTP_IN_PROGRESS.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec(method=method, route=route)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status["code"]))
+            HTTP_SQL_STATEMENTS.observe(counter[0], method=method, route=route)
+            _request_statements.reset(token)
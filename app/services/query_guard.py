@@ -0,0 +1,165 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional, Tuple
+from sqlalchemy import event
+from app.database import engine, async_engine
+from app.services.metrics import resolve_route
+from app.config import QUERY_GUARD_REPEAT_THRESHOLD, QUERY_GUARD_RAISE
+from app.logger import logger
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_POSTCOMPILE = re.compile(r"__\[POSTCOMPILE_\w+\]")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|:\w+")
+
+class QueryBudgetExceeded(RuntimeError):
+    """Запрос превысил бюджет SQL-запросов или повторяет один запрос в цикле"""
+
+def statement_shape(statement: str) -> str:
+    """Форма запроса: литералы, параметры и списки IN заменены на ?"""
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _POSTCOMPILE.sub("?", shape)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _PLACEHOLDER_LIST.sub("(?)", shape)
+    return " ".join(shape.split())
+
+class QueryRecorder:
+    """
+    SQL-запросы одного HTTP-запроса или блока кода, сгруппированные по форме.
+    
+    Нарушения: общее число запросов больше budget или одна форма повторилась
+    больше repeat_threshold раз (типичный N+1). С raise_on_violation
+    нарушение прерывает запрос исключением QueryBudgetExceeded.
+    """
+    
+    def __init__(self,
+                 label: str,
+                 budget: Optional[int] = None,
+                 repeat_threshold: int = QUERY_GUARD_REPEAT_THRESHOLD,
+                 raise_on_violation: bool = QUERY_GUARD_RAISE):
+        self.label = label
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold
+        self.raise_on_violation = raise_on_violation
+        self.count = 0
+        self.shapes = Counter()
+        self.violations: List[str] = []
+        self.closed = False
+    
+    def record(self, statement: str):
+        if self.closed:
+            return
+        self.count += 1
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        
+        if self.budget is not None and self.count == self.budget + 1:
+            self._violation(f"{self.label}: больше {self.budget} SQL-запросов")
+        if self.shapes[shape] == self.repeat_threshold + 1:
+            self._violation(
+                f"{self.label}: запрос повторяется больше {self.repeat_threshold} раз (N+1?): {shape[:200]}"
+            )
+    
+    def _violation(self, message: str):
+        self.violations.append(message)
+        logger.warning(f"Бюджет запросов: {message}")
+        if self.raise_on_violation:
+            raise QueryBudgetExceeded(message)
+    
+    def repeated_shapes(self) -> List[Tuple[str, int]]:
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > self.repeat_threshold]
+    
+    def summary(self) -> dict:
+        return {
+            "label": self.label,
+            "queries": self.count,
+            "budget": self.budget,
+            "distinct_shapes": len(self.shapes),
+            "repeated": self.repeated_shapes(),
+            "violations": list(self.violations)
+        }
+
+_current_recorder: ContextVar[Optional[QueryRecorder]] = ContextVar("query_recorder", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorder = _current_recorder.get()
+    if recorder is not None:
+        recorder.record(statement)
+
+def install_query_guard(db_engine=None):
+    """Без аргумента - на синхронный и асинхронный движки приложения"""
+    engines = [db_engine] if db_engine is not None else [engine, async_engine.sync_engine]
+    for target in engines:
+        if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+            event.listen(target, "before_cursor_execute", _before_cursor_execute)
+
+def query_budget(max_queries: int) -> Callable:
+    """Объявляет бюджет SQL-запросов обработчика (проверяется QueryGuardMiddleware)"""
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+@contextmanager
+def query_guard(budget: Optional[int] = None,
+                repeat_threshold: int = QUERY_GUARD_REPEAT_THRESHOLD,
+                label: str = "block",
+                raise_on_violation: bool = True) -> Iterator[QueryRecorder]:
+    """
+    Проверка бюджета для тестов и скриптов:
+    
+        with query_guard(budget=5) as recorder:
+            engine.get_mastery_table()
+    """
+    install_query_guard()
+    recorder = QueryRecorder(label, budget, repeat_threshold, raise_on_violation)
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.closed = True
+        _current_recorder.reset(token)
+
+class QueryGuardMiddleware:
+    """
+    Режим разработки: записывает SQL каждого HTTP-запроса, сверяет с бюджетом
+    маршрута (@query_budget) и ищет повторяющиеся формы запросов. Число
+    запросов отдается в заголовке X-Query-Count. Фоновые задачи после ответа
+    не учитываются.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        install_query_guard()
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        route = resolve_route(scope)
+        budget = getattr(getattr(route, "endpoint", None), "query_budget", None)
+        label = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+        recorder = QueryRecorder(label, budget)
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(recorder.count).encode()))
+                message = dict(message, headers=headers)
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                recorder.closed = True
+            await send(message)
+        
+        token = _current_recorder.set(recorder)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            recorder.closed = True
+            _current_recorder.reset(token)
+            if recorder.violations or recorder.repeated_shapes():
+                logger.warning(f"Бюджет запросов: {recorder.summary()}")
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""
+Бенчмарки горячих путей на синтетической школе.
+
+Запуск: python -m benchmarks --scales small,medium --output results.json
+"""
\ No newline at end of file
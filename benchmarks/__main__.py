@@ -0,0 +1,106 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    """Генерирует синтетическую школу нужного масштаба и замеряет сценарии"""
+    parser = argparse.ArgumentParser(description="Бенчмарки BKT на синтетических данных")
+    parser.add_argument("--scales", default="small", help="масштабы через запятую: small, medium, large")
+    parser.add_argument("--scenarios", default=None, help="сценарии через запятую (по умолчанию - все)")
+    parser.add_argument("--repeat", type=int, default=20, help="замеров на сценарий")
+    parser.add_argument("--class-size", type=int, default=30, help="учеников в одном тесте")
+    parser.add_argument("--items", type=int, default=10, help="заданий в одном тесте")
+    parser.add_argument("--seed", type=int, default=42, help="seed генератора")
+    parser.add_argument("--database-url", default=None,
+                        help="база для замеров (по умолчанию - временный файл SQLite)")
+    parser.add_argument("--drop-existing", action="store_true",
+                        help="разрешить удалить все таблицы в --database-url")
+    parser.add_argument("--output", default=None, help="файл для JSON (по умолчанию - stdout)")
+    args = parser.parse_args()
+    
+    if args.database_url and not args.drop_existing:
+        parser.error("база --database-url будет очищена, подтвердите флагом --drop-existing")
+    
+    workdir = tempfile.mkdtemp(prefix="bkt_bench_")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    
+    # app.database читает DATABASE_URL при импорте; модель чтения не используется
+    os.environ["DATABASE_URL"] = database_url
+    # асинхронный URL выводится из DATABASE_URL, а не берется из .env
+    os.environ["ASYNC_DATABASE_URL"] = ""
+    os.environ["KNOWLEDGE_MATRIX_ENABLED"] = "0"
+    
+    from app.logger import logger
+    from app.database import engine, SessionLocal
+    from benchmarks.generator import SCALES, SyntheticSchool, reset_schema
+    from benchmarks.scenarios import ScenarioContext, run_scenarios
+    
+    logger.setLevel(logging.WARNING)
+    
+    scales = [name.strip() for name in args.scales.split(",") if name.strip()]
+    unknown = [name for name in scales if name not in SCALES]
+    if unknown:
+        parser.error(f"неизвестные масштабы: {', '.join(unknown)}")
+    names = [name.strip() for name in args.scenarios.split(",")] if args.scenarios else None
+    
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "dialect": engine.dialect.name,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "class_size": args.class_size,
+            "items_per_test": args.items
+        },
+        "scales": []
+    }
+    
+    for scale in scales:
+        print(f"Масштаб {scale}: генерация...", file=sys.stderr)
+        reset_schema()
+        
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            data = SyntheticSchool(db, seed=args.seed, **SCALES[scale]).generate()
+        finally:
+            db.close()
+        generate_seconds = time.perf_counter() - started
+        
+        print(f"Масштаб {scale}: {data['attempts']} попыток, замеры...", file=sys.stderr)
+        ctx = ScenarioContext(seed=args.seed, class_size=args.class_size)
+        report["scales"].append({
+            "scale": scale,
+            "data": data,
+            "generate_seconds": round(generate_seconds, 2),
+            "scenarios": run_scenarios(ctx, args.repeat, args.items, names)
+        })
+    
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Результаты записаны в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
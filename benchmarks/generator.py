@@ -0,0 +1,165 @@
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.database import Base, engine
+from app.models.db_models import User, Student, Skill, Test, TestItem, StudentAttempt
+from app.services.knowledge_rebuild import KnowledgeRebuilder
+from app.services.bkt_engine import _chunks
+from app.auth import get_password_hash
+
+SCALES = {
+    "small": {"students": 100, "skills": 10, "tests": 10, "items_per_test": 10},
+    "medium": {"students": 500, "skills": 30, "tests": 30, "items_per_test": 12},
+    "large": {"students": 2000, "skills": 80, "tests": 60, "items_per_test": 15}
+}
+
+BENCH_USERNAME = "bench_teacher"
+CLASS_NAMES = ["5А", "5Б", "6А", "6Б", "7А", "7Б", "8А", "8Б", "9А", "9Б"]
+INSERT_CHUNK_SIZE = 10000
+
+def reset_schema():
+    """Удаляет и заново создает все таблицы в базе DATABASE_URL"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+class SyntheticSchool:
+    """
+    Детерминированная синтетическая школа: ученики, навыки с разными
+    параметрами BKT, тесты раз в несколько дней и попытки, полученные
+    симуляцией скрытого состояния знания (угадывание, ошибка, обучение
+    после каждого задания). Одинаковый seed дает одинаковые данные.
+    """
+    
+    def __init__(self,
+                 db: Session,
+                 students: int,
+                 skills: int,
+                 tests: int,
+                 items_per_test: int,
+                 participation: float = 0.9,
+                 seed: int = 42,
+                 start: datetime = datetime(2025, 9, 1, 9, 0)):
+        self.db = db
+        self.n_students = students
+        self.n_skills = skills
+        self.n_tests = tests
+        self.items_per_test = items_per_test
+        self.participation = participation
+        self.rng = np.random.default_rng(seed)
+        self.start = start
+    
+    def _create_user(self) -> int:
+        user = User(
+            username=BENCH_USERNAME,
+            password_hash=get_password_hash("bench"),
+            role="teacher"
+        )
+        self.db.add(user)
+        self.db.flush()
+        return user.id
+    
+    def _create_skills(self, user_id: int) -> Dict[str, np.ndarray]:
+        params = {
+            "p_init": self.rng.uniform(0.1, 0.4, self.n_skills),
+            "p_learn": self.rng.uniform(0.05, 0.3, self.n_skills),
+            "p_guess": self.rng.uniform(0.1, 0.3, self.n_skills),
+            "p_slip": self.rng.uniform(0.05, 0.15, self.n_skills)
+        }
+        rows = [
+            {
+                "name": f"Навык {j + 1:03d}",
+                "created_by": user_id,
+                "is_active": True,
+                **{name: float(values[j]) for name, values in params.items()}
+            }
+            for j in range(self.n_skills)
+        ]
+        self.db.execute(insert(Skill.__table__), rows)
+        params["id"] = np.array(
+            [row[0] for row in self.db.query(Skill.id).order_by(Skill.id).all()], dtype=np.int64
+        )
+        return params
+    
+    def _create_students(self, user_id: int) -> np.ndarray:
+        rows = [
+            {
+                "name": f"Ученик {i + 1:05d}",
+                "class_name": CLASS_NAMES[i % len(CLASS_NAMES)],
+                "created_by": user_id
+            }
+            for i in range(self.n_students)
+        ]
+        for chunk in _chunks(rows, INSERT_CHUNK_SIZE):
+            self.db.execute(insert(Student.__table__), chunk)
+        return np.array(
+            [row[0] for row in self.db.query(Student.id).order_by(Student.id).all()], dtype=np.int64
+        )
+    
+    def _create_test(self, user_id: int, test_date: datetime, skill_ids: List[int]) -> List[int]:
+        test = Test(test_date=test_date, description=f"Синтетический тест {test_date:%d.%m}", created_by=user_id)
+        self.db.add(test)
+        self.db.flush()
+        items = [
+            TestItem(test_id=test.id, item_order=order, skill_id=skill_id)
+            for order, skill_id in enumerate(skill_ids, 1)
+        ]
+        self.db.add_all(items)
+        self.db.flush()
+        return [item.id for item in items]
+    
+    def generate(self, rebuild: bool = True) -> dict:
+        """Заполняет пустую базу; rebuild - посчитать состояния знаний по попыткам"""
+        user_id = self._create_user()
+        skills = self._create_skills(user_id)
+        student_ids = self._create_students(user_id)
+        
+        # Скрытое состояние знания (ученик x навык)
+        known = self.rng.random((self.n_students, self.n_skills)) < skills["p_init"]
+        attempt_rows = []
+        attempts = 0
+        test_date = self.start
+        
+        for _ in range(self.n_tests):
+            test_date += timedelta(days=int(self.rng.integers(1, 5)))
+            positions = self.rng.integers(0, self.n_skills, self.items_per_test)
+            item_ids = self._create_test(user_id, test_date, skills["id"][positions].tolist())
+            
+            present = self.rng.random(self.n_students) < self.participation
+            for offset, (item_id, position) in enumerate(zip(item_ids, positions)):
+                state = known[:, position]
+                p_correct = np.where(state, 1 - skills["p_slip"][position], skills["p_guess"][position])
+                correct = self.rng.random(self.n_students) < p_correct
+                known[:, position] |= self.rng.random(self.n_students) < skills["p_learn"][position]
+                
+                created_at = test_date + timedelta(minutes=offset)
+                for i in np.flatnonzero(present):
+                    attempt_rows.append({
+                        "student_id": int(student_ids[i]),
+                        "test_item_id": item_id,
+                        "is_correct": bool(correct[i]),
+                        "score": 1.0 if correct[i] else 0.0,
+                        "created_at": created_at
+                    })
+            
+            if len(attempt_rows) >= INSERT_CHUNK_SIZE:
+                self.db.execute(insert(StudentAttempt.__table__), attempt_rows)
+                attempts += len(attempt_rows)
+                attempt_rows = []
+        
+        if attempt_rows:
+            self.db.execute(insert(StudentAttempt.__table__), attempt_rows)
+            attempts += len(attempt_rows)
+        self.db.commit()
+        
+        if rebuild:
+            KnowledgeRebuilder(self.db, workers=1).run()
+        
+        return {
+            "students": self.n_students,
+            "skills": self.n_skills,
+            "tests": self.n_tests,
+            "items_per_test": self.items_per_test,
+            "attempts": attempts
+        }
\ No newline at end of file
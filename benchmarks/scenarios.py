@@ -0,0 +1,327 @@
+import gzip
+import time
+import tracemalloc
+import numpy as np
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, insert
+from app.database import engine, async_engine, SessionLocal
+from app.models.db_models import User, Student, Skill, Test, TestItem, StudentAttempt
+from app.services.bkt_engine import BKTEngine, mastery_labels, mastery_table_from_matrix
+from app.services.bkt_jobs import process_pending_jobs
+from app.services.compression import brotli
+from app.services.json_response import ORJSONResponse
+from app.services.mastery_formats import columnar_payload, binary_payload
+from app.config import GZIP_COMPRESSLEVEL, BROTLI_QUALITY, MASTERY_COLUMNAR_PRECISION
+from app.routers import tests
+from app.auth import create_access_token
+from benchmarks.generator import BENCH_USERNAME
+
+try:
+    from fastapi.testclient import TestClient
+except ImportError:
+    # TestClient требует httpx
+    TestClient = None
+
+# prepare(i) выполняет подготовку вне замера и возвращает операцию,
+# которая замеряется; операция возвращает число обработанных единиц
+Prepare = Callable[[int], Callable[[], int]]
+
+class QueryCounter:
+    """Считает SQL-запросы синхронного и асинхронного движков, пока активен контекст"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+    
+    def __enter__(self):
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "before_cursor_execute", self._on_execute)
+        return self
+    
+    def __exit__(self, *exc):
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", self._on_execute)
+
+def measure(prepare: Prepare, repeat: int, warmup: int = 1) -> dict:
+    """
+    Латентность (p50/p95/max), пропускная способность, число запросов на
+    операцию и пик памяти Python (tracemalloc, отдельным прогоном, чтобы
+    трассировка не искажала время).
+    """
+    for i in range(warmup):
+        prepare(-1 - i)()
+    
+    latencies = []
+    units = 0
+    queries = 0
+    for i in range(repeat):
+        operation = prepare(i)
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            units += operation()
+            latencies.append(time.perf_counter() - started)
+        queries += counter.count
+    
+    operation = prepare(repeat)
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    total = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "operations": repeat,
+        "total_seconds": round(total, 4),
+        "ops_per_second": round(repeat / total, 2) if total else None,
+        "units_per_second": round(units / total, 2) if total else None,
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "max_ms": round(float(latencies_ms.max()), 3),
+        "queries_per_op": round(queries / repeat, 2),
+        "peak_memory_kb": round(peak / 1024, 1)
+    }
+
+class ScenarioContext:
+    """Общие данные сценариев одного масштаба: id учеников, навыков и автор тестов"""
+    
+    def __init__(self, seed: int, class_size: int):
+        self.rng = np.random.default_rng(seed)
+        self.class_size = class_size
+        db = SessionLocal()
+        try:
+            self.user_id = db.query(User.id).filter(User.username == BENCH_USERNAME).scalar()
+            self.student_ids = np.array([row[0] for row in db.query(Student.id).all()], dtype=np.int64)
+            self.skill_ids = np.array([row[0] for row in db.query(Skill.id).all()], dtype=np.int64)
+        finally:
+            db.close()
+        self._client = None
+    
+    @property
+    def client(self):
+        if self._client is None:
+            app = FastAPI()
+            app.include_router(tests.router)
+            self._client = TestClient(app)
+            self._client.headers["Authorization"] = "Bearer " + create_access_token({"sub": BENCH_USERNAME})
+        return self._client
+    
+    def new_test(self, db, items: int) -> Tuple[int, Dict[int, int]]:
+        """Создает тест; возвращает его id и item_order -> test_item_id"""
+        test = Test(test_date=datetime.now(), description="Бенчмарк", created_by=self.user_id)
+        db.add(test)
+        db.flush()
+        skill_ids = self.rng.choice(self.skill_ids, size=items)
+        rows = [
+            TestItem(test_id=test.id, item_order=order, skill_id=int(skill_id))
+            for order, skill_id in enumerate(skill_ids, 1)
+        ]
+        db.add_all(rows)
+        db.commit()
+        return test.id, {item.item_order: item.id for item in rows}
+    
+    def sample_class(self) -> np.ndarray:
+        size = min(self.class_size, len(self.student_ids))
+        return self.rng.choice(self.student_ids, size=size, replace=False)
+
+def scenario_update_from_attempt(ctx: ScenarioContext, repeat: int) -> dict:
+    db = SessionLocal()
+    try:
+        bkt = BKTEngine(db)
+        
+        def prepare(i: int):
+            student_id = int(ctx.rng.choice(ctx.student_ids))
+            skill_id = int(ctx.rng.choice(ctx.skill_ids))
+            is_correct = bool(ctx.rng.random() < 0.6)
+            
+            def operation():
+                bkt.update_from_attempt(student_id, skill_id, is_correct)
+                return 1
+            return operation
+        
+        return measure(prepare, repeat)
+    finally:
+        db.close()
+
+def scenario_process_test_results(ctx: ScenarioContext, repeat: int, items: int) -> dict:
+    db = SessionLocal()
+    try:
+        bkt = BKTEngine(db)
+        
+        def prepare(i: int):
+            test_id, item_ids = ctx.new_test(db, items)
+            rows = [
+                {
+                    "student_id": int(student_id),
+                    "test_item_id": item_id,
+                    "is_correct": bool(ctx.rng.random() < 0.6),
+                    "score": 0.0
+                }
+                for student_id in ctx.sample_class()
+                for item_id in item_ids.values()
+            ]
+            db.execute(insert(StudentAttempt.__table__), rows)
+            db.commit()
+            
+            def operation():
+                bkt.process_test_results(test_id)
+                return len(rows)
+            return operation
+        
+        return measure(prepare, repeat)
+    finally:
+        db.close()
+
+def scenario_get_mastery_table(ctx: ScenarioContext, repeat: int) -> dict:
+    db = SessionLocal()
+    try:
+        def prepare(i: int):
+            def operation():
+                students, _, _ = BKTEngine(db).get_mastery_table()
+                return len(students)
+            return operation
+        
+        return measure(prepare, repeat)
+    finally:
+        db.close()
+
+def _encode_default(table, columns) -> bytes:
+    # Путь FastAPI для возвращенного словаря: jsonable_encoder, затем JSONResponse
+    return JSONResponse(jsonable_encoder(table)).body
+
+def _encode_orjson(table, columns) -> bytes:
+    return ORJSONResponse(table).body
+
+def _encode_gzip(table, columns) -> bytes:
+    return gzip.compress(ORJSONResponse(table).body, compresslevel=GZIP_COMPRESSLEVEL)
+
+def _encode_brotli(table, columns) -> bytes:
+    return brotli.compress(ORJSONResponse(table).body, quality=BROTLI_QUALITY)
+
+def _encode_columnar(table, columns) -> bytes:
+    return ORJSONResponse(columnar_payload(*columns, MASTERY_COLUMNAR_PRECISION)).body
+
+def _encode_binary(table, columns) -> bytes:
+    return binary_payload(*columns)
+
+SERIALIZERS = {
+    "serialize_mastery_default": _encode_default,
+    "serialize_mastery_orjson": _encode_orjson,
+    "serialize_mastery_gzip": _encode_gzip,
+    "serialize_mastery_brotli": _encode_brotli,
+    "serialize_mastery_columnar": _encode_columnar,
+    "serialize_mastery_binary": _encode_binary
+}
+
+def scenario_serialize_mastery(ctx: ScenarioContext, repeat: int, name: str) -> dict:
+    """
+    Тело ответа /students/api/mastery: время кодирования и байты на проводе.
+    Единица - ячейка таблицы; bytes_on_wire - размер тела после кодирования.
+    Обе формы данных берутся такими, какими их хранит кэш таблиц освоения.
+    """
+    db = SessionLocal()
+    try:
+        students, skills, probabilities = BKTEngine(db).get_mastery_matrix()
+        students_data, skills_data, matrix = mastery_table_from_matrix(students, skills, probabilities)
+        columns = (*mastery_labels(students, skills), probabilities)
+    finally:
+        db.close()
+    
+    table = {"students": students_data, "skills": skills_data, "matrix": matrix, "as_of": None}
+    encode = SERIALIZERS[name]
+    cells = len(students) * len(skills)
+    
+    def prepare(i: int):
+        def operation():
+            encode(table, columns)
+            return cells
+        return operation
+    
+    result = measure(prepare, repeat)
+    result["bytes_on_wire"] = len(encode(table, columns))
+    return result
+
+def scenario_save_results(ctx: ScenarioContext, repeat: int, items: int) -> dict:
+    db = SessionLocal()
+    try:
+        def prepare(i: int):
+            test_id, item_ids = ctx.new_test(db, items)
+            results = {
+                str(student_id): {str(order): bool(ctx.rng.random() < 0.6) for order in item_ids}
+                for student_id in ctx.sample_class()
+            }
+            
+            def operation():
+                response = ctx.client.post("/tests/api/save-results", json={"test_id": test_id, "results": results})
+                response.raise_for_status()
+                # Пересчет BKT выполняется очередью; замер включает его
+                process_pending_jobs("benchmark")
+                return len(results) * len(item_ids)
+            return operation
+        
+        return measure(prepare, repeat)
+    finally:
+        db.close()
+
+def scenario_tests_list(ctx: ScenarioContext, repeat: int) -> dict:
+    def prepare(i: int):
+        def operation():
+            response = ctx.client.get("/tests/api/list")
+            response.raise_for_status()
+            return len(response.json()["items"])
+        return operation
+    
+    return measure(prepare, repeat)
+
+SCENARIOS = [
+    "get_mastery_table",
+    "serialize_mastery_default",
+    "serialize_mastery_orjson",
+    "serialize_mastery_gzip",
+    "serialize_mastery_brotli",
+    "serialize_mastery_columnar",
+    "serialize_mastery_binary",
+    "tests_list",
+    "update_from_attempt",
+    "process_test_results",
+    "save_results"
+]
+HTTP_SCENARIOS = {"tests_list", "save_results"}
+
+def run_scenarios(ctx: ScenarioContext,
+                  repeat: int,
+                  items: int,
+                  names: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Сценарии чтения идут первыми: остальные меняют данные"""
+    runners = {
+        "get_mastery_table": lambda: scenario_get_mastery_table(ctx, repeat),
+        **{
+            name: (lambda name=name: scenario_serialize_mastery(ctx, repeat, name))
+            for name in SERIALIZERS
+        },
+        "tests_list": lambda: scenario_tests_list(ctx, repeat),
+        "update_from_attempt": lambda: scenario_update_from_attempt(ctx, repeat),
+        "process_test_results": lambda: scenario_process_test_results(ctx, repeat, items),
+        "save_results": lambda: scenario_save_results(ctx, repeat, items)
+    }
+    
+    results = {}
+    for name in SCENARIOS:
+        if names is not None and name not in names:
+            continue
+        if name in HTTP_SCENARIOS and TestClient is None:
+            results[name] = {"skipped": "fastapi.testclient недоступен (нужен httpx)"}
+            continue
+        if name == "serialize_mastery_brotli" and brotli is None:
+            results[name] = {"skipped": "пакет brotli не установлен"}
+            continue
+        results[name] = runners[name]()
+    return results
\ No newline at end of file
@@ -0,0 +1,34 @@
+import argparse
+from datetime import date
+from app.database import SessionLocal
+from app.services.mastery_snapshots import MasterySnapshotBuilder
+
+def main():
+    """Построение ежедневных снимков освоения (для cron)"""
+    parser = argparse.ArgumentParser(description="Построение снимков mastery_snapshots")
+    parser.add_argument("--day", type=date.fromisoformat, action="append", dest="days",
+                        help="перестроить снимок за день YYYY-MM-DD (можно несколько)")
+    parser.add_argument("--until", type=date.fromisoformat, default=None,
+                        help="достроить недостающие снимки до даты (по умолчанию - вчера)")
+    args = parser.parse_args()
+    
+    db = SessionLocal()
+    try:
+        builder = MasterySnapshotBuilder(db)
+        if args.days:
+            for day in sorted(args.days):
+                count = builder.build_day(day)
+                if count is None:
+                    print(f"⚠️ {day}: история изменилась во время построения, повторите")
+                else:
+                    print(f"✅ {day}: {count} учеников")
+        else:
+            built = builder.build_missing(args.until)
+            print(f"✅ Построено снимков: {len(built)}")
+            if built:
+                print(f"   {built[0]} - {built[-1]}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
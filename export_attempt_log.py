@@ -0,0 +1,38 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from app.database import SessionLocal
+from app.services.attempt_log import AttemptLog, EXPORT_CHUNK_SIZE
+from app.config import ATTEMPT_LOG_DIR
+
+def main():
+    """Выгрузка журнала попыток в колоночные .npy файлы"""
+    parser = argparse.ArgumentParser(description="Колоночный журнал попыток для аналитики и пересчета")
+    parser.add_argument("--dir", type=Path, default=ATTEMPT_LOG_DIR, help="каталог журнала")
+    parser.add_argument("--full", action="store_true", help="удалить журнал и выгрузить заново")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="размер пачки чтения")
+    args = parser.parse_args()
+    
+    print("="*50)
+    print("ВЫГРУЗКА ЖУРНАЛА ПОПЫТОК")
+    print("="*50)
+    
+    log = AttemptLog(args.dir)
+    if args.full:
+        log.reset()
+    
+    db = SessionLocal()
+    try:
+        exported = log.export(db, chunk_size=args.chunk_size)
+        print(f"Новых попыток: {exported}")
+        print(json.dumps(log.manifest(), ensure_ascii=False, indent=2))
+        print("✅ Готово")
+    except Exception as e:
+        print(f"❌ Ошибка выгрузки: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
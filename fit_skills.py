@@ -0,0 +1,51 @@
+import argparse
+import sys
+from pathlib import Path
+from app.database import SessionLocal
+from app.services.attempt_log import AttemptLog
+from app.services.bkt_fitting import BKTParameterFitter
+
+def main():
+    """Подбор параметров BKT навыков по накопленным попыткам"""
+    parser = argparse.ArgumentParser(description="EM-подбор p_init, p_learn, p_guess, p_slip")
+    parser.add_argument("--skill", type=int, action="append", dest="skills", help="ID навыка (можно несколько)")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию - число CPU)")
+    parser.add_argument("--max-iter", type=int, default=100, help="максимум итераций EM")
+    parser.add_argument("--min-attempts", type=int, default=20, help="не подбирать навыки с меньшим числом попыток")
+    parser.add_argument("--from-log", type=Path, default=None, help="читать попытки из колоночного журнала (каталог)")
+    parser.add_argument("--apply", action="store_true", help="записать подобранные параметры в навыки")
+    args = parser.parse_args()
+    
+    print("="*50)
+    print("ПОДБОР ПАРАМЕТРОВ BKT")
+    print("="*50)
+    
+    db = SessionLocal()
+    try:
+        fitter = BKTParameterFitter(
+            db,
+            workers=args.workers,
+            max_iter=args.max_iter,
+            min_attempts=args.min_attempts,
+            attempt_log=AttemptLog(args.from_log) if args.from_log else None
+        )
+        results = fitter.fit(args.skills)
+        
+        for r in sorted(results, key=lambda x: x["skill_name"]):
+            print(f"\n📚 {r['skill_name']} (ID {r['skill_id']}): "
+                  f"{r['attempts']} попыток, {r['sequences']} учеников")
+            for name in ("p_init", "p_learn", "p_guess", "p_slip"):
+                print(f"  {name}: {r['previous'][name]:.3f} -> {r[name]:.3f}")
+            print(f"  log-likelihood: {r['log_likelihood']:.2f} ({r['iterations']} итераций)")
+        
+        if args.apply and results:
+            fitter.apply(results)
+            print(f"\n✅ Параметры обновлены для {len(results)} навыков")
+    except Exception as e:
+        print(f"❌ Ошибка подбора: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import sys
+from app.database import SessionLocal
+from app.services.attempt_import import AttemptImporter, FORMATS, IMPORT_CHUNK_SIZE, detect_format
+
+def print_progress(stage: str, done: int, total: int):
+    percent = (done / total * 100) if total else 100.0
+    sys.stdout.write(f"\rИмпорт: {done}/{total} байт ({percent:.1f}%)")
+    if done >= total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+def main():
+    """Импорт попыток из CSV или NDJSON (бумажные журналы)"""
+    parser = argparse.ArgumentParser(description="Потоковый импорт попыток")
+    parser.add_argument("path", help="файл CSV или NDJSON: student_id, test_id, item_order, is_correct[, created_at, score]")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="формат (по умолчанию - по расширению)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="строк в пачке")
+    parser.add_argument("--errors", type=int, default=20, help="сколько ошибок строк показать")
+    args = parser.parse_args()
+    
+    print("="*50)
+    print("ИМПОРТ ПОПЫТОК")
+    print("="*50)
+    
+    fmt = args.format or detect_format(args.path)
+    db = SessionLocal()
+    try:
+        importer = AttemptImporter(db, chunk_size=args.chunk_size, progress=print_progress)
+        with open(args.path, "rb") as source:
+            report = importer.run(source, fmt, total_bytes=os.path.getsize(args.path))
+        
+        errors = report.pop("errors")
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        for error in errors[:args.errors]:
+            print(f"  строка {error['line']}: {error['error']}")
+        if len(errors) > args.errors:
+            print(f"  ... и еще {report['failed'] - args.errors}")
+        if report["bkt_jobs"]:
+            print(f"Задач BKT в очереди: {len(report['bkt_jobs'])} (выполнит воркер приложения или run_bkt_jobs.py)")
+        print("✅ Готово")
+    except Exception as e:
+        print(f"❌ Ошибка импорта: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
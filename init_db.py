@@ -1,7 +1,7 @@
 import logging
 from app.database import engine
 from app.models.db_models import Base
-from sqlalchemy import inspect
+from sqlalchemy import inspect, text
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +22,23 @@ def init_database():
         Base.metadata.create_all(bind=engine)
         logger.info("✅ Таблицы успешно созданы/обновлены")
         
+        # create_all не добавляет новые столбцы и индексы к уже существующим таблицам
+        inspector = inspect(engine)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"✅ Добавлен столбец {table.name}.{column.name}")
+        
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        logger.info("✅ Индексы проверены")
+        
         # Проверяем созданные таблицы
         inspector = inspect(engine)
         new_tables = inspector.get_table_names()
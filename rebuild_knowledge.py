@@ -0,0 +1,50 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+from app.database import SessionLocal
+from app.services.attempt_log import AttemptLog
+from app.services.knowledge_rebuild import KnowledgeRebuilder, REBUILD_CHUNK_SIZE
+
+STAGES = {"load": "Чтение попыток", "replay": "Пересчет шардов", "write": "Запись"}
+
+def print_progress(stage: str, done: int, total: int):
+    percent = (done / total * 100) if total else 100.0
+    sys.stdout.write(f"\r{STAGES.get(stage, stage)}: {done}/{total} ({percent:.1f}%)")
+    if done >= total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+def main():
+    """Полный пересчет состояний знаний по всем попыткам"""
+    parser = argparse.ArgumentParser(description="Пересчет student_knowledge_states с нуля")
+    parser.add_argument("--dry-run", action="store_true", help="только показать расхождения, не записывать")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию - число CPU)")
+    parser.add_argument("--chunk-size", type=int, default=REBUILD_CHUNK_SIZE, help="размер пачки чтения и записи")
+    parser.add_argument("--from-log", type=Path, default=None, help="читать попытки из колоночного журнала (каталог)")
+    args = parser.parse_args()
+    
+    print("="*50)
+    print("ПЕРЕСЧЕТ СОСТОЯНИЙ ЗНАНИЙ" + (" (DRY RUN)" if args.dry_run else ""))
+    print("="*50)
+    
+    db = SessionLocal()
+    try:
+        rebuilder = KnowledgeRebuilder(
+            db,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            progress=print_progress,
+            attempt_log=AttemptLog(args.from_log) if args.from_log else None
+        )
+        report = rebuilder.run(dry_run=args.dry_run)
+        print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+        print("✅ Готово")
+    except Exception as e:
+        print(f"❌ Ошибка пересчета: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import argparse
+import time
+from app.services.bkt_jobs import process_pending_jobs
+from app.config import BKT_JOB_POLL_SECONDS
+
+def main():
+    """Обработка очереди bkt_jobs отдельным процессом (при BKT_JOB_WORKER_ENABLED=0 или для cron)"""
+    parser = argparse.ArgumentParser(description="Обработка задач очереди BKT")
+    parser.add_argument("--loop", action="store_true", help="не завершаться, опрашивать очередь")
+    parser.add_argument("--limit", type=int, default=None, help="не больше стольких задач за проход")
+    args = parser.parse_args()
+    
+    while True:
+        processed = process_pending_jobs("cli", args.limit)
+        if processed or not args.loop:
+            print(f"✅ Выполнено задач: {processed}")
+        if not args.loop:
+            break
+        time.sleep(BKT_JOB_POLL_SECONDS)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
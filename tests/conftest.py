@@ -0,0 +1,84 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Настройки читаются при импорте app, поэтому окружение задается до него:
+# отдельная база SQLite и каталоги данных, без фоновых потоков приложения
+_tmp_dir = tempfile.mkdtemp(prefix="bkt-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.setdefault("SECRET_KEY", "test-secret-key-0123456789abcdef0123456789")
+os.environ["SNAPSHOT_BUILDER_ENABLED"] = "0"
+os.environ["BKT_JOB_WORKER_ENABLED"] = "0"
+os.environ["KNOWLEDGE_MATRIX_ENABLED"] = "0"
+os.environ["KNOWLEDGE_MATRIX_DIR"] = os.path.join(_tmp_dir, "knowledge_matrix")
+os.environ["ATTEMPT_LOG_DIR"] = os.path.join(_tmp_dir, "attempt_log")
+
+from app.database import Base, SessionLocal, engine
+from app.models.db_models import Skill, Student
+
+@pytest.fixture(scope="session", autouse=True)
+def app_workdir():
+    """app.main открывает app/static и app/templates относительно рабочего каталога"""
+    app_dir = Path(_tmp_dir) / "app"
+    (app_dir / "static").mkdir(parents=True, exist_ok=True)
+    if not (app_dir / "templates").exists():
+        (app_dir / "templates").symlink_to(Path(__file__).resolve().parent.parent / "app" / "templates")
+    
+    cwd = os.getcwd()
+    os.chdir(_tmp_dir)
+    yield
+    os.chdir(cwd)
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    Base.metadata.create_all(bind=engine)
+    yield
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def students(db):
+    rows = [Student(name=f"Ученик {i}", class_name="7А") for i in range(1, 7)]
+    db.add_all(rows)
+    db.commit()
+    return [s.id for s in rows]
+
+@pytest.fixture
+def skills(db):
+    rows = [
+        Skill(name="Дроби", p_learn=0.15, p_guess=0.20, p_slip=0.10, p_init=0.20),
+        Skill(name="Уравнения", p_learn=0.30, p_guess=0.25, p_slip=0.05, p_init=0.35),
+        Skill(name="Проценты", p_learn=0.05, p_guess=0.10, p_slip=0.20, p_init=0.10)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return [s.id for s in rows]
+
+def random_attempts(student_ids, skill_ids, count, seed=0):
+    """Попытки (student_id, skill_id, is_correct, attempt_date) за последние два месяца по времени"""
+    rng = np.random.default_rng(seed)
+    start = datetime.now().replace(microsecond=0) - timedelta(days=60)
+    offsets = np.sort(rng.integers(0, 60 * 24 * 3600, size=count))
+    return [
+        (
+            int(rng.choice(student_ids)),
+            int(rng.choice(skill_ids)),
+            bool(rng.random() < 0.6),
+            start + timedelta(seconds=int(offset))
+        )
+        for offset in offsets
+    ]
\ No newline at end of file
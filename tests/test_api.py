@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth import create_access_token, get_password_hash
+from app.models.db_models import Test, User
+
+@pytest.fixture
+def client(db):
+    from app.main import app
+    
+    db.add(User(username="teacher", password_hash=get_password_hash("secret"), role="teacher"))
+    db.commit()
+    
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'teacher'})}"
+    return client
+
+def test_tests_list_pages_by_keyset_cursor(client, db):
+    # Одинаковые даты: порядок внутри дня задает id
+    dates = [datetime(2026, 9, day) for day in (1, 2, 2, 2, 3, 4, 4)]
+    tests = [Test(test_date=test_date) for test_date in dates]
+    db.add_all(tests)
+    db.commit()
+    expected = [test.id for test in sorted(tests, key=lambda test: (test.test_date, test.id), reverse=True)]
+    
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/tests/api/list", params=params).json()
+        ids.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    
+    assert ids == expected
+    assert client.get("/tests/api/list", params={"cursor": "не курсор"}).status_code == 400
+
+def test_mastery_etag_revalidates_until_data_changes(client, students, skills):
+    response = client.get("/students/api/mastery")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    
+    response = client.get("/students/api/mastery", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    
+    assert client.post("/students/api", json={"name": "Новый ученик", "class_name": "7А"}).status_code == 200
+    response = client.get("/students/api/mastery", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()["students"]) == len(students) + 1
\ No newline at end of file
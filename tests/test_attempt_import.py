@@ -0,0 +1,51 @@
+import io
+
+from app.models.db_models import BKTJob, StudentAttempt, StudentKnowledgeState
+from app.services.attempt_import import AttemptImporter
+from app.services.bkt_jobs import JOB_FINISHED, JOB_QUEUED, process_pending_jobs
+from test_bkt_engine import save_test
+
+def gradebook(rows):
+    lines = ["student_id,test_id,item_order,is_correct"]
+    lines += [f"{student_id},{test_id},{item_order},{int(is_correct)}" for student_id, test_id, item_order, is_correct in rows]
+    return io.BytesIO("\n".join(lines).encode("utf-8"))
+
+def test_import_queues_one_job_per_test(db, students, skills):
+    first_test, _ = save_test(db, [], skills)
+    second_test, _ = save_test(db, [], skills)
+    rows = [
+        (student_id, test_id, order, (student_id + order) % 2 == 0)
+        for test_id in (first_test, second_test)
+        for student_id in students
+        for order in range(1, len(skills) + 1)
+    ]
+    
+    report = AttemptImporter(db, chunk_size=4).run(gradebook(rows), "csv")
+    
+    assert report["imported"] == len(rows)
+    assert db.query(StudentAttempt).count() == len(rows)
+    assert db.query(StudentKnowledgeState).count() == 0
+    
+    jobs = db.query(BKTJob).order_by(BKTJob.id).all()
+    assert report["bkt_jobs"] == [job.id for job in jobs]
+    assert sorted(job.test_id for job in jobs) == [first_test, second_test]
+    assert {job.state for job in jobs} == {JOB_QUEUED}
+    
+    assert process_pending_jobs("test") == 2
+    db.expire_all()
+    assert {job.state for job in db.query(BKTJob)} == {JOB_FINISHED}
+    assert db.query(StudentKnowledgeState).count() == len(students) * len(skills)
+
+def test_import_requeues_test_whose_job_already_ran(db, students, skills):
+    test_id, _ = save_test(db, [], skills[:1])
+    rows = [(student_id, test_id, 1, True) for student_id in students]
+    processed = []
+    
+    def run_queue_between_chunks(stage, done, total):
+        processed.append(process_pending_jobs("test"))
+    
+    report = AttemptImporter(db, chunk_size=3, progress=run_queue_between_chunks).run(gradebook(rows), "csv")
+    
+    assert len(report["bkt_jobs"]) == 2
+    assert processed == [1, 1]
+    assert db.query(StudentKnowledgeState).count() == len(students)
\ No newline at end of file
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.models.db_models import StudentAttempt, Test, TestItem
+from app.services.attempt_log import AttemptLog
+from app.services.knowledge_rebuild import load_attempt_arrays
+from conftest import random_attempts
+
+@pytest.fixture
+def attempt_log(tmp_path):
+    return AttemptLog(tmp_path / "attempt_log")
+
+def save_attempts(db, attempts, seed=0):
+    """
+    Попытки в отдельном тесте, по заданию на попытку, в перемешанном порядке:
+    id не совпадает с хронологией. Одно задание без навыка.
+    """
+    test = Test(test_date=datetime.now())
+    db.add(test)
+    db.flush()
+    order = np.random.default_rng(seed).permutation(len(attempts))
+    for position, index in enumerate(order, 1):
+        student_id, skill_id, is_correct, created_at = attempts[index]
+        item = TestItem(test_id=test.id, item_order=position, skill_id=skill_id)
+        db.add(item)
+        db.flush()
+        db.add(StudentAttempt(student_id=student_id, test_item_id=item.id, is_correct=is_correct, created_at=created_at))
+    
+    item = TestItem(test_id=test.id, item_order=len(attempts) + 1, skill_id=None)
+    db.add(item)
+    db.flush()
+    db.add(StudentAttempt(student_id=attempts[0][0], test_item_id=item.id, is_correct=True, created_at=attempts[0][3]))
+    db.commit()
+
+def assert_same_arrays(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key in expected:
+        assert actual[key].dtype == expected[key].dtype
+        np.testing.assert_array_equal(actual[key], expected[key])
+
+def test_export_round_trip_matches_database(db, students, skills, attempt_log):
+    save_attempts(db, random_attempts(students, skills, 37, seed=4))
+    
+    # Пачки по 5: последний байт битовой колонки каждый раз неполный
+    assert attempt_log.export(db, chunk_size=5) == 38
+    assert attempt_log.manifest()["count"] == 38
+    assert_same_arrays(load_attempt_arrays(db), attempt_log.to_attempt_arrays())
+    
+    save_attempts(db, random_attempts(students, skills, 11, seed=5), seed=1)
+    assert attempt_log.export(db, chunk_size=5) == 12
+    assert attempt_log.export(db, chunk_size=5) == 0
+    assert_same_arrays(load_attempt_arrays(db), attempt_log.to_attempt_arrays())
+    assert_same_arrays(
+        load_attempt_arrays(db, skill_ids=skills[:1]),
+        attempt_log.to_attempt_arrays(skill_ids=skills[:1])
+    )
+
+def test_export_drops_tail_written_before_crash(db, students, skills, attempt_log):
+    save_attempts(db, random_attempts(students, skills, 13, seed=6))
+    attempt_log.export(db, chunk_size=5)
+    count = attempt_log.manifest()["count"]
+    
+    # Сбой после дописывания пачки, но до записи манифеста
+    garbage = {
+        "attempt_id": np.arange(1000, 1007), "student_id": np.full(7, 999), "skill_id": np.full(7, skills[0]),
+        "test_id": np.full(7, 999), "timestamp_us": np.zeros(7, dtype=np.int64), "correct": np.ones(7, dtype=bool)
+    }
+    attempt_log.append(garbage, count)
+    assert attempt_log.manifest()["count"] == count
+    
+    save_attempts(db, random_attempts(students, skills, 9, seed=7), seed=2)
+    attempt_log.export(db, chunk_size=4)
+    
+    columns = attempt_log.load(mmap=False)
+    assert all(len(values) == count + 10 for values in columns.values())
+    assert 999 not in columns["student_id"]
+    assert_same_arrays(load_attempt_arrays(db), attempt_log.to_attempt_arrays())
\ No newline at end of file
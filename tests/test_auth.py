@@ -0,0 +1,53 @@
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app.auth import create_refresh_token, get_password_hash, verify_password
+from app.config import ALGORITHM, SECRET_KEY
+from app.models.db_models import User
+
+@pytest.fixture
+def client():
+    from app.main import app
+    
+    return TestClient(app)
+
+def test_long_passwords_differing_after_50_characters_do_not_match():
+    password = "a" * 50 + "правильный"
+    hashed = get_password_hash(password)
+    
+    assert verify_password(password, hashed)
+    assert not verify_password("a" * 50 + "неверный", hashed)
+
+def test_password_is_truncated_by_utf8_bytes():
+    password = "пароль" * 12
+    hashed = get_password_hash(password)
+    
+    assert len(password.encode("utf-8")) > 72
+    assert verify_password(password, hashed)
+    assert verify_password(password[:36], hashed)
+    assert not verify_password(password[:35], hashed)
+
+def test_register_rejects_password_longer_than_72_bytes(client):
+    response = client.post("/api/auth/register", json={"username": "long", "password": "я" * 37})
+    assert response.status_code == 422
+    
+    response = client.post("/api/auth/register", json={"username": "short", "password": "я" * 36})
+    assert response.status_code == 200
+
+def test_refresh_issues_access_token_and_refuses_inactive_user(client, db):
+    db.add_all([
+        User(username="teacher", password_hash=get_password_hash("secret"), role="teacher"),
+        User(username="former", password_hash=get_password_hash("secret"), role="teacher", is_active=False)
+    ])
+    db.commit()
+    
+    login = client.post("/api/auth/login", data={"username": "teacher", "password": "secret"}).json()
+    assert "jti" not in jwt.decode(login["refresh_token"], SECRET_KEY, algorithms=[ALGORITHM])
+    
+    response = client.post("/api/auth/refresh", json={"refresh_token": login["refresh_token"]})
+    assert response.status_code == 200
+    assert response.json()["access_token"]
+    
+    response = client.post("/api/auth/refresh", json={"refresh_token": create_refresh_token("former")})
+    assert response.status_code == 400
\ No newline at end of file
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.models.db_models import (
+    KnowledgeHistory, MasterySnapshot, Student, StudentAttempt, StudentKnowledgeState, Test, TestItem,
+    TestProcessingState
+)
+from app.services import bkt_engine
+from app.services.bkt_engine import (
+    BKTEngine, insert_knowledge_history, shutdown_shard_pool, upsert_knowledge_states
+)
+from conftest import random_attempts
+
+def knowledge_states(db):
+    rows = db.execute(select(
+        StudentKnowledgeState.student_id,
+        StudentKnowledgeState.skill_id,
+        StudentKnowledgeState.probability_knowing,
+        StudentKnowledgeState.total_attempts,
+        StudentKnowledgeState.correct_attempts,
+        StudentKnowledgeState.last_updated
+    )).all()
+    return {(r[0], r[1]): tuple(r[2:]) for r in rows}
+
+def knowledge_history(db):
+    return db.execute(select(
+        KnowledgeHistory.student_id,
+        KnowledgeHistory.skill_id,
+        KnowledgeHistory.recorded_at,
+        KnowledgeHistory.probability
+    ).order_by(
+        KnowledgeHistory.student_id,
+        KnowledgeHistory.skill_id,
+        KnowledgeHistory.recorded_at,
+        KnowledgeHistory.id
+    )).all()
+
+def save_test(db, students, skills):
+    """Тест с заданием на каждый навык и ответами всех учеников"""
+    test = Test(test_date=datetime.now())
+    db.add(test)
+    db.flush()
+    items = [TestItem(test_id=test.id, item_order=order, skill_id=skill_id) for order, skill_id in enumerate(skills, 1)]
+    db.add_all(items)
+    db.flush()
+    db.add_all(
+        StudentAttempt(student_id=student_id, test_item_id=item.id, is_correct=(student_id + item.item_order) % 2 == 0)
+        for student_id in students
+        for item in items
+    )
+    db.commit()
+    return test.id, [item.id for item in items]
+
+def clear_knowledge(db):
+    db.query(KnowledgeHistory).delete()
+    db.query(StudentKnowledgeState).delete()
+    db.commit()
+
+def assert_same_knowledge(expected_states, expected_history, states, history):
+    assert states.keys() == expected_states.keys()
+    for key, (probability, total, correct, last_updated) in expected_states.items():
+        assert states[key][0] == pytest.approx(probability, abs=1e-9)
+        assert states[key][1:] == (total, correct, last_updated)
+    
+    assert len(history) == len(expected_history)
+    for row, expected in zip(history, expected_history):
+        assert row[:3] == expected[:3]
+        assert row[3] == pytest.approx(expected[3], abs=1e-9)
+
+def test_upsert_adds_attempt_counts_and_replaces_probability(db, students, skills):
+    first = datetime(2026, 9, 1, 10, 0)
+    second = datetime(2026, 9, 2, 10, 0)
+    upsert_knowledge_states(db, [
+        {"student_id": students[0], "skill_id": skills[0], "probability_knowing": 0.4,
+         "total_attempts": 3, "correct_attempts": 2, "last_updated": first}
+    ])
+    db.commit()
+    
+    # В одном вызове и существующая, и новая строка
+    upsert_knowledge_states(db, [
+        {"student_id": students[0], "skill_id": skills[0], "probability_knowing": 0.7,
+         "total_attempts": 2, "correct_attempts": 1, "last_updated": second},
+        {"student_id": students[1], "skill_id": skills[0], "probability_knowing": 0.3,
+         "total_attempts": 1, "correct_attempts": 0, "last_updated": second}
+    ])
+    db.commit()
+    
+    assert knowledge_states(db) == {
+        (students[0], skills[0]): (pytest.approx(0.7), 5, 3, second),
+        (students[1], skills[0]): (pytest.approx(0.3), 1, 0, second)
+    }
+
+def test_history_insert_invalidates_snapshots_from_first_recorded_day(db, students, skills):
+    today = datetime(2026, 9, 10, 12, 0)
+    db.add_all(
+        MasterySnapshot(snapshot_date=(today - timedelta(days=days)).date(), student_id=students[0], states=b"")
+        for days in range(4)
+    )
+    db.commit()
+    
+    insert_knowledge_history(db, [
+        {"student_id": students[0], "skill_id": skills[0], "probability": 0.5, "recorded_at": today - timedelta(days=1)},
+        {"student_id": students[0], "skill_id": skills[0], "probability": 0.6, "recorded_at": today}
+    ])
+    db.commit()
+    
+    remaining = db.execute(select(MasterySnapshot.snapshot_date).order_by(MasterySnapshot.snapshot_date)).scalars().all()
+    assert remaining == [(today - timedelta(days=3)).date(), (today - timedelta(days=2)).date()]
+
+def test_batch_update_matches_scalar_updates(db, students, skills):
+    attempts = random_attempts(students, skills, 300)
+    
+    engine = BKTEngine(db, shards=1)
+    for attempt in attempts:
+        engine.update_from_attempt(*attempt)
+    scalar_states, scalar_history = knowledge_states(db), knowledge_history(db)
+    
+    clear_knowledge(db)
+    BKTEngine(db, shards=1).update_from_attempts_batch(attempts)
+    
+    assert_same_knowledge(scalar_states, scalar_history, knowledge_states(db), knowledge_history(db))
+
+def test_batch_update_continues_from_existing_states(db, students, skills):
+    attempts = random_attempts(students, skills, 200, seed=1)
+    first, second = attempts[:120], attempts[120:]
+    
+    engine = BKTEngine(db, shards=1)
+    for attempt in attempts:
+        engine.update_from_attempt(*attempt)
+    scalar_states, scalar_history = knowledge_states(db), knowledge_history(db)
+    
+    clear_knowledge(db)
+    engine = BKTEngine(db, shards=1)
+    engine.update_from_attempts_batch(first)
+    engine.update_from_attempts_batch(second)
+    
+    assert_same_knowledge(scalar_states, scalar_history, knowledge_states(db), knowledge_history(db))
+
+@pytest.fixture
+def shard_pool():
+    yield
+    shutdown_shard_pool()
+
+def test_sharded_replay_matches_serial_replay(db, students, skills, monkeypatch, shard_pool):
+    BKTEngine(db, shards=1).update_from_attempts_batch(random_attempts(students, skills, 150, seed=2))
+    attempts = random_attempts(students, skills, 400, seed=3)
+    now = datetime.now()
+    monkeypatch.setattr(bkt_engine, "BKT_PARALLEL_MIN_ATTEMPTS", 1)
+    
+    serial_states, serial_history, serial_path = BKTEngine(db, shards=1)._replay_batch(attempts, now)
+    sharded_states, sharded_history, sharded_path = BKTEngine(db, shards=3)._replay_batch(attempts, now)
+    
+    assert (serial_path, sharded_path) == ("batch", "parallel")
+    assert sharded_states == serial_states
+    assert sharded_history == serial_history
+
+def test_process_test_results_applies_only_new_attempts(db, students, skills):
+    test_id, item_ids = save_test(db, students, skills)
+    engine = BKTEngine(db, shards=1)
+    
+    assert engine.process_test_results(test_id) == len(students) * len(skills)
+    assert engine.process_test_results(test_id) == 0
+    
+    latecomer = Student(name="Опоздавший")
+    db.add(latecomer)
+    db.flush()
+    db.add_all(StudentAttempt(student_id=latecomer.id, test_item_id=item_id, is_correct=True) for item_id in item_ids)
+    db.commit()
+    assert engine.process_test_results(test_id) == len(skills)
+    
+    states = knowledge_states(db)
+    assert len(states) == (len(students) + 1) * len(skills)
+    assert {state[1] for state in states.values()} == {1}
+    assert db.get(TestProcessingState, test_id).processed_attempts == (len(students) + 1) * len(skills)
+
+def test_failed_processing_rolls_back_states_and_watermark(db, students, skills, monkeypatch):
+    test_id, _ = save_test(db, students, skills)
+    
+    def fail(db, rows):
+        raise RuntimeError("история не записана")
+    
+    monkeypatch.setattr(bkt_engine, "insert_knowledge_history", fail)
+    with pytest.raises(RuntimeError):
+        BKTEngine(db, shards=1).process_test_results(test_id)
+    
+    assert knowledge_states(db) == {}
+    assert db.get(TestProcessingState, test_id) is None
+    
+    monkeypatch.undo()
+    assert BKTEngine(db, shards=1).process_test_results(test_id) == len(students) * len(skills)
\ No newline at end of file
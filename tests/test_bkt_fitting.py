@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from app.services.bkt_fitting import build_sequences, fit_sequences, forward_backward
+
+TRUE_PARAMS = {"p_init": 0.3, "p_learn": 0.2, "p_guess": 0.15, "p_slip": 0.1}
+
+def simulate(students, steps, p_init, p_learn, p_guess, p_slip, seed=0):
+    """Ответы учеников по модели BKT: строка - ученик, столбец - шаг"""
+    rng = np.random.default_rng(seed)
+    known = rng.random(students) < p_init
+    outcomes = np.empty((students, steps), dtype=bool)
+    for t in range(steps):
+        outcomes[:, t] = np.where(known, rng.random(students) >= p_slip, rng.random(students) < p_guess)
+        known |= rng.random(students) < p_learn
+    return outcomes
+
+def test_em_recovers_simulated_parameters():
+    outcomes = simulate(3000, 12, **TRUE_PARAMS)
+    mask = np.ones(outcomes.shape, dtype=bool)
+    
+    result = fit_sequences(outcomes, mask, (0.5, 0.1, 0.3, 0.3), max_iter=300)
+    
+    for name, value in TRUE_PARAMS.items():
+        assert result[name] == pytest.approx(value, abs=0.03)
+    _, _, true_likelihood = forward_backward(outcomes, mask, *TRUE_PARAMS.values())
+    assert result["log_likelihood"] >= true_likelihood
+
+def test_padding_steps_do_not_change_likelihood():
+    outcomes = simulate(200, 6, **TRUE_PARAMS, seed=1)
+    mask = np.ones(outcomes.shape, dtype=bool)
+    padded_outcomes = np.pad(outcomes, ((0, 0), (0, 4)))
+    padded_mask = np.pad(mask, ((0, 0), (0, 4)))
+    
+    _, _, likelihood = forward_backward(outcomes, mask, *TRUE_PARAMS.values())
+    _, _, padded_likelihood = forward_backward(padded_outcomes, padded_mask, *TRUE_PARAMS.values())
+    assert padded_likelihood == pytest.approx(likelihood)
+
+def test_build_sequences_aligns_attempts_by_time():
+    student_ids = np.array([7, 3, 7, 3, 7])
+    is_correct = np.array([True, False, False, True, True])
+    timestamps_us = np.array([30, 20, 10, 10, 20], dtype=np.int64)
+    
+    outcomes, mask = build_sequences(student_ids, is_correct, timestamps_us)
+    
+    np.testing.assert_array_equal(mask, [[True, True, False], [True, True, True]])
+    np.testing.assert_array_equal(outcomes, [[True, False, False], [False, True, True]])
\ No newline at end of file
@@ -0,0 +1,77 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth import create_access_token, get_password_hash
+from app.models.db_models import StudentKnowledgeState, User
+from app.services import bkt_jobs
+from app.services.bkt_engine import BKTEngine
+from app.services.bkt_jobs import JOB_FINISHED, JOB_LEASE, JOB_QUEUED, process_pending_jobs
+from app.services.leases import acquire_lease, release_lease
+
+@pytest.fixture
+def client(db):
+    from app.main import app
+    
+    db.add(User(username="teacher", password_hash=get_password_hash("secret"), role="teacher"))
+    db.commit()
+    
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {create_access_token({'sub': 'teacher'})}"
+    return client
+
+def save_results(client, students, skills):
+    test_id = client.post("/tests/api/create", json={"items": skills}).json()["test_id"]
+    results = {
+        str(student_id): {str(order): (student_id + order) % 2 == 0 for order in range(1, len(skills) + 1)}
+        for student_id in students
+    }
+    return client.post("/tests/api/save-results", json={"test_id": test_id, "results": results})
+
+def test_saved_results_are_processed_by_job(client, db, students, skills):
+    response = save_results(client, students, skills)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    
+    status = client.get(f"/tests/api/jobs/{job_id}").json()
+    assert status["state"] == JOB_QUEUED
+    assert db.query(StudentKnowledgeState).count() == 0
+    
+    assert process_pending_jobs("test") == 1
+    
+    attempts = len(students) * len(skills)
+    status = client.get(f"/tests/api/jobs/{job_id}").json()
+    assert status["state"] == JOB_FINISHED
+    assert status["updated_count"] == attempts
+    assert status["progress"] == {"done": attempts, "total": attempts}
+    assert db.query(StudentKnowledgeState).count() == attempts
+
+def test_jobs_wait_for_queue_lease(client, students, skills):
+    job_id = save_results(client, students, skills).json()["job_id"]
+    
+    assert acquire_lease(JOB_LEASE, 60, owner="other-process")
+    assert process_pending_jobs("test") == 0
+    assert client.get(f"/tests/api/jobs/{job_id}").json()["state"] == JOB_QUEUED
+    
+    release_lease(JOB_LEASE, owner="other-process")
+    assert process_pending_jobs("test") == 1
+    assert client.get(f"/tests/api/jobs/{job_id}").json()["state"] == JOB_FINISHED
+
+def test_job_reports_progress_after_each_chunk(client, db, students, skills, monkeypatch):
+    job_id = save_results(client, students, skills).json()["job_id"]
+    reported = []
+    process = BKTEngine.process_test_results
+    
+    def recording_process(engine, test_id, chunk_size=None, progress=None):
+        def record(done):
+            progress(done)
+            reported.append(client.get(f"/tests/api/jobs/{job_id}").json()["progress"])
+        return process(engine, test_id, chunk_size, record)
+    
+    monkeypatch.setattr(bkt_jobs, "BKT_JOB_CHUNK_SIZE", 5)
+    monkeypatch.setattr(BKTEngine, "process_test_results", recording_process)
+    assert process_pending_jobs("test") == 1
+    
+    attempts = len(students) * len(skills)
+    assert [p["done"] for p in reported] == [5, 10, 15, attempts]
+    assert {p["total"] for p in reported} == {attempts}
+    assert db.query(StudentKnowledgeState).count() == attempts
\ No newline at end of file
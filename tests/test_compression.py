@@ -0,0 +1,43 @@
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.services.compression import CompressionMiddleware
+
+ETAG = '"v1-abc"'
+BODY = b'{"mastery": [' + b"0.5, " * 2000 + b"0.5]}"
+
+def mastery(request):
+    if request.headers.get("if-none-match"):
+        return Response(status_code=304, headers={"ETag": ETAG})
+    return Response(BODY, media_type="application/json", headers={"ETag": ETAG})
+
+def make_client():
+    app = Starlette(routes=[Route("/mastery", mastery)])
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+def test_compressed_response_has_weak_etag():
+    response = make_client().get("/mastery", headers={"Accept-Encoding": "gzip"})
+    
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == f"W/{ETAG}"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.content == BODY
+
+def test_identity_response_keeps_strong_etag():
+    response = make_client().get("/mastery", headers={"Accept-Encoding": "identity"})
+    
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == ETAG
+
+def test_not_modified_uses_weak_etag_when_compression_is_negotiated():
+    client = make_client()
+    
+    response = client.get("/mastery", headers={"Accept-Encoding": "gzip", "If-None-Match": f"W/{ETAG}"})
+    assert response.status_code == 304
+    assert response.headers["etag"] == f"W/{ETAG}"
+    
+    response = client.get("/mastery", headers={"Accept-Encoding": "identity", "If-None-Match": ETAG})
+    assert response.headers["etag"] == ETAG
\ No newline at end of file
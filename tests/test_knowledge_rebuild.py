@@ -0,0 +1,56 @@
+import pytest
+
+from app.services.bkt_engine import BKTEngine
+from app.services.bkt_jobs import JOB_PAUSE_LEASE, JOB_RUNNING, new_job, pause_jobs, process_pending_jobs, resume_jobs
+from app.services.knowledge_rebuild import KnowledgeRebuilder
+from app.services.leases import acquire_lease, release_lease
+from test_bkt_engine import knowledge_states, save_test
+
+def test_rebuild_matches_processing_on_the_day_of_the_test(db, students, skills):
+    test_id, _ = save_test(db, students, skills)
+    BKTEngine(db, shards=1).process_test_results(test_id)
+    live = knowledge_states(db)
+    
+    report = KnowledgeRebuilder(db, workers=1).run(dry_run=True)
+    assert report["diff"]["changed_pairs"] == 0
+    assert report["diff"]["new_pairs"] == report["diff"]["removed_pairs"] == 0
+    
+    KnowledgeRebuilder(db, workers=1).run()
+    db.expire_all()
+    rebuilt = knowledge_states(db)
+    assert rebuilt.keys() == live.keys()
+    for key, state in live.items():
+        assert rebuilt[key][0] == pytest.approx(state[0], abs=1e-9)
+        assert rebuilt[key][1:3] == state[1:3]
+
+def test_paused_queue_does_not_claim_jobs(db, students, skills):
+    test_id, _ = save_test(db, students, skills)
+    db.add(new_job(test_id))
+    db.commit()
+    
+    assert pause_jobs("rebuild", 60, timeout=0)
+    assert process_pending_jobs("test") == 0
+    resume_jobs("rebuild")
+    assert process_pending_jobs("test") == 1
+
+def test_pause_waits_for_running_jobs(db, students, skills):
+    test_id, _ = save_test(db, students, skills)
+    job = new_job(test_id)
+    job.state = JOB_RUNNING
+    job.started_at = job.created_at
+    db.add(job)
+    db.commit()
+    
+    assert not pause_jobs("rebuild", 60, timeout=0)
+    # Неудачная пауза снимается, другой владелец может ее взять
+    assert acquire_lease(JOB_PAUSE_LEASE, 60, "other")
+    release_lease(JOB_PAUSE_LEASE, "other")
+
+def test_rebuild_refuses_while_queue_is_paused_elsewhere(db, students, skills):
+    save_test(db, students, skills)
+    assert acquire_lease(JOB_PAUSE_LEASE, 60, "other-rebuild")
+    
+    with pytest.raises(RuntimeError):
+        KnowledgeRebuilder(db, workers=1).run()
+    
+    release_lease(JOB_PAUSE_LEASE, "other-rebuild")
\ No newline at end of file